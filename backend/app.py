@@ -2,7 +2,8 @@
 Flask API backend for Hebrew Font Maker
 """
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, g
+from werkzeug.local import LocalProxy
 try:
     from flask_cors import CORS
 except ImportError:
@@ -16,8 +17,10 @@ import sys
 import base64
 import cv2
 import numpy as np
+import time
 import threading
 import webbrowser
+from functools import partial
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
@@ -27,14 +30,58 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 try:
     from config import Config
     from backend.image_processor import LetterDetector, GlyphExtractor
-    from backend.font_generator import FontCreator
+    from backend.font_generator import FontCreator, GlyphMetricsPreview
     from backend.hebrew_support import HebrewReader, HEBREW_LETTERS
+    from backend.thumbnails import (
+        ThumbnailCache, AtlasPacker, THUMB_FORMATS, image_content_id, crop_url, crop_etag,
+        atlas_url
+    )
+    from backend.family_builder import (
+        add_assigned_glyphs, extract_job_contours, session_glyph_jobs, ContourCache,
+        build_font_family, family_archive, DEFAULT_VARIANTS
+    )
+    from backend.session_store import SessionStore, LazyArray, valid_session_id, new_session_id
+    from backend.jobs import JobQueue, FINISHED_STATES, CANCELLED
+    from backend.project_file import ProjectFile, write_project, SUPPORTED_VERSIONS
+    from backend.session_journal import SessionJournal, letter_record
+    from backend.detection_cache import DetectionCache, content_hash, file_hash, load_entry_binary
+    from backend.storage_manager import StorageManager
+    from backend.metrics import MetricsRegistry, install_metrics
+    from backend.compression import CompressionCache, install_compression, precompress_folder
+    from backend.fast_json import FastJSONProvider
+    from backend.detection_matching import (
+        bbox_iou, match_boxes, carry_assignments, carry_verified_glyphs, MIN_IOU
+    )
+    from backend.component_labels import ComponentLabels
+    from backend.tile_pyramid import TilePyramidCache, pyramid_levels, tile_etag, valid_image_id
 except ImportError:
     # Fallback for direct execution
     from config import Config
     from image_processor import LetterDetector, GlyphExtractor
-    from font_generator import FontCreator
+    from font_generator import FontCreator, GlyphMetricsPreview
     from hebrew_support import HebrewReader, HEBREW_LETTERS
+    from thumbnails import (
+        ThumbnailCache, AtlasPacker, THUMB_FORMATS, image_content_id, crop_url, crop_etag,
+        atlas_url
+    )
+    from family_builder import (
+        add_assigned_glyphs, extract_job_contours, session_glyph_jobs, ContourCache,
+        build_font_family, family_archive, DEFAULT_VARIANTS
+    )
+    from session_store import SessionStore, LazyArray, valid_session_id, new_session_id
+    from jobs import JobQueue, FINISHED_STATES, CANCELLED
+    from project_file import ProjectFile, write_project, SUPPORTED_VERSIONS
+    from session_journal import SessionJournal, letter_record
+    from detection_cache import DetectionCache, content_hash, file_hash, load_entry_binary
+    from storage_manager import StorageManager
+    from metrics import MetricsRegistry, install_metrics
+    from compression import CompressionCache, install_compression, precompress_folder
+    from fast_json import FastJSONProvider
+    from detection_matching import (
+        bbox_iou, match_boxes, carry_assignments, carry_verified_glyphs, MIN_IOU
+    )
+    from component_labels import ComponentLabels
+    from tile_pyramid import TilePyramidCache, pyramid_levels, tile_etag, valid_image_id
 
 # Resolve frontend directory path
 _project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,20 +90,182 @@ _frontend_dir = os.path.join(_project_root, 'frontend')
 app = Flask(__name__, static_folder=_frontend_dir, static_url_path='')
 CORS(app)
 app.config.from_object(Config)
+app.json = FastJSONProvider(app)  # numpy values can be returned as they are
 
 # Initialize processors
 letter_detector = LetterDetector()
 glyph_extractor = GlyphExtractor()
+thumbnail_cache = ThumbnailCache()
+atlas_packer = AtlasPacker()
 
-# Store current session data
-current_session = {
-    'upload_path': None,
-    'detected_letters': [],
-    'verified_glyphs': {},
-    'original_image': None,
-    'binary_image': None,
-    'processed_image': None
-}
+# Per-client sessions, keyed by the X-Session-Id header (one per browser tab)
+# or the session cookie
+session_store = SessionStore(
+    Config.SESSION_SPILL_FOLDER,
+    memory_cap_bytes=Config.SESSION_MEMORY_CAP_MB * 1024 * 1024,
+    idle_timeout=Config.SESSION_IDLE_TIMEOUT,
+    max_sessions=Config.MAX_SESSIONS,
+    shared=Config.SHARED_STATE,
+)
+
+# Detection results by upload content (persistent across restarts)
+detection_cache = DetectionCache(
+    Config.DETECTION_CACHE_FOLDER,
+    max_bytes=Config.DETECTION_CACHE_MAX_MB * 1024 * 1024,
+)
+
+# Deep-zoom tiles of the uploaded scans for the review canvas
+tile_pyramids = TilePyramidCache(
+    Config.TILE_FOLDER,
+    tile_size=Config.TILE_SIZE,
+    max_bytes=Config.TILE_CACHE_MAX_MB * 1024 * 1024,
+)
+
+# Append-only journal of session edits: autosave and crash recovery
+session_journal = SessionJournal(
+    Config.JOURNAL_FOLDER,
+    compact_bytes=Config.JOURNAL_COMPACT_BYTES,
+    retention=Config.JOURNAL_RETENTION,
+    load_image=letter_detector.load_image,
+    preprocess=letter_detector.preprocess_image,
+)
+
+# Quotas / age limits for uploads and generated files
+storage_manager = StorageManager(min_age=Config.STORAGE_MIN_AGE,
+                                 interval=Config.STORAGE_SWEEP_INTERVAL)
+storage_manager.add_area('uploads', Config.UPLOAD_FOLDER, ['upload_*', 'import_*'],
+                         max_bytes=Config.UPLOAD_QUOTA_MB * 1024 * 1024,
+                         max_age=Config.UPLOAD_MAX_AGE)
+storage_manager.add_area('fonts', Config.OUTPUT_FOLDER, ['*.ttf'],
+                         max_bytes=Config.OUTPUT_QUOTA_MB * 1024 * 1024,
+                         max_age=Config.OUTPUT_MAX_AGE)
+storage_manager.add_area('exports', Config.OUTPUT_FOLDER, ['*.hfm', '*.zip'],
+                         max_bytes=Config.OUTPUT_QUOTA_MB * 1024 * 1024,
+                         max_age=Config.EXPORT_MAX_AGE)
+
+def _session_files():
+    """Files the live sessions of this process use (never evicted)."""
+    for state in session_store.sessions():
+        yield dict.get(state, 'upload_path')
+        yield dict.get(state, 'binary_path')
+        yield dict.get(state, 'font_path')
+
+storage_manager.add_references(_session_files)
+storage_manager.start()
+
+# Request telemetry + component gauges at /api/metrics (Prometheus text format)
+metrics = MetricsRegistry(
+    prefix='hfm',
+    shared_dir=Config.METRICS_FOLDER if Config.SHARED_STATE else None,
+    flush_interval=Config.METRICS_FLUSH_INTERVAL,
+)
+
+def _collect_metrics():
+    """Samples of this process (summed over workers)."""
+    sessions = session_store.stats()
+    if not session_store.shared:
+        yield ('hfm_sessions', 'gauge', 'Sessions held in memory', {}, sessions['sessions'])
+    yield ('hfm_sessions_active', 'gauge', 'Sessions used by a running request', {},
+           sessions['active'])
+    yield ('hfm_session_memory_bytes', 'gauge', 'Image and contour bytes held by sessions', {},
+           sessions['memory_bytes'])
+    yield ('hfm_session_memory_cap_bytes', 'gauge', 'Session memory cap per process', {},
+           sessions['memory_cap_bytes'])
+    for event in ('spills', 'reloads', 'evictions'):
+        yield ('hfm_session_events_total', 'counter', 'Session spills to disk, reloads, evictions',
+               {'event': event}, sessions[event])
+
+    jobs = job_queue.stats()
+    for status in ('queued', 'running'):
+        yield ('hfm_jobs', 'gauge', 'Background jobs by state (queue depth)',
+               {'status': status}, jobs.get(status, 0))
+
+    thumbs = thumbnail_cache.stats()
+    compressed = compression_cache.stats()
+    for cache, stats in (('thumbnail', thumbs), ('compression', compressed)):
+        yield ('hfm_cache_bytes', 'gauge', 'Cache size', {'cache': cache}, stats['bytes'])
+        yield ('hfm_cache_entries', 'gauge', 'Cache entries', {'cache': cache}, stats['entries'])
+    for cache, hits, misses in (
+            ('thumbnail', thumbs['hits'], thumbs['misses']),
+            ('compression', compressed['hits'], compressed['misses']),
+            ('detection', detection_cache.hits, detection_cache.misses),
+            ('tile', tile_pyramids.hits, tile_pyramids.misses)):
+        for result, count in (('hit', hits), ('miss', misses)):
+            yield ('hfm_cache_lookups_total', 'counter', 'Cache lookups by result',
+                   {'cache': cache, 'result': result}, count)
+
+    journal = session_journal.stats()
+    yield ('hfm_journal_recoveries_total', 'counter', 'Sessions recovered from their journal', {},
+           journal['recoveries'])
+    for area, (_, removed_bytes) in storage_manager.removal_counts().items():
+        yield ('hfm_storage_removed_bytes_total', 'counter', 'Bytes removed by the storage sweeper',
+               {'area': area}, removed_bytes)
+
+def _collect_shared_metrics():
+    """Samples of the folders all workers share (disk caches, storage areas)."""
+    if session_store.shared:
+        yield ('hfm_sessions', 'gauge', 'Sessions held by the workers', {},
+               session_store.persisted_count())
+    for cache, stats in (('detection', detection_cache.stats()), ('tile', tile_pyramids.stats())):
+        yield ('hfm_cache_bytes', 'gauge', 'Cache size', {'cache': cache}, stats['bytes'])
+        yield ('hfm_cache_entries', 'gauge', 'Cache entries', {'cache': cache}, stats['entries'])
+    for area, stats in storage_manager.stats()['areas'].items():
+        yield ('hfm_storage_bytes', 'gauge', 'Bytes in a managed storage area', {'area': area},
+               stats['bytes'])
+
+metrics.add_collector(_collect_metrics)
+metrics.add_collector(_collect_shared_metrics, shared=True)
+install_metrics(app, metrics)
+
+# gzip / brotli for large JSON and the frontend files. Installed after the
+# metrics hook so response sizes are recorded as sent
+compression_cache = CompressionCache(max_bytes=Config.COMPRESSION_CACHE_MB * 1024 * 1024)
+precompress_folder(compression_cache, _frontend_dir, min_bytes=Config.COMPRESSION_MIN_BYTES)
+install_compression(app, compression_cache, min_bytes=Config.COMPRESSION_MIN_BYTES)
+
+def _request_session_id():
+    """Session id of the current request, or a new one."""
+    # ?session= is for clients that cannot set headers (EventSource)
+    sid = (request.headers.get('X-Session-Id') or request.args.get('session')
+           or request.cookies.get(Config.SESSION_COOKIE))
+    return sid if valid_session_id(sid) else new_session_id()
+
+def _get_current_session():
+    if 'session' not in g:
+        g.session_id = _request_session_id()
+        g.session = session_store.acquire(g.session_id)
+        if not g.session.get('upload_path'):
+            # Empty after a restart (or idle eviction): replay the journal
+            session_journal.recover(g.session)
+    return g.session
+
+# Session of the current request (a SessionState dict)
+current_session = LocalProxy(_get_current_session)
+
+# Worker pool for detection and font generation (?async=1 requests)
+job_queue = JobQueue(
+    max_workers=Config.JOB_WORKERS,
+    per_session=Config.JOBS_PER_SESSION,
+    result_ttl=Config.JOB_RESULT_TTL,
+    shared_dir=Config.JOB_FOLDER if Config.SHARED_STATE else None,
+)
+
+@app.after_request
+def _remember_session(response):
+    sid = g.get('session_id')
+    if sid:
+        response.headers['X-Session-Id'] = sid
+        # Tabs that send X-Session-Id keep their own session; the cookie
+        # covers clients that don't
+        if 'X-Session-Id' not in request.headers and request.cookies.get(Config.SESSION_COOKIE) != sid:
+            response.set_cookie(Config.SESSION_COOKIE, sid, httponly=True, samesite='Lax')
+    return response
+
+@app.teardown_request
+def _release_session(exc=None):
+    sid = g.pop('session_id', None)
+    if sid and g.pop('session', None) is not None:
+        session_store.release(sid, modified=request.method != 'GET')
 
 @app.route('/')
 def serve_frontend():
@@ -66,7 +275,12 @@ def serve_frontend():
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'message': 'Hebrew Font Maker API is running'})
+    return jsonify({'status': 'ok', 'message': 'Hebrew Font Maker API is running',
+                    'sessions': session_store.stats(), 'jobs': job_queue.stats(),
+                    'journal': session_journal.stats(),
+                    'detection_cache': detection_cache.stats(),
+                    'tiles': tile_pyramids.stats(),
+                    'storage': storage_manager.stats()})
 
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
@@ -85,63 +299,25 @@ def upload_image():
         if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
             return jsonify({'error': 'Invalid file type. Allowed: ' + ', '.join(allowed_extensions)}), 400
         
-        # Save file
-        filename = secure_filename(f"upload_{datetime.now().timestamp()}.png")
+        # Save file, named by content so re-uploads of the same scan share
+        # one file and hit the detection cache
+        data = file.read()
+        image_hash = content_hash(data)
+        filename = secure_filename(f"upload_{image_hash}.png")
         upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(upload_path)
-        
-        current_session['upload_path'] = upload_path
+        if not os.path.exists(upload_path):
+            tmp_path = f'{upload_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, upload_path)
         
         # Get separation level from form data (default=1)
         separation_level = int(request.form.get('separation_level', 1))
         separation_level = max(0, min(5, separation_level))
-        current_session['separation_level'] = separation_level
         
         # Detect letters
-        letters, original_image, processed_image = letter_detector.detect_letters(
-            upload_path, separation_level=separation_level
-        )
-        
-        # Store image info
-        current_session['detected_letters'] = letters
-        current_session['original_image'] = original_image
-        current_session['binary_image'] = processed_image
-        
-        # Prepare response with letter detections + cropped images as base64
-        detection_data = []
-        for idx, letter in enumerate(letters):
-            x, y, w, h = letter['bbox']
-            
-            # Crop the letter from the original image
-            padding = 6
-            x1 = max(0, x - padding)
-            y1 = max(0, y - padding)
-            x2 = min(original_image.shape[1], x + w + padding)
-            y2 = min(original_image.shape[0], y + h + padding)
-            cropped = original_image[y1:y2, x1:x2]
-            
-            # Encode as base64 PNG
-            _, buffer = cv2.imencode('.png', cropped)
-            img_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            detection_data.append({
-                'id': idx,
-                'bbox': {'x': x, 'y': y, 'w': w, 'h': h},
-                'area': letter['area'],
-                'fill_ratio': letter['fill_ratio'],
-                'image': img_base64
-            })
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Detected {len(letters)} potential letters',
-            'count': len(letters),
-            'detections': detection_data,
-            'image_info': {
-                'width': original_image.shape[1],
-                'height': original_image.shape[0]
-            }
-        }), 200
+        return _run_request_job('upload', _detect_letters_job, upload_path, separation_level,
+                                _crop_mode_requested(), image_hash=image_hash, group='detect')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -160,79 +336,282 @@ def redetect_letters():
         data = request.get_json()
         separation_level = int(data.get('separation_level', 1))
         separation_level = max(0, min(5, separation_level))
-        current_session['separation_level'] = separation_level
         
         # Re-detect with new separation level
-        letters, original_image, processed_image = letter_detector.detect_letters(
-            upload_path, separation_level=separation_level
-        )
+        return _run_request_job('redetect', _detect_letters_job, upload_path, separation_level,
+                                _crop_mode_requested(), redetect=True, group='detect')
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/redetect-region', methods=['POST'])
+def redetect_region():
+    """
+    Re-run letter detection inside one rectangle, with its own separation
+    level. Only that region is processed; detections overlapping it are
+    replaced and every other detection keeps its id and assignment.
+    Expects: { x, y, w, h, separation_level } in original image coordinates.
+    """
+    try:
+        original_image = current_session.get('original_image')
+        if original_image is None:
+            return jsonify({'error': 'No image uploaded'}), 400
         
-        current_session['detected_letters'] = letters
-        current_session['original_image'] = original_image
-        current_session['binary_image'] = processed_image
-        current_session['verified_glyphs'] = {}  # reset assignments
+        data = request.get_json()
+        x, y, w, h = (int(data[k]) for k in ('x', 'y', 'w', 'h'))
+        separation_level = max(0, min(5, int(data.get('separation_level', 1))))
         
-        # Build detection data the same way as upload
-        detection_data = []
-        for idx, letter in enumerate(letters):
-            x, y, w, h = letter['bbox']
-            padding = 6
-            x1 = max(0, x - padding)
-            y1 = max(0, y - padding)
-            x2 = min(original_image.shape[1], x + w + padding)
-            y2 = min(original_image.shape[0], y + h + padding)
-            cropped = original_image[y1:y2, x1:x2]
-            _, buffer = cv2.imencode('.png', cropped)
-            img_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            detection_data.append({
-                'id': idx,
-                'bbox': {'x': x, 'y': y, 'w': w, 'h': h},
-                'area': letter['area'],
-                'fill_ratio': letter['fill_ratio'],
-                'image': img_base64
-            })
+        # Clamp to image bounds
+        img_h, img_w = original_image.shape[:2]
+        x = max(0, min(x, img_w - 1))
+        y = max(0, min(y, img_h - 1))
+        w = min(w, img_w - x)
+        h = min(h, img_h - y)
+        if w < 4 or h < 4:
+            return jsonify({'error': 'Box too small'}), 400
         
-        return jsonify({
-            'status': 'success',
-            'message': f'Re-detected {len(letters)} potential letters (separation={separation_level})',
-            'count': len(letters),
-            'detections': detection_data,
-            'image_info': {
-                'width': original_image.shape[1],
-                'height': original_image.shape[0]
-            }
-        }), 200
+        return _run_request_job('redetect-region', _redetect_region_job, (x, y, w, h),
+                                separation_level, _crop_mode_requested(), group='detect')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _bbox_union(boxes):
+    x1 = min(b[0] for b in boxes)
+    y1 = min(b[1] for b in boxes)
+    x2 = max(b[0] + b[2] for b in boxes)
+    y2 = max(b[1] + b[3] for b in boxes)
+    return (x1, y1, x2 - x1, y2 - y1)
+
+def _redetect_region_job(job, session, region, separation_level, mode):
+    """
+    Detect letters in region and splice them into the session's detections.
+    
+    New detections take the ids of the replaced ones (extra ones are
+    appended), so ids outside the region only move when the region yields
+    fewer detections than it had. Replaced detections are matched to the
+    new ones by IoU (see detection_matching) and keep their assignments.
+    The region's binary crop replaces that part of the session binary image.
+    
+    Returns: (response payload, status code); 'id_map' maps every old id
+             that survives to its new id, for remapping assignments
+    """
+    letters = session['detected_letters']
+    replaced = [i for i, l in enumerate(letters)
+                if bbox_iou(l['bbox'], region) > 0]
+    # Letters crossing the rectangle's edge are re-detected whole
+    roi = _bbox_union([region] + [letters[i]['bbox'] for i in replaced])
+    new_letters, region_binary, (x1, y1) = letter_detector.detect_region(
+        session['original_image'], roi, separation_level=separation_level, with_binary=True)
+    if job is not None:
+        job.raise_if_cancelled()
+    # The grown roi can hold letters that do not touch the rectangle: those
+    # stay as they are, so their re-detected copies are dropped
+    kept = [l['bbox'] for i, l in enumerate(letters)
+            if i not in replaced and bbox_iou(l['bbox'], roi) > 0]
+    new_letters = [l for l in new_letters
+                   if not any(bbox_iou(l['bbox'], bbox) >= MIN_IOU for bbox in kept)]
+    
+    # The binary image follows the detections, so splits and merges inside
+    # the region label the pixels the new detections were found in
+    binary_image = _session_image_loader(session, 'binary_image')()
+    if not binary_image.flags.writeable:
+        binary_image = np.array(binary_image)  # read-only memory map (shared mode)
+    h, w = region_binary.shape[:2]
+    binary_image[y1:y1 + h, x1:x1 + w] = region_binary
+    
+    # Slots: replaced ids in order, then the end of the list
+    slots = replaced[:len(new_letters)]
+    spliced = list(letters)
+    for slot, letter in zip(slots, new_letters):
+        spliced[slot] = letter
+    spliced.extend(new_letters[len(slots):])
+    dropped_slots = set(replaced[len(new_letters):])
+    if dropped_slots:
+        spliced = [l for i, l in enumerate(spliced) if i not in dropped_slots]
+    
+    # Old id -> new id: outside detections shift past dropped slots only
+    id_map = {}
+    shift = 0
+    for i in range(len(letters)):
+        if i in dropped_slots:
+            shift += 1
+        elif i not in replaced:
+            id_map[i] = i - shift
+    new_set = {id(l) for l in new_letters}
+    new_ids = [i for i, l in enumerate(spliced) if id(l) in new_set]
+    result = match_boxes([letters[i]['bbox'] for i in replaced],
+                         [spliced[i]['bbox'] for i in new_ids])
+    for a, b in result.mapping.items():
+        id_map[replaced[a]] = new_ids[b]
+    
+    # Remap the server-side assignments the same way
+    verified, unmatched = carry_verified_glyphs(session.get('verified_glyphs', {}),
+                                                id_map, spliced)
+    session['detected_letters'] = spliced
+    session['verified_glyphs'] = verified
+    session['binary_image'] = binary_image
+    session.image_changed('binary_image')
+    session['component_labels'] = None
+    session_journal.snapshot(session)
+    
+    return {
+        'status': 'success',
+        'message': f'Re-detected {len(new_letters)} letters in region '
+                   f'(replaced {len(replaced)}, separation={separation_level})',
+        'count': len(spliced),
+        'replaced': len(replaced),
+        'detected': len(new_letters),
+        'id_map': {str(old): new for old, new in id_map.items()},
+        'unmatched_assignments': unmatched,
+        'detections': _build_detection_data(spliced, None, mode, session),
+    }, 200
+
+def _detect_letters_job(job, session, upload_path, separation_level, mode, redetect=False,
+                        image_hash=None):
+    """
+    Detect letters in upload_path and install the result in session.
+    Runs inline or on the job queue (job is None when inline).
+    Results come from the detection cache when the same file was detected
+    before with the same parameters; images are then decoded on demand.
+    
+    Returns: (response payload, status code)
+    """
+    if image_hash is None:
+        image_hash = file_hash(upload_path)
+    params = letter_detector.cache_params()
+    cached = detection_cache.get(image_hash, separation_level, params)
+    
+    if cached is not None:
+        letters = cached.letters
+        # Partials rather than closures, so other workers get them undecoded
+        original_image = LazyArray(partial(letter_detector.load_image, upload_path))
+        # Re-processed if the cache entry is evicted meanwhile
+        processed_image = LazyArray(partial(
+            load_entry_binary, cached.path,
+            fallback=partial(letter_detector.preprocess_file, upload_path, separation_level)))
+        image_id = cached.image_id
+        width, height = cached.width, cached.height
+        if job is not None:
+            job.progress('cache', letters=len(letters))
+    else:
+        letters, original_image, processed_image = letter_detector.detect_letters(
+            upload_path, separation_level=separation_level,
+            progress=job.progress if job is not None else None
+        )
+        image_id = image_content_id(original_image)
+        height, width = original_image.shape[:2]
+        detection_cache.put(image_hash, separation_level, params, letters, processed_image,
+                            image_id, original_image.shape)
+    if job is not None:
+        job.raise_if_cancelled()  # superseded: leave the session alone
+    
+    # Store image info
+    previous_letters = session.get('detected_letters') or []
+    session['upload_path'] = upload_path
+    session['separation_level'] = separation_level
+    session['detected_letters'] = letters
+    _set_session_images(original_image, processed_image, session, image_id=image_id)
+    # Review canvas tiles, built in the background while the user looks at the results
+    if isinstance(original_image, LazyArray):
+        load_original = lambda: letter_detector.load_image(upload_path)
+    else:
+        load_original = lambda: original_image
+    tile_pyramids.ensure(image_id, width, height, load_original)
+    extra = {}
+    if redetect:
+        # Carry assignments over to the new detections that match the old ones
+        result = match_boxes([l['bbox'] for l in previous_letters], [l['bbox'] for l in letters])
+        session['verified_glyphs'], unmatched = carry_verified_glyphs(
+            session.get('verified_glyphs', {}), result.mapping, letters)
+        extra = {'id_map': {str(old): new for old, new in result.mapping.items()},
+                 'unmatched_assignments': unmatched}
+        message = f'Re-detected {len(letters)} potential letters (separation={separation_level})'
+    else:
+        session['client_state'] = {}  # the UI state belonged to the previous image
+        message = f'Detected {len(letters)} potential letters'
+    session_journal.snapshot(session)
+    
+    return dict({
+        'status': 'success',
+        'message': message,
+        'count': len(letters),
+        'detections': _build_detection_data(letters, None, mode, session),
+        'image_info': {
+            'width': width,
+            'height': height
+        }
+    }, **extra), 200
+
+def _async_requested():
+    return request.args.get('async', '0').lower() in ('1', 'true', 'yes')
+
+def _session_job(job, fn, args, kwargs):
+    """Job queue entry point: run fn against the job's session."""
+    session = session_store.acquire(job.session_id)
+    try:
+        return fn(job, session, *args, **kwargs)
+    finally:
+        session_store.release(job.session_id)
+
+def _run_request_job(kind, fn, *args, group=None, **kwargs):
+    """
+    Run fn(job, session, *args, **kwargs) for the current request.
+    
+    By default it runs inline and its payload is the response. With ?async=1
+    it is queued and the response is 202 with the job id; poll
+    /api/jobs/<id> and fetch /api/jobs/<id>/result when it is done.
+    Jobs of the same group supersede each other within a session.
+    """
+    if not _async_requested():
+        payload, status_code = fn(None, current_session, *args, **kwargs)
+        return jsonify(payload), status_code
+    
+    _get_current_session()
+    job = job_queue.submit(g.session_id, kind, _session_job, fn, args, kwargs, group=group)
+    return jsonify(_job_info(job)), 202
+
+def _job_info(job):
+    info = job.to_dict()
+    info['status_url'] = f'/api/jobs/{job.id}'
+    info['result_url'] = f'/api/jobs/{job.id}/result'
+    info['events_url'] = f'/api/jobs/{job.id}/events'
+    return info
+
+def _set_session_images(original_image, binary_image, session=None, image_id=None):
+    """
+    Install new session images and drop everything derived from the old ones
+    (thumbnails, extracted contours). Distance fields are validated by
+    image identity, so other sessions' cached fields stay usable.
+    image_id: content id of original_image when already known (required
+    when original_image is a LazyArray)
+    """
+    session = current_session if session is None else session
+    old_id = session.get('image_id')
+    new_id = image_id
+    if new_id is None and original_image is not None:
+        new_id = image_content_id(original_image)
+    if old_id and old_id != new_id:
+        thumbnail_cache.drop_image(old_id)
+        atlas_packer.drop_image(old_id)
+    session['contour_cache'] = {}
+    session['component_labels'] = None
+    session['binary_path'] = None
+    session['original_image'] = original_image
+    session['binary_image'] = binary_image
+    session['image_id'] = new_id
+
 def _build_detection_response():
     """Helper: build detection_data list from current_session['detected_letters']."""
-    original_image = current_session['original_image']
-    detection_data = []
-    for idx, letter in enumerate(current_session['detected_letters']):
-        x, y, w, h = letter['bbox']
-        padding = 6
-        x1 = max(0, x - padding)
-        y1 = max(0, y - padding)
-        x2 = min(original_image.shape[1], x + w + padding)
-        y2 = min(original_image.shape[0], y + h + padding)
-        cropped = original_image[y1:y2, x1:x2]
-        _, buffer = cv2.imencode('.png', cropped)
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
-        detection_data.append({
-            'id': idx,
-            'bbox': {'x': x, 'y': y, 'w': w, 'h': h},
-            'area': letter['area'],
-            'fill_ratio': letter['fill_ratio'],
-            'image': img_base64
-        })
-    return detection_data
+    return _build_detection_data(current_session['detected_letters'],
+                                 current_session['original_image'])
 
 @app.route('/api/original-image', methods=['GET'])
 def get_original_image():
-    """Return the uploaded original image as base64 for canvas display."""
+    """
+    Return the uploaded original image as base64 for canvas display.
+    The review canvas loads tiles instead (see /api/tiles/manifest).
+    """
     try:
         original_image = current_session.get('original_image')
         if original_image is None:
@@ -247,6 +626,67 @@ def get_original_image():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/tiles/manifest', methods=['GET'])
+def get_tile_manifest():
+    """
+    Tile pyramid layout of the current image, with the URL template of its
+    tiles. Starts building the pyramid if it is not on disk yet; tiles are
+    served meanwhile anyway (rendered on request).
+    """
+    try:
+        image_id = current_session.get('image_id')
+        manifest = tile_pyramids.load_manifest(image_id) if image_id else None
+        if manifest is None:
+            original_image = current_session.get('original_image')
+            if original_image is None or not image_id:
+                return jsonify({'error': 'No image uploaded'}), 400
+            height, width = original_image.shape[:2]
+            tile_pyramids.ensure(image_id, width, height, lambda: original_image)
+            manifest = tile_pyramids.manifest(image_id, width, height)
+        manifest['tile_url'] = f'/api/tiles/{image_id}/{{level}}/{{col}}/{{row}}.jpg'
+        return jsonify(manifest), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tiles/<image_id>/<int:level>/<int:col>/<int:row>.jpg', methods=['GET'])
+def get_tile(image_id, level, col, row):
+    """
+    Serve one JPEG tile of an image pyramid (level 0 = full resolution).
+    image_id is a content hash, so tiles are immutable and revalidate by
+    strong ETag.
+    """
+    try:
+        if not valid_image_id(image_id):
+            return jsonify({'error': 'Image not found'}), 404
+        
+        etag = tile_etag(image_id, level, col, row, tile_pyramids.tile_size)
+        cache_control = 'public, max-age=31536000, immutable'
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        
+        data = tile_pyramids.tile(image_id, level, col, row)
+        if data is None:
+            # Not built yet: render it from any session holding the image
+            original_image = session_store.find_image(image_id)
+            if original_image is None:
+                return jsonify({'error': 'Image not found'}), 404
+            img_h, img_w = original_image.shape[:2]
+            levels = pyramid_levels(img_w, img_h, tile_pyramids.tile_size)
+            if (level >= len(levels) or col >= levels[level]['cols']
+                    or row >= levels[level]['rows']):
+                return jsonify({'error': 'Tile not found'}), 404
+            data = tile_pyramids.tile(image_id, level, col, row, original_image)
+        
+        response = Response(data, mimetype='image/jpeg')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/add-detection', methods=['POST'])
 def add_detection():
     """
@@ -287,6 +727,9 @@ def add_detection():
             'area': area
         }
         current_session['detected_letters'].append(new_letter)
+        session_journal.record(current_session, 'add',
+                               at=len(current_session['detected_letters']) - 1,
+                               letters=[letter_record(new_letter)])
         
         detection_data = _build_detection_response()
         
@@ -314,6 +757,7 @@ def remove_detection():
         
         letters.pop(det_id)
         current_session['detected_letters'] = letters
+        session_journal.record(current_session, 'remove', remove=[det_id], at=det_id)
         
         detection_data = _build_detection_response()
         
@@ -362,6 +806,8 @@ def assign_letters():
                 'label': manual_label,
                 'confirmed': True
             }
+        session_journal.record(current_session, 'assign',
+                               verified_glyphs=current_session['verified_glyphs'])
         
         return jsonify({
             'status': 'success',
@@ -379,26 +825,211 @@ def generate_font():
     """
     try:
         data = request.get_json()
-        font_name = data.get('font_name', 'HebrewFont')
-        adjustments = data.get('adjustments', {})  # { char: {scale, offsetX, offsetY} }
         
         if not current_session['verified_glyphs']:
             return jsonify({'error': 'No verified glyphs. Please verify letters first.'}), 400
         
-        # Create font
+        return _run_request_job('generate-font', _generate_font_job, data, group='generate')
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _contour_cache(session):
+    """The session's ContourCache (reset to a plain {} on new images and imports)."""
+    cache = session.get('contour_cache')
+    if not isinstance(cache, ContourCache):
+        cache = session['contour_cache'] = ContourCache(cache or {})
+    return cache
+
+def _session_image_loader(session, key):
+    """
+    Callable returning session[key], resolved on the first call only, so
+    glyphs served from the contour cache never decode the image. A missing
+    binary image is regenerated from the upload.
+    """
+    loaded = []
+    
+    def load():
+        if not loaded:
+            image = session.get(key)
+            if image is None and key == 'binary_image':
+                # Re-process if binary not stored
+                image = letter_detector.preprocess_image(
+                    letter_detector.load_image(session['upload_path']),
+                    separation_level=session.get('separation_level', 1))
+            loaded.append(image)
+        return loaded[0]
+    return load
+
+def _generate_font_job(job, session, data):
+    """
+    Build and save the session's font (inline or on the job queue).
+    
+    Returns: (response payload, status code)
+    """
+    font_name = data.get('font_name', 'HebrewFont')
+    adjustments = data.get('adjustments', {})  # { char: {scale, offsetX, offsetY} }
+    
+    # Create font
+    metadata = data.get('metadata', {})
+    # Optional per-phase build timings, collected through the FontCreator hook
+    want_timings = bool(data.get('timings', False))
+    timings = []
+    
+    def on_phase(entry):
+        if want_timings:
+            timings.append(entry)
+        if job is not None and entry['phase'] in ('fallback_injection', 'compile_save'):
+            stage = 'save' if entry['phase'] == 'compile_save' else entry['phase']
+            job.emit(stage, glyphs=len(creator.glyph_order), phase_ms=entry['ms'])
+    
+    creator = FontCreator(font_name=font_name, units_per_em=1024, metadata=metadata,
+                          timing_hook=on_phase if want_timings or job is not None else None,
+                          trace_allocations=want_timings)
+    
+    # Images for contour extraction, loaded only if a glyph misses the contour cache
+    binary_image = _session_image_loader(session, 'binary_image')
+    original_image = _session_image_loader(session, 'original_image')
+    
+    # Use client's refHeight for exact preview-to-font match.
+    # The client computes this from assigned detections' bbox heights.
+    # Fallback: compute from all detections if not provided.
+    ref_height = data.get('ref_height', 0)
+    if not ref_height:
+        ref_height = 0
+        for ltr in session['detected_letters']:
+            _, _, _, lh = ltr['bbox']
+            ref_height = max(ref_height, lh)
+    
+    glyph_jobs = session_glyph_jobs(session['verified_glyphs'],
+                                    session['detected_letters'])
+    # Optional global stroke weight (px): thicken > 0, thin < 0
+    extract_params = {}
+    if data.get('stroke_weight'):
+        extract_params['stroke_weight'] = float(data['stroke_weight'])
+    
+    add_assigned_glyphs(
+        creator, glyph_extractor, glyph_jobs,
+        binary_image, original_image,
+        ref_height, adjustments, extract_params,
+        contour_cache=_contour_cache(session),
+        progress=job.progress if job is not None else None
+    )
+    if job is not None:
+        job.raise_if_cancelled()
+    
+    # Save font
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_filename = secure_filename(f"{font_name}_{timestamp}.ttf")
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    
+    success, result = creator.save_font(output_path)
+    
+    if success:
+        session['font_path'] = output_path
+        response = {
+            'status': 'success',
+            'message': 'Font generated successfully',
+            'filename': output_filename,
+            'path': output_path,
+            'glyph_count': len(glyph_jobs)
+        }
+        if want_timings:
+            response['timings'] = timings
+        return response, 200
+    else:
+        return {'error': f'Font generation failed: {result}'}, 500
+
+@app.route('/api/preview-metrics', methods=['POST'])
+def preview_metrics():
+    """
+    Exact font-unit metrics for every assigned glyph, without building a TTF.
+    Expects: { adjustments, ref_height, stroke_weight }
+    Returns: { glyphs: { char: {glyph_name, advance_width, lsb, bbox,
+                                left_bearing, right_bearing} }, ... }
+    """
+    try:
+        t0 = time.perf_counter()
+        data = request.get_json() or {}
+        adjustments = data.get('adjustments', {})
+        
+        if not current_session['verified_glyphs']:
+            return jsonify({'error': 'No verified glyphs. Please verify letters first.'}), 400
+        
+        if not current_session['upload_path']:
+            return jsonify({'error': 'No image uploaded'}), 400
+        binary_image = _session_image_loader(current_session, 'binary_image')
+        original_image = _session_image_loader(current_session, 'original_image')
+        
+        ref_height = data.get('ref_height', 0)
+        if not ref_height:
+            ref_height = 0
+            for ltr in current_session['detected_letters']:
+                _, _, _, lh = ltr['bbox']
+                ref_height = max(ref_height, lh)
+        
+        extract_params = {}
+        if data.get('stroke_weight'):
+            extract_params['stroke_weight'] = float(data['stroke_weight'])
+        
+        contour_cache = _contour_cache(current_session)
+        metrics_preview = current_session.get('metrics_preview')
+        if metrics_preview is None:
+            metrics_preview = current_session['metrics_preview'] = GlyphMetricsPreview(units_per_em=1024)
+        glyph_jobs = session_glyph_jobs(current_session['verified_glyphs'],
+                                        current_session['detected_letters'])
+        for job in glyph_jobs:
+            contour_data = extract_job_contours(
+                glyph_extractor, job, binary_image, original_image,
+                extract_params, contour_cache
+            )
+            _, _, w, h = job['bbox']
+            metrics_preview.set_glyph(job['char'], contour_data, w, h)
+        metrics_preview.retain({job['char'] for job in glyph_jobs})
+        
+        glyphs = metrics_preview.export_metrics(adjustments, ref_height)
+        
+        return jsonify({
+            'status': 'success',
+            'units_per_em': metrics_preview.units_per_em,
+            'ascender': Config.ASCENDER,
+            'descender': Config.DESCENDER,
+            'ref_height': ref_height,
+            'glyphs': glyphs,
+            'elapsed_ms': round((time.perf_counter() - t0) * 1000, 3)
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/generate-family', methods=['POST'])
+def generate_family():
+    """
+    Build several variants of the font (weights / smoothing profiles) in
+    parallel and return them as one zip archive.
+    Expects: { family_name, adjustments, ref_height, metadata, max_workers,
+               variants: [ {style_name, weight_class, stroke_weight,
+                            smooth_window, point_budget}, ... ] }
+    """
+    try:
+        data = request.get_json() or {}
+        family_name = data.get('family_name') or data.get('font_name', 'HebrewFont')
+        adjustments = data.get('adjustments', {})
         metadata = data.get('metadata', {})
-        creator = FontCreator(font_name=font_name, units_per_em=1024, metadata=metadata)
+        variants = data.get('variants') or DEFAULT_VARIANTS
+        max_workers = data.get('max_workers')
+        if max_workers is not None and (isinstance(max_workers, bool)
+                                        or not isinstance(max_workers, int)):
+            return jsonify({'error': 'max_workers must be an integer'}), 400
+        
+        if not current_session['verified_glyphs']:
+            return jsonify({'error': 'No verified glyphs. Please verify letters first.'}), 400
         
-        # Get the binary image for contour extraction
         binary_image = current_session.get('binary_image')
         if binary_image is None:
-            # Re-process if binary not stored
             image = letter_detector.load_image(current_session['upload_path'])
             binary_image = letter_detector.preprocess_image(image)
         
-        # Use client's refHeight for exact preview-to-font match.
-        # The client computes this from assigned detections' bbox heights.
-        # Fallback: compute from all detections if not provided.
         ref_height = data.get('ref_height', 0)
         if not ref_height:
             ref_height = 0
@@ -406,68 +1037,26 @@ def generate_font():
                 _, _, _, lh = ltr['bbox']
                 ref_height = max(ref_height, lh)
         
-        for hebrew_char, glyph_info in current_session['verified_glyphs'].items():
-            detection_id = glyph_info['detection_id']
-            letter = current_session['detected_letters'][detection_id]
-            x, y, w, h = letter['bbox']
-            
-            # Extract all contours (outer + holes) from the original image
-            # (using original avoids preprocessing distortion from bilateral/CLAHE/morph)
-            original_image = current_session.get('original_image')
-            contour_data = glyph_extractor.extract_glyph_contours(
-                binary_image, (x, y, w, h), original_image=original_image
-            )
-            
-            # Get per-character adjustments if any
-            char_adj = adjustments.get(hebrew_char, {})
-            adj_scale = char_adj.get('scale', 100) / 100.0
-            adj_offset_x = char_adj.get('offsetX', 0)
-            adj_offset_y = char_adj.get('offsetY', 0)
-            adj_spacing = char_adj.get('spacing', 0)
-            
-            if adj_scale != 1.0 or adj_offset_x != 0 or adj_offset_y != 0:
-                px_to_font = 750.0 / 80.0
-                computed_fy = round(-adj_offset_y * px_to_font * adj_scale)
-                computed_fx = round(adj_offset_x * px_to_font * adj_scale)
-                print(f"  Glyph '{hebrew_char}': scale={adj_scale:.0%}, "
-                      f"offsetX={adj_offset_x}→{computed_fx}fu, "
-                      f"offsetY={adj_offset_y}→{computed_fy}fu")
-            
-            if contour_data:
-                # Use the new multi-contour method with proper aspect ratio
-                creator.add_glyph_from_contours(
-                    hebrew_char, contour_data, w, h,
-                    scale_factor=adj_scale,
-                    offset_x=adj_offset_x,
-                    offset_y=adj_offset_y,
-                    spacing=adj_spacing,
-                    reference_height=ref_height
-                )
-            else:
-                # Fallback to legacy single-contour method
-                contour = letter['contour']
-                smoothed_contour = glyph_extractor.smooth_contour(contour)
-                points = glyph_extractor.contour_to_bezier_points(smoothed_contour)
-                if points:
-                    creator.add_glyph(hebrew_char, points, width=int(max(h, w) * 0.7))
-        
-        # Save font
+        glyph_jobs = session_glyph_jobs(current_session['verified_glyphs'],
+                                        current_session['detected_letters'])
+        results = build_font_family(
+            family_name, variants, glyph_jobs,
+            binary_image, current_session.get('original_image'),
+            ref_height, adjustments=adjustments, metadata=metadata,
+            max_workers=max_workers
+        )
+        
+        if all('error' in r for r in results):
+            return jsonify({'error': f"Family build failed: {results[0]['error']}"}), 500
+        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_filename = secure_filename(f"{font_name}_{timestamp}.ttf")
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        
-        success, result = creator.save_font(output_path)
-        
-        if success:
-            return jsonify({
-                'status': 'success',
-                'message': 'Font generated successfully',
-                'filename': output_filename,
-                'path': output_path,
-                'glyph_count': len(current_session['verified_glyphs'])
-            }), 200
-        else:
-            return jsonify({'error': f'Font generation failed: {result}'}), 500
+        archive_name = secure_filename(f"{family_name}_family_{timestamp}.zip")
+        archive_path = os.path.join(app.config['OUTPUT_FOLDER'], archive_name)
+        with open(archive_path, 'wb') as f:
+            f.write(family_archive(results))
+        
+        return send_file(archive_path, as_attachment=True, download_name=archive_name,
+                         mimetype='application/zip')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -507,17 +1096,31 @@ def open_output_folder():
 @app.route('/api/session-clear', methods=['POST'])
 def clear_session():
     """Clear current session"""
-    global current_session
-    current_session = {
-        'upload_path': None,
-        'detected_letters': [],
-        'verified_glyphs': {},
-        'original_image': None,
-        'binary_image': None,
-        'processed_image': None
-    }
+    _get_current_session()
+    session_journal.drop(g.session_id)
+    session_store.release(g.session_id)
+    session_store.drop(g.session_id)
+    g.pop('session', None)
     return jsonify({'status': 'success', 'message': 'Session cleared'}), 200
 
+def _component_labels(session=None):
+    """
+    Connected-component labels of the session's binary image, computed on
+    first use after each detection pass (see component_labels.py).
+    """
+    session = current_session if session is None else session
+    key = (session.get('image_id'), session.get('separation_level'))
+    components = session.get('component_labels')
+    if components is None or not components.matches(key):
+        binary_image = session.get('binary_image')
+        if binary_image is None:
+            # Re-process if binary not stored
+            image = letter_detector.load_image(session['upload_path'])
+            binary_image = letter_detector.preprocess_image(
+                image, separation_level=session.get('separation_level', 1))
+        components = session['component_labels'] = ComponentLabels(binary_image, key)
+    return components
+
 @app.route('/api/merge-detections', methods=['POST'])
 def merge_detections():
     """
@@ -550,17 +1153,13 @@ def merge_detections():
         x_max = max(l['bbox'][0] + l['bbox'][2] for l in to_merge)
         y_max = max(l['bbox'][1] + l['bbox'][3] for l in to_merge)
         
-        merged_contour = np.vstack([l['contour'] for l in to_merge])
-        total_area = sum(l['area'] for l in to_merge)
-        merged_w = x_max - x_min
-        merged_h = y_max - y_min
-        
-        merged_letter = {
-            'bbox': (x_min, y_min, merged_w, merged_h),
-            'contour': merged_contour,
-            'fill_ratio': total_area / (merged_w * merged_h) if merged_w * merged_h > 0 else 0,
-            'area': total_area
-        }
+        # The merged letter is the union of the components of the parts
+        # (exact pixel area, outlines traced once per component)
+        components = _component_labels()
+        merged_set = set()
+        for letter in to_merge:
+            merged_set.update(components.components_in(letter['bbox']))
+        merged_letter = components.letter(merged_set, (x_min, y_min, x_max - x_min, y_max - y_min))
         
         # Rebuild the list: remove merged indices, insert merged one at the position of the first
         ids_set = set(ids)
@@ -577,6 +1176,8 @@ def merge_detections():
                 new_letters.append(letter)
         
         current_session['detected_letters'] = new_letters
+        session_journal.record(current_session, 'merge', remove=sorted(ids_set), at=insert_pos,
+                               letters=[letter_record(merged_letter)])
         
         # Rebuild detection_data response (same format as upload)
         detection_data = _build_detection_data(new_letters, original_image)
@@ -607,7 +1208,6 @@ def split_detection():
         
         letters = current_session['detected_letters']
         original_image = current_session['original_image']
-        binary_image = current_session.get('binary_image')
         
         if not letters or original_image is None:
             return jsonify({'error': 'No detections available'}), 400
@@ -616,46 +1216,17 @@ def split_detection():
             return jsonify({'error': f'Invalid detection id: {det_id}'}), 400
         
         target = letters[det_id]
-        x, y, w, h = target['bbox']
-        
-        # Crop the binary image for this detection and find connected components
-        padding = 4
-        img_h, img_w = binary_image.shape[:2]
-        x1 = max(0, x - padding)
-        y1 = max(0, y - padding)
-        x2 = min(img_w, x + w + padding)
-        y2 = min(img_h, y + h + padding)
-        crop = binary_image[y1:y2, x1:x2]
         
-        # Find separate contours in this region
-        contours, _ = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Connected components of this detection, from the cached label map
+        components = _component_labels()
+        labels = components.components_in(target['bbox'], padding=4)
         
-        if len(contours) < 2:
+        if len(labels) < 2:
             return jsonify({'error': 'לא ניתן לפצל - זוהה רכיב אחד בלבד'}), 400
         
-        # Create a new detection for each contour
-        new_parts = []
-        for contour in contours:
-            cx, cy, cw, ch = cv2.boundingRect(contour)
-            if cw < 5 or ch < 5:
-                continue  # skip tiny noise
-            
-            # Convert back to full-image coords
-            abs_x = x1 + cx
-            abs_y = y1 + cy
-            
-            # Shift contour points to absolute coords
-            contour_abs = contour.copy()
-            contour_abs[:, 0, 0] += x1
-            contour_abs[:, 0, 1] += y1
-            
-            area = cv2.contourArea(contour)
-            new_parts.append({
-                'bbox': (abs_x, abs_y, cw, ch),
-                'contour': contour_abs,
-                'fill_ratio': area / (cw * ch) if cw * ch > 0 else 0,
-                'area': area
-            })
+        # Create a new detection for each component (skip tiny noise)
+        new_parts = [components.letter([label]) for label in labels
+                     if min(components.bbox(label)[2:]) >= 5]
         
         if len(new_parts) < 2:
             return jsonify({'error': 'לא ניתן לפצל - רכיב אחד משמעותי בלבד'}), 400
@@ -666,6 +1237,8 @@ def split_detection():
         # Replace the original detection with the split parts
         new_letters = letters[:det_id] + new_parts + letters[det_id + 1:]
         current_session['detected_letters'] = new_letters
+        session_journal.record(current_session, 'split', remove=[det_id], at=det_id,
+                               letters=[letter_record(p) for p in new_parts])
         
         # Rebuild detection_data response
         detection_data = _build_detection_data(new_letters, original_image)
@@ -681,111 +1254,306 @@ def split_detection():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def _build_detection_data(letters_list, original_image):
-    """Helper to build the detection data response array."""
+def _crop_mode_requested():
+    """
+    How detection responses carry crops, chosen by query flag:
+      ?mode=url (default) - 'image_url' per detection for /api/crop
+      ?mode=inline or ?inline=1 - base64 PNG embedded as 'image'
+      ?mode=atlas - 'atlas' slot per detection into shared sprite shelves
+    """
+    mode = request.args.get('mode', '').lower()
+    if mode in ('url', 'inline', 'atlas'):
+        return mode
+    if request.args.get('inline', '0').lower() in ('1', 'true', 'yes'):
+        return 'inline'
+    return 'url'
+
+def _build_detection_data(letters_list, original_image, mode=None, session=None):
+    """
+    Helper to build the detection data response array.
+    Every entry carries an 'image_url' for /api/crop; depending on mode
+    (see _crop_mode_requested) the PNG is also embedded as base64 'image',
+    or an 'atlas' slot {url, shelf, x, y, w, h} is added.
+    Inline crops come from the thumbnail cache, so only new or changed
+    detections are cropped and PNG-encoded.
+    """
+    if mode is None:
+        mode = _crop_mode_requested()
+    session = current_session if session is None else session
+    if original_image is None:
+        # URL mode needs no pixels; otherwise decode the session image now
+        original_image = session['original_image'] if mode != 'url' else None
+    image_id = session.get('image_id')
+    if image_id is None:
+        image_id = session['image_id'] = image_content_id(original_image)
+    
+    atlas_slots = None
+    if mode == 'atlas':
+        atlas_slots, shelves = atlas_packer.layout(
+            image_id, original_image, [l['bbox'] for l in letters_list]
+        )
+    
     detection_data = []
     for idx, letter in enumerate(letters_list):
         x, y, w, h = letter['bbox']
-        padding = 6
-        x1 = max(0, x - padding)
-        y1 = max(0, y - padding)
-        x2 = min(original_image.shape[1], x + w + padding)
-        y2 = min(original_image.shape[0], y + h + padding)
-        cropped = original_image[y1:y2, x1:x2]
-        
-        _, buffer = cv2.imencode('.png', cropped)
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        detection_data.append({
+        entry = {
             'id': idx,
             'bbox': {'x': x, 'y': y, 'w': w, 'h': h},
             'area': letter['area'],
             'fill_ratio': letter['fill_ratio'],
-            'image': img_base64
-        })
+            'image_url': crop_url(image_id, (x, y, w, h))
+        }
+        if mode == 'inline':
+            entry['image'] = thumbnail_cache.get_base64(image_id, original_image, (x, y, w, h))
+        elif atlas_slots is not None:
+            slot = atlas_slots[idx]
+            version = shelves[slot['shelf']]['version']
+            entry['atlas'] = dict(slot, url=atlas_url(image_id, slot['shelf'], version))
+        detection_data.append(entry)
     return detection_data
 
+@app.route('/api/crop/<image_id>/<bbox>', methods=['GET'])
+def get_crop(image_id, bbox):
+    """
+    Serve one detection crop as raw PNG (default) or WebP (?fmt=webp).
+    bbox is 'x,y,w,h' in original image coordinates. image_id is a content
+    hash, so responses are immutable and revalidate by strong ETag.
+    """
+    try:
+        fmt = request.args.get('fmt', 'png').lower()
+        if fmt not in THUMB_FORMATS:
+            return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+        try:
+            x, y, w, h = (int(v) for v in bbox.split(','))
+        except ValueError:
+            return jsonify({'error': 'bbox must be x,y,w,h'}), 400
+        
+        etag = crop_etag(image_id, (x, y, w, h), fmt)
+        cache_control = 'public, max-age=31536000, immutable'
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        
+        # image_id is a content hash, so any session holding the image can serve it
+        original_image = session_store.find_image(image_id)
+        if original_image is None:
+            return jsonify({'error': 'Image not found'}), 404
+        img_h, img_w = original_image.shape[:2]
+        if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > img_w or y + h > img_h:
+            return jsonify({'error': 'bbox outside image'}), 400
+        
+        data = thumbnail_cache.get_bytes(image_id, original_image, (x, y, w, h), fmt)
+        response = Response(data, mimetype=f'image/{fmt}')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/atlas/<image_id>/<int:shelf>', methods=['GET'])
+def get_atlas_shelf(image_id, shelf):
+    """
+    Serve one shelf strip of the detection sprite atlas (PNG).
+    Versioned requests (?v=N matching the current version) are immutable.
+    """
+    try:
+        # image_id is a content hash, so any session holding the image can serve it
+        original_image = session_store.find_image(image_id)
+        if original_image is None:
+            return jsonify({'error': 'Image not found'}), 404
+        
+        data, version = atlas_packer.shelf_png(image_id, original_image, shelf)
+        if data is None:
+            return jsonify({'error': 'Atlas shelf not found'}), 404
+        
+        etag = f'{image_id}-atlas-{shelf}-{version}'
+        if request.args.get('v') == str(version):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(data, mimetype='image/png')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# ==================== Background jobs ====================
+
+def _session_job_or_404(job_id):
+    """The job if it belongs to the requesting session, else None."""
+    job = job_queue.get(job_id)
+    _get_current_session()
+    if job is None or job.session_id != g.session_id:
+        return None
+    return job
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a background job (queued / running / done / failed / cancelled)"""
+    job = _session_job_or_404(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_job_info(job)), 200
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Result of a finished job: the same body and status code the synchronous
+    request would have returned. 202 while still pending, 409 if cancelled.
+    """
+    job = _session_job_or_404(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status not in FINISHED_STATES:
+        return jsonify(_job_info(job)), 202
+    if job.status == CANCELLED:
+        return jsonify(dict(_job_info(job), error='Job was cancelled')), 409
+    return jsonify(job.payload), job.status_code
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job's progress. Each 'progress' event is
+    JSON {seq, stage, elapsed_ms, ...counts}; stages are preprocess,
+    contours, filter, merge, sort for detection and glyph (one per glyph),
+    fallback_injection, save for font generation. A final 'end' event
+    carries the job status. Reconnects resume after Last-Event-ID.
+    EventSource cannot send headers, so pass the session as ?session=<id>.
+    """
+    job = _session_job_or_404(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        since = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        since = 0
+    
+    def stream():
+        seq = since
+        while True:
+            events, finished = job.wait_events(seq, timeout=15)
+            for event in events:
+                yield f"event: progress\nid: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+            seq += len(events)
+            if finished:
+                yield f"event: end\ndata: {json.dumps(_job_info(job))}\n\n"
+                return
+            if not events:
+                yield ': keep-alive\n\n'
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job (running jobs stop at their next checkpoint)"""
+    job = _session_job_or_404(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.cancel()
+    return jsonify(_job_info(job)), 200
+
 
 # ==================== Export / Import Project ====================
 
 @app.route('/api/export-project', methods=['POST'])
 def export_project():
     """
-    Export the current project state to a .hfm (JSON) file so the user
-    can resume editing later.   Includes the original image (base64-encoded)
-    so the project is fully self-contained.
+    Export the current project state to a .hfm file so the user can resume
+    editing later. The file is a v3 container (see project_file.py) holding
+    the original and binary images as PNG, so it is fully self-contained.
+    Unless include_glyphs is false, the extracted outlines of the assigned
+    letters are saved too, so regenerating the font after import skips
+    contour extraction.
     """
     try:
         data = request.get_json() or {}
         font_name = data.get('font_name', 'HebrewFont')
-        assignments = data.get('assignments', {})
-        adjustments = data.get('adjustments', {})
-        metadata = data.get('metadata', {})
 
         if not current_session.get('upload_path') or not current_session.get('detected_letters'):
             return jsonify({'error': 'אין פרויקט פתוח לייצוא. יש להעלות תמונה קודם.'}), 400
 
-        # Encode the original uploaded image as base64 PNG so the file is portable
-        original_image = current_session.get('original_image')
-        if original_image is not None:
-            _, buf = cv2.imencode('.png', original_image)
-            image_b64 = base64.b64encode(buf).decode('utf-8')
-        else:
-            image_b64 = None
+        glyph_contours = None
+        if data.get('include_glyphs', True):
+            glyph_contours = _assigned_glyph_contours(data.get('assignments', {}), data)
 
-        # Encode the binary (pre-processed) image — needed for contour extraction at font generation
-        binary_image = current_session.get('binary_image')
-        if binary_image is not None:
-            _, buf2 = cv2.imencode('.png', binary_image)
-            binary_b64 = base64.b64encode(buf2).decode('utf-8')
-        else:
-            binary_b64 = None
-
-        # Serialise detected_letters INCLUDING contour data so the exact
-        # detections (manual adds/removes/merges) are preserved.
-        det_export = []
-        for ltr in current_session['detected_letters']:
-            entry = {
-                'bbox': list(ltr['bbox']),
-                'area': int(ltr['area']),
-                'fill_ratio': float(ltr['fill_ratio']),
-            }
-            # Serialize numpy contour to plain list
-            cnt = ltr.get('contour')
-            if cnt is not None:
-                entry['contour'] = np.array(cnt).tolist()
-            det_export.append(entry)
-
-        project = {
-            'version': 2,
+        original_image = current_session.get('original_image')
+        manifest = {
             'font_name': font_name,
+            # Lets import skip decoding the original (content id and size)
+            'image_id': current_session.get('image_id'),
+            'width': int(original_image.shape[1]) if original_image is not None else None,
+            'height': int(original_image.shape[0]) if original_image is not None else None,
             'separation_level': current_session.get('separation_level', 1),
-            'assignments': assignments,          # { detId: char }
-            'adjustments': adjustments,          # { char: {scale,offsetX,offsetY,spacing} }
-            'metadata': metadata,                # { author, description, version, license, url }
-            'detections': det_export,            # full detection data with contours
-            'image_b64': image_b64,              # full original image
-            'binary_b64': binary_b64,            # binary image for contour extraction
+            'assignments': data.get('assignments', {}),   # { detId: char }
+            'adjustments': data.get('adjustments', {}),   # { char: {scale,offsetX,offsetY,spacing} }
+            'metadata': data.get('metadata', {}),         # { author, description, version, license, url }
         }
 
         filename = secure_filename(f"{font_name}_project.hfm")
         out_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-        with open(out_path, 'w', encoding='utf-8') as f:
-            json.dump(project, f, ensure_ascii=False)
+        # The detections keep their contours, so the exact detections
+        # (manual adds/removes/merges) are preserved
+        write_project(out_path, manifest,
+                      original_image,
+                      current_session.get('binary_image'),
+                      current_session['detected_letters'],
+                      glyph_contours=glyph_contours,
+                      image_hash=current_session.get('image_id'))
 
         return send_file(out_path, as_attachment=True, download_name=filename,
-                         mimetype='application/json')
+                         mimetype='application/zip')
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _assigned_glyph_contours(assignments, data):
+    """
+    Contour cache entries of the assigned letters (client assignments and
+    verified glyphs). Every cached parameter set is kept; letters that were
+    never extracted are extracted now with the request's stroke_weight.
+    """
+    letters = current_session['detected_letters']
+    ids = set(info['detection_id'] for info in current_session['verified_glyphs'].values())
+    for det_id in assignments:
+        try:
+            ids.add(int(det_id))
+        except (TypeError, ValueError):
+            continue
+    bboxes = {tuple(int(v) for v in letters[i]['bbox']) for i in ids if 0 <= i < len(letters)}
+    if not bboxes or current_session.get('image_id') is None:
+        return None
+
+    extract_params = {}
+    if data.get('stroke_weight'):
+        extract_params['stroke_weight'] = float(data['stroke_weight'])
+    contour_cache = _contour_cache(current_session)
+    cached = {key[0] for key in contour_cache}
+    binary_image = _session_image_loader(current_session, 'binary_image')
+    original_image = _session_image_loader(current_session, 'original_image')
+    for bbox in bboxes - cached:
+        extract_job_contours(glyph_extractor, {'bbox': bbox}, binary_image, original_image,
+                             extract_params, contour_cache)
+    return {key: value for key, value in contour_cache.items() if key[0] in bboxes}
+
+
 @app.route('/api/import-project', methods=['POST'])
 def import_project():
     """
-    Import a previously exported .hfm project file.
+    Import a previously exported .hfm project file (v1, v2 JSON or v3 container).
     Restores the exact detections (including manual adds/removals/merges)
-    without re-detecting.
+    without re-detecting. The images of a v3 container are only decoded when
+    first needed (its manifest records the image id and size), and saved
+    glyph outlines seed the contour cache when the image matches.
     """
     try:
         if 'file' not in request.files:
@@ -795,124 +1563,179 @@ def import_project():
         if file.filename == '':
             return jsonify({'error': 'לא נבחר קובץ'}), 400
 
-        content = file.read().decode('utf-8')
-        project = json.loads(content)
+        try:
+            project = ProjectFile.open(file.stream)
+        except ValueError:
+            return jsonify({'error': 'קובץ לא תקין'}), 400
 
-        version = project.get('version', 1)
-        if version not in (1, 2):
-            return jsonify({'error': 'גרסת קובץ לא נתמכת'}), 400
+        try:
+            if project.version not in SUPPORTED_VERSIONS:
+                return jsonify({'error': 'גרסת קובץ לא נתמכת'}), 400
 
-        image_b64 = project.get('image_b64')
-        if not image_b64:
-            return jsonify({'error': 'קובץ הפרויקט לא מכיל תמונה'}), 400
+            img_bytes = project.image_bytes()
+            if not img_bytes:
+                return jsonify({'error': 'קובץ הפרויקט לא מכיל תמונה'}), 400
 
-        # Decode the original image
-        img_bytes = base64.b64decode(image_b64)
-        img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-        original_image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        if original_image is None:
-            return jsonify({'error': 'שגיאה בפענוח התמונה'}), 400
+            image_id = project.get('image_id')
+            width, height = project.get('width'), project.get('height')
+            lazy = (project.version >= 3 and valid_image_id(image_id)
+                    and isinstance(width, int) and isinstance(height, int)
+                    and width > 0 and height > 0)
+            if not lazy:
+                # Older files: decode the original for its content id and size
+                original_image = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8),
+                                              cv2.IMREAD_COLOR)
+                if original_image is None:
+                    return jsonify({'error': 'שגיאה בפענוח התמונה'}), 400
+                image_id = image_content_id(original_image)
+                height, width = original_image.shape[:2]
 
-        # Save the image to temp so the session has a valid upload_path
-        filename = secure_filename(f"import_{datetime.now().timestamp()}.png")
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        cv2.imwrite(upload_path, original_image)
+            # Save the image to temp so the session has a valid upload_path
+            # (the stored bytes are already a PNG, no need to re-encode)
+            filename = secure_filename(f"import_{datetime.now().timestamp()}.png")
+            upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            with open(upload_path, 'wb') as f:
+                f.write(img_bytes)
+            if lazy:
+                original_image = LazyArray(partial(letter_detector.load_image, upload_path))
 
-        separation_level = project.get('separation_level', 1)
+            separation_level = project.get('separation_level', 1)
+            binary_path = None
 
-        # Decode binary image if present (v2)
-        binary_b64 = project.get('binary_b64')
-        if binary_b64:
-            bin_bytes = base64.b64decode(binary_b64)
-            bin_array = np.frombuffer(bin_bytes, dtype=np.uint8)
-            binary_image = cv2.imdecode(bin_array, cv2.IMREAD_GRAYSCALE)
-        else:
-            binary_image = None
-
-        saved_dets = project.get('detections', [])
-
-        if version >= 2 and saved_dets and 'contour' in saved_dets[0]:
-            # ── V2: restore exact detections (preserves manual edits) ──
-            letters = []
-            for det in saved_dets:
-                entry = {
-                    'bbox': tuple(det['bbox']),
-                    'area': det['area'],
-                    'fill_ratio': det['fill_ratio'],
-                }
-                if det.get('contour') is not None:
-                    entry['contour'] = np.array(det['contour'], dtype=np.int32)
+            letters = project.saved_detections()
+            if letters is not None:
+                # ── V2/V3: restore exact detections (preserves manual edits) ──
+                bin_bytes = project.image_bytes(binary=True)
+                if bin_bytes:
+                    # Kept next to the upload, so the image can load from a file
+                    binary_path = f'{os.path.splitext(upload_path)[0]}_binary.png'
+                    with open(binary_path, 'wb') as f:
+                        f.write(bin_bytes)
+                    binary_image = LazyArray(partial(letter_detector.load_image, binary_path,
+                                                     cv2.IMREAD_GRAYSCALE))
                 else:
-                    entry['contour'] = np.array([], dtype=np.int32)
-                letters.append(entry)
-
-            # If binary image wasn't saved, regenerate it
-            if binary_image is None:
-                image = letter_detector.load_image(upload_path)
-                binary_image = letter_detector.preprocess_image(
-                    image, separation_level=separation_level
-                )
-
-            matched_assignments = project.get('assignments', {})
-        else:
-            # ── V1 fallback: re-detect and match assignments by bbox ──
-            letters, original_image, binary_image = letter_detector.detect_letters(
-                upload_path, separation_level=separation_level
-            )
-
-            old_assignments = project.get('assignments', {})
-            matched_assignments = {}
+                    # Binary image wasn't saved, regenerate it when needed
+                    binary_image = LazyArray(partial(letter_detector.preprocess_file,
+                                                     upload_path, separation_level))
 
-            if len(letters) == len(saved_dets):
-                matched_assignments = old_assignments
+                matched_assignments = project.get('assignments', {})
+                unmatched_assignments = []
+                glyph_contours = project.saved_glyph_contours(image_id)
             else:
-                for old_id_str, char in old_assignments.items():
-                    old_idx = int(old_id_str)
-                    if old_idx >= len(saved_dets):
-                        continue
-                    ob = saved_dets[old_idx]['bbox']
-                    ox, oy = ob[0], ob[1]
-                    best_new = None
-                    best_dist = 9999999
-                    for ni, nl in enumerate(letters):
-                        nx, ny = nl['bbox'][0], nl['bbox'][1]
-                        d = abs(nx - ox) + abs(ny - oy)
-                        if d < best_dist:
-                            best_dist = d
-                            best_new = ni
-                    if best_new is not None and best_dist < 50:
-                        matched_assignments[str(best_new)] = char
+                # ── V1 fallback: re-detect and match assignments by bbox ──
+                letters, original_image, binary_image = letter_detector.detect_letters(
+                    upload_path, separation_level=separation_level
+                )
+                image_id = image_content_id(original_image)
+                glyph_contours = None
+
+                saved_bboxes = project.saved_bboxes()
+                result = match_boxes(saved_bboxes, [l['bbox'] for l in letters])
+                matched_assignments, unmatched_assignments = carry_assignments(
+                    project.get('assignments', {}), result.mapping)
+        finally:
+            project.close()
 
         # Update session
         current_session['upload_path'] = upload_path
         current_session['separation_level'] = separation_level
         current_session['detected_letters'] = letters
-        current_session['original_image'] = original_image
-        current_session['binary_image'] = binary_image
+        _set_session_images(original_image, binary_image, image_id=image_id)
+        current_session['binary_path'] = binary_path
         current_session['verified_glyphs'] = {}
+        if glyph_contours:
+            current_session['contour_cache'] = glyph_contours
+        current_session['client_state'] = {
+            'font_name': project.get('font_name', 'HebrewFont'),
+            'assignments': matched_assignments,
+            'adjustments': project.get('adjustments', {}),
+            'metadata': project.get('metadata', {}),
+        }
+        session_journal.snapshot(current_session)
 
         # Build detection response with cropped images
-        detection_data = _build_detection_response()
+        detection_data = _build_detection_data(letters, None)
 
         return jsonify({
             'status': 'success',
             'font_name': project.get('font_name', 'HebrewFont'),
             'assignments': matched_assignments,
+            'unmatched_assignments': unmatched_assignments,
             'adjustments': project.get('adjustments', {}),
             'metadata': project.get('metadata', {}),
             'count': len(letters),
+            'cached_glyphs': len(glyph_contours or {}),
             'detections': detection_data,
+            'image_info': {
+                'width': int(width),
+                'height': int(height)
+            }
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/autosave', methods=['POST'])
+def autosave():
+    """
+    Journal the client-side project state (cheap, called periodically by the UI).
+    Expects: { font_name, assignments, adjustments, metadata }
+    """
+    try:
+        data = request.get_json() or {}
+        if not current_session.get('upload_path'):
+            return jsonify({'status': 'skipped'}), 200
+
+        client_state = {key: data.get(key) for key in
+                        ('font_name', 'assignments', 'adjustments', 'metadata')
+                        if data.get(key) is not None}
+        if client_state != current_session.get('client_state'):
+            current_session['client_state'] = client_state
+            session_journal.record(current_session, 'autosave', client_state=client_state)
+
+        return jsonify({'status': 'success', 'seq': current_session.get('journal_seq', 0)}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/session-restore', methods=['GET'])
+def session_restore():
+    """
+    State of the current session for the UI after a reload or a server
+    restart (sessions are recovered from their journal when first used).
+    Same fields as /api/import-project, status 'empty' when there is nothing.
+    """
+    try:
+        if not current_session.get('upload_path') or not current_session.get('detected_letters'):
+            return jsonify({'status': 'empty'}), 200
+
+        client_state = current_session.get('client_state') or {}
+        assignments = client_state.get('assignments')
+        if assignments is None:
+            assignments = {str(info['detection_id']): char
+                           for char, info in current_session['verified_glyphs'].items()}
+        original_image = current_session['original_image']
+
+        return jsonify({
+            'status': 'restored',
+            'font_name': client_state.get('font_name', 'HebrewFont'),
+            'assignments': assignments,
+            'adjustments': client_state.get('adjustments', {}),
+            'metadata': client_state.get('metadata', {}),
+            'count': len(current_session['detected_letters']),
+            'detections': _build_detection_data(current_session['detected_letters'],
+                                                original_image, _crop_mode_requested()),
             'image_info': {
                 'width': original_image.shape[1],
                 'height': original_image.shape[0]
             }
         }), 200
 
-    except json.JSONDecodeError:
-        return jsonify({'error': 'קובץ לא תקין (JSON)'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
 def open_browser():
     """Open the browser after a short delay to let Flask start"""
     import time
@@ -0,0 +1,421 @@
+"""
+Batch font builder - scans plus a mapping spec to fonts, without the web UI
+
+Usage:
+    python backend/batch.py SPEC.json [--output DIR] [--workers N]
+                            [--report FILE] [--no-cache]
+
+SPEC.json lists the fonts to build (relative paths are relative to the
+spec file):
+
+    {
+      "defaults": {"separation_level": 1, "stroke_weight": 0,
+                   "metadata": {...}, "adjustments": {...},
+                   "mapping": "alphabet"},
+      "fonts": [
+        {"image": "scans/dana.png", "name": "Dana"},
+        {"images": "scans/night/*.png", "mapping": "maps/grid-6x4.json"},
+        {"image": "scans/omer.jpg", "mapping": {"type": "explicit",
+                                                "map": {"0": "א", "3": "ב"}}}
+      ]
+    }
+
+"images" (a glob pattern or a list) builds one font per image, named
+after the file ("name" may use {stem}). A mapping is an object, a path to
+a JSON file holding one, or "alphabet":
+
+    alphabet   detections in reading order (rows top to bottom, right to
+               left) take the characters of "chars" in order
+               (default: the 22 letters of Config.HEBREW_LETTERS)
+    grid       the image (or "region": [x, y, w, h]) is "rows" x "cols"
+               equal cells; "chars" lists them row by row in reading
+               order ("direction": "rtl" default, or "ltr"), ' ' for an
+               empty cell. The detections whose centers fall in a cell are
+               merged into its glyph
+    explicit   "map": {detection id: character}, ids as the web UI shows
+               them for the same separation level
+
+Each font runs LetterDetector, GlyphExtractor and FontCreator in a worker
+process; detection results go through the detection cache, so rebuilding
+the same scans again skips detection. Fonts are written to --output
+(default: fonts_output/batch_<timestamp>/) with report.json listing, per
+font, the output file, glyph counts, unmapped characters, timings or the
+error. The exit status is 1 if any font failed.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from werkzeug.utils import secure_filename
+from config import Config
+from backend.image_processor import LetterDetector, GlyphExtractor
+from backend.font_generator import FontCreator
+from backend.family_builder import EXTRACT_PARAMS, add_assigned_glyphs
+from backend.detection_cache import DetectionCache, file_hash
+from backend.thumbnails import image_content_id
+
+MAPPING_TYPES = ('alphabet', 'grid', 'explicit')
+# GlyphExtractor expects a float stroke weight and integer window / budget
+_EXTRACT_PARAM_TYPES = {'stroke_weight': float, 'smooth_window': int, 'point_budget': int}
+
+
+class SpecError(ValueError):
+    """Invalid batch spec or mapping."""
+
+
+# ==================== Spec ====================
+
+def _resolve(base_dir, path):
+    return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+def load_mapping(mapping, base_dir):
+    """A mapping object from its spec form (object, 'alphabet' or JSON file path)."""
+    if mapping is None or mapping == 'alphabet':
+        return {'type': 'alphabet'}
+    if isinstance(mapping, str):
+        try:
+            with open(_resolve(base_dir, mapping), encoding='utf-8') as f:
+                mapping = json.load(f)
+        except (OSError, ValueError) as e:
+            raise SpecError(f'Cannot read mapping {mapping}: {e}')
+    if not isinstance(mapping, dict) or mapping.get('type') not in MAPPING_TYPES:
+        raise SpecError(f'Mapping type must be one of {", ".join(MAPPING_TYPES)}')
+    if mapping['type'] == 'grid' and not (int(mapping.get('rows', 0)) > 0
+                                          and int(mapping.get('cols', 0)) > 0):
+        raise SpecError('Grid mapping needs rows and cols')
+    if mapping['type'] == 'explicit' and not isinstance(mapping.get('map'), dict):
+        raise SpecError('Explicit mapping needs a "map" of detection id -> character')
+    return mapping
+
+
+def load_spec(path):
+    """
+    Expand a batch spec file into font tasks.
+
+    Returns: list of task dicts (name, image, filename, mapping, options)
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SpecError(f'Cannot read spec {path}: {e}')
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if isinstance(spec, list):
+        spec = {'fonts': spec}
+    defaults = spec.get('defaults', {})
+    mapping_cache = {}
+
+    tasks = []
+    used_filenames = set()
+    for entry in spec.get('fonts', []):
+        entry = dict(defaults, **entry)
+        if 'image' in entry:
+            images = [_resolve(base_dir, entry['image'])]
+        elif isinstance(entry.get('images'), list):
+            images = [_resolve(base_dir, p) for p in entry['images']]
+        elif isinstance(entry.get('images'), str):
+            images = sorted(glob.glob(_resolve(base_dir, entry['images'])))
+        else:
+            raise SpecError('Every font needs "image" or "images"')
+
+        mapping_key = json.dumps(entry.get('mapping'), sort_keys=True)
+        if mapping_key not in mapping_cache:
+            mapping_cache[mapping_key] = load_mapping(entry.get('mapping'), base_dir)
+
+        for image in images:
+            stem = os.path.splitext(os.path.basename(image))[0]
+            name = entry.get('name', '{stem}').replace('{stem}', stem)
+            # One output file per font, even if names collide
+            # secure_filename drops non-ASCII letters, so Hebrew names use the stem
+            filename = f'{secure_filename(name) or secure_filename(stem) or "font"}.ttf'
+            base, n = filename[:-4], 2
+            while filename in used_filenames:
+                filename = f'{base}_{n}.ttf'
+                n += 1
+            used_filenames.add(filename)
+            tasks.append({
+                'name': name,
+                'image': image,
+                'filename': filename,
+                'mapping': mapping_cache[mapping_key],
+                'separation_level': int(entry.get('separation_level', 1)),
+                'metadata': entry.get('metadata', {}),
+                'adjustments': entry.get('adjustments', {}),
+                'extract_params': {k: _EXTRACT_PARAM_TYPES[k](entry[k]) for k in EXTRACT_PARAMS
+                                   if entry.get(k)},
+            })
+    if not tasks:
+        raise SpecError('The spec lists no fonts')
+    return tasks
+
+
+# ==================== Mapping ====================
+
+def merge_letters(letters):
+    """One detection covering several (contours stacked, bbox united)."""
+    if len(letters) == 1:
+        return letters[0]
+    x_min = min(l['bbox'][0] for l in letters)
+    y_min = min(l['bbox'][1] for l in letters)
+    x_max = max(l['bbox'][0] + l['bbox'][2] for l in letters)
+    y_max = max(l['bbox'][1] + l['bbox'][3] for l in letters)
+    w, h = x_max - x_min, y_max - y_min
+    area = sum(l['area'] for l in letters)
+    return {
+        'bbox': (x_min, y_min, w, h),
+        'contour': np.vstack([l['contour'] for l in letters]),
+        'fill_ratio': area / (w * h) if w * h > 0 else 0,
+        'area': area,
+    }
+
+
+def _chars(mapping, default=None):
+    chars = mapping.get('chars', default)
+    return list(chars) if chars is not None else []
+
+
+def map_detections(mapping, letters, image_shape):
+    """
+    Assign detections to characters.
+
+    Returns: (glyph_jobs [{'char', 'bbox', 'contour'}], missing chars,
+              number of detections left unassigned)
+    """
+    kind = mapping['type']
+    assigned = {}  # char -> letter
+    missing = []
+    used = set()
+
+    if kind == 'alphabet':
+        chars = _chars(mapping, Config.HEBREW_LETTERS)
+        for i, char in enumerate(chars):
+            if i < len(letters):
+                assigned[char] = letters[i]
+                used.add(i)
+            else:
+                missing.append(char)
+
+    elif kind == 'explicit':
+        for det_id, char in mapping['map'].items():
+            i = int(det_id)
+            if 0 <= i < len(letters):
+                assigned[char] = letters[i]
+                used.add(i)
+            else:
+                missing.append(char)
+
+    else:  # grid
+        rows, cols = int(mapping['rows']), int(mapping['cols'])
+        img_h, img_w = image_shape[:2]
+        gx, gy, gw, gh = mapping.get('region') or (0, 0, img_w, img_h)
+        cells = {}
+        for i, letter in enumerate(letters):
+            x, y, w, h = letter['bbox']
+            col = int((x + w / 2 - gx) * cols // gw)
+            row = int((y + h / 2 - gy) * rows // gh)
+            if 0 <= row < rows and 0 <= col < cols:
+                if mapping.get('direction', 'rtl') == 'rtl':
+                    col = cols - 1 - col
+                cells.setdefault(row * cols + col, []).append(i)
+        for cell, char in enumerate(_chars(mapping)[:rows * cols]):
+            if not char.strip():
+                continue
+            if cell in cells:
+                assigned[char] = merge_letters([letters[i] for i in cells[cell]])
+                used.update(cells[cell])
+            else:
+                missing.append(char)
+
+    jobs = [{'char': char, 'bbox': tuple(int(v) for v in letter['bbox']),
+             'contour': letter['contour']}
+            for char, letter in assigned.items()]
+    return jobs, missing, len(letters) - len(used)
+
+
+# ==================== Workers ====================
+
+# Per-worker state, filled by _init_worker
+_worker = {}
+
+
+def _init_worker(cache_dir):
+    """Process pool initializer: one detector / extractor / cache per worker."""
+    _worker['detector'] = LetterDetector()
+    _worker['extractor'] = GlyphExtractor()
+    _worker['cache'] = (DetectionCache(cache_dir, Config.DETECTION_CACHE_MAX_MB * 1024 * 1024)
+                        if cache_dir else None)
+
+
+def _detect(task):
+    """(letters, original image, binary image, 'hit' | 'miss' | 'off')"""
+    detector, cache = _worker['detector'], _worker['cache']
+    level = task['separation_level']
+    if cache is None:
+        return detector.detect_letters(task['image'], separation_level=level) + ('off',)
+
+    image_hash = file_hash(task['image'])
+    params = detector.cache_params()
+    cached = cache.get(image_hash, level, params)
+    if cached is not None:
+        original = detector.load_image(task['image'])
+        binary = cached.load_binary()
+        if binary is None:  # evicted meanwhile
+            binary = detector.preprocess_image(original, separation_level=level)
+        return cached.letters, original, binary, 'hit'
+
+    letters, original, binary = detector.detect_letters(task['image'], separation_level=level)
+    cache.put(image_hash, level, params, letters, binary, image_content_id(original),
+              original.shape)
+    return letters, original, binary, 'miss'
+
+
+def build_font(task, output_dir):
+    """
+    Build one font (in a worker process).
+
+    Returns: report entry for the font
+    """
+    started = time.perf_counter()
+    report = {'name': task['name'], 'image': task['image'], 'status': 'failed'}
+    try:
+        if not os.path.isfile(task['image']):
+            raise FileNotFoundError(f"Image not found: {task['image']}")
+        letters, original, binary, cache_result = _detect(task)
+        detected = time.perf_counter()
+
+        glyph_jobs, missing, unused = map_detections(task['mapping'], letters, original.shape)
+        if not glyph_jobs:
+            raise ValueError(f'No characters mapped ({len(letters)} detections)')
+        # Same reference as the web UI: the tallest assigned detection
+        ref_height = max(job['bbox'][3] for job in glyph_jobs)
+
+        creator = FontCreator(font_name=task['name'], units_per_em=1024,
+                              metadata=task['metadata'])
+        added = add_assigned_glyphs(creator, _worker['extractor'], glyph_jobs,
+                                    binary, original, ref_height, task['adjustments'],
+                                    task['extract_params'])
+        output_path = os.path.join(output_dir, task['filename'])
+        success, result = creator.save_font(output_path)
+        if not success:
+            raise RuntimeError(f'Font build failed: {result}')
+
+        report.update({
+            'status': 'ok',
+            'output': output_path,
+            'detections': len(letters),
+            'mapped': len(glyph_jobs),
+            'glyphs': added,
+            'missing': missing,
+            'unused_detections': unused,
+            'detection_cache': cache_result,
+            'detect_seconds': round(detected - started, 3),
+        })
+    except Exception as e:
+        report['error'] = str(e)
+    finally:
+        _worker['extractor'].clear_stroke_cache()
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def run_batch(tasks, output_dir, workers=None, cache_dir=None, on_result=None):
+    """
+    Build all tasks on a process pool (inline when workers == 1).
+
+    Returns: list of report entries, in task order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(len(tasks), workers or os.cpu_count() or 1))
+    results = [None] * len(tasks)
+
+    if workers == 1:
+        _init_worker(cache_dir)
+        for i, task in enumerate(tasks):
+            results[i] = build_font(task, output_dir)
+            if on_result:
+                on_result(results[i])
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_dir,)) as pool:
+        futures = {pool.submit(build_font, task, output_dir): i
+                   for i, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:  # worker died
+                results[i] = {'name': tasks[i]['name'], 'image': tasks[i]['image'],
+                              'status': 'failed', 'error': str(e)}
+            if on_result:
+                on_result(results[i])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build fonts from scans and mapping specs')
+    parser.add_argument('spec', help='batch spec (JSON)')
+    parser.add_argument('--output', default=None,
+                        help='output folder (default: fonts_output/batch_<timestamp>)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--report', default=None,
+                        help='report file (default: <output>/report.json)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always run detection (skip the detection cache)')
+    args = parser.parse_args(argv)
+
+    try:
+        tasks = load_spec(args.spec)
+    except SpecError as e:
+        parser.error(str(e))
+    output_dir = args.output or os.path.join(
+        Config.OUTPUT_FOLDER, f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    cache_dir = None if args.no_cache else Config.DETECTION_CACHE_FOLDER
+
+    print(f"Building {len(tasks)} fonts into {output_dir}")
+    done = [0]
+
+    def on_result(result):
+        done[0] += 1
+        if result['status'] == 'ok':
+            detail = f"{result['glyphs']} glyphs"
+            if result['missing']:
+                detail += f", missing {''.join(result['missing'])}"
+        else:
+            detail = f"FAILED - {result['error']}"
+        print(f"  [{done[0]}/{len(tasks)}] {result['name']}: {detail} ({result['seconds']}s)")
+
+    started = time.time()
+    results = run_batch(tasks, output_dir, args.workers, cache_dir, on_result)
+    failed = sum(1 for r in results if r['status'] != 'ok')
+    report = {
+        'spec': os.path.abspath(args.spec),
+        'output': os.path.abspath(output_dir),
+        'started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        'seconds': round(time.time() - started, 3),
+        'fonts': len(results),
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'results': results,
+    }
+    report_path = args.report or os.path.join(output_dir, 'report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"{len(results) - failed}/{len(results)} fonts built in {report['seconds']}s, "
+          f"report: {report_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
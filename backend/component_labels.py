@@ -0,0 +1,107 @@
+"""
+Component labels - connected-component label map of the binary image, for
+splitting and merging detections
+
+The label map and per-component stats (bbox, pixel area) are computed once
+per detection pass with cv2.connectedComponentsWithStats, on the first split
+or merge. A detection is then the set of components inside its bbox:
+splitting hands out its components as separate detections and merging
+unites the sets, with exact pixel areas and without re-tracing the image or
+stacking contour point arrays. Component outlines are traced once, from the
+component's own mask, and memoized. Labels are 16-bit unless the image has
+65535 components or more (a 100 MP scan: 200 MB instead of 400 MB).
+"""
+
+import cv2
+import numpy as np
+
+
+class ComponentLabels:
+    """Label map of one binary image plus per-component stats and outlines."""
+
+    def __init__(self, binary_image, key=None):
+        try:
+            count, labels, stats, _ = cv2.connectedComponentsWithStats(
+                binary_image, connectivity=8, ltype=cv2.CV_16U)
+        except cv2.error:
+            # Too many components for 16-bit labels
+            count, labels, stats, _ = cv2.connectedComponentsWithStats(
+                binary_image, connectivity=8, ltype=cv2.CV_32S)
+        self.key = key  # what the binary image was made from, see matches()
+        self.labels = labels
+        self.stats = stats  # per label: x, y, w, h, area (label 0 = background)
+        self.count = count - 1
+        self._outlines = {}
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + self.stats.nbytes
+
+    def matches(self, key):
+        return self.key == key
+
+    def bbox(self, label):
+        x, y, w, h = self.stats[label, :4]
+        return int(x), int(y), int(w), int(h)
+
+    def area(self, label):
+        return int(self.stats[label, cv2.CC_STAT_AREA])
+
+    def components_in(self, bbox, padding=0, min_size=1):
+        """
+        Labels of the components whose bbox center lies inside bbox (grown
+        by padding) and whose width and height are at least min_size.
+        """
+        x, y, w, h = (int(v) for v in bbox)
+        img_h, img_w = self.labels.shape
+        x1, y1 = max(0, x - padding), max(0, y - padding)
+        x2, y2 = min(img_w, x + w + padding), min(img_h, y + h + padding)
+        found = np.unique(self.labels[y1:y2, x1:x2])
+        found = found[found > 0]
+        st = self.stats[found]
+        cx = st[:, 0] + st[:, 2] / 2
+        cy = st[:, 1] + st[:, 3] / 2
+        keep = ((cx >= x1) & (cx < x2) & (cy >= y1) & (cy < y2)
+                & (st[:, 2] >= min_size) & (st[:, 3] >= min_size))
+        return [int(label) for label in found[keep]]
+
+    def outline(self, label):
+        """External contour of one component in image coordinates (memoized)."""
+        contour = self._outlines.get(label)
+        if contour is None:
+            x, y, w, h = self.bbox(label)
+            mask = (self.labels[y:y + h, x:x + w] == label).astype(np.uint8)
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contour = max(contours, key=len) + np.array([x, y], dtype=np.int32)
+            self._outlines[label] = contour
+        return contour
+
+    def letter(self, labels, bbox=None):
+        """
+        Detection dict for a set of components. bbox defaults to the union
+        of the component bboxes.
+        """
+        labels = sorted(set(labels))
+        if bbox is None:
+            boxes = [self.bbox(label) for label in labels]
+            x = min(b[0] for b in boxes)
+            y = min(b[1] for b in boxes)
+            x2 = max(b[0] + b[2] for b in boxes)
+            y2 = max(b[1] + b[3] for b in boxes)
+            bbox = (x, y, x2 - x, y2 - y)
+        x, y, w, h = bbox
+        area = sum(self.area(label) for label in labels)
+        if not labels:
+            # Nothing drawn inside: the box itself (like a manual detection)
+            contour = np.array([[[x, y]], [[x + w, y]], [[x + w, y + h]], [[x, y + h]]],
+                               dtype=np.int32)
+        elif len(labels) == 1:
+            contour = self.outline(labels[0])
+        else:
+            contour = np.concatenate([self.outline(label) for label in labels])
+        return {
+            'bbox': bbox,
+            'contour': contour,
+            'fill_ratio': area / (w * h) if w * h > 0 else 0,
+            'area': area,
+        }
@@ -0,0 +1,165 @@
+"""
+Response compression - gzip / brotli negotiated through Accept-Encoding
+
+Responses above a size threshold with a compressible content type are
+compressed with the best encoding the client accepts (brotli when the
+'brotli' package is installed, else gzip). Compressed bodies are kept in an
+LRU cache keyed by a hash of the uncompressed bytes, so a payload that is
+sent again (the frontend files, a re-fetched font) is never compressed
+twice. The frontend files are compressed ahead of time at startup, at the
+highest levels, by precompress_folder().
+
+Streamed responses (Server-Sent Events) are left alone.
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    # Fallback if brotli not installed: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml',
+    'image/svg+xml', 'font/ttf', 'font/otf', 'application/font-sfnt',
+)
+# Never read files bigger than this into memory just to compress them
+MAX_FILE_BYTES = 16 * 1024 * 1024
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(data, encoding, level=None):
+    """data compressed with 'gzip' or 'br' (level None = the default level)."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5 if level is None else level)
+    return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+
+
+class CompressionCache:
+    """LRU of compressed bodies keyed by (hash of the plain bytes, encoding)."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, digest, encoding):
+        with self._lock:
+            body = self._entries.get((digest, encoding))
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((digest, encoding))
+            self.hits += 1
+            return body
+
+    def put(self, digest, encoding, body):
+        with self._lock:
+            key = (digest, encoding)
+            if key in self._entries:
+                return
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def compressed(self, data, encoding, level=None):
+        digest = self.digest(data)
+        body = self.get(digest, encoding)
+        if body is None:
+            body = compress(data, encoding, level)
+            self.put(digest, encoding, body)
+        return body
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def precompress_folder(cache, folder, min_bytes=1024,
+                       extensions=('.html', '.js', '.css', '.svg', '.json')):
+    """Compress the static files of a folder into the cache (max levels)."""
+    count = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if not name.lower().endswith(extensions):
+                continue
+            try:
+                with open(os.path.join(root, name), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) < min_bytes:
+                continue
+            digest = cache.digest(data)
+            for encoding in supported_encodings():
+                cache.put(digest, encoding, compress(data, encoding, 11 if encoding == 'br' else 9))
+            count += 1
+    logger.info(f"Precompressed {count} static files in {folder} ({', '.join(supported_encodings())})")
+    return count
+
+
+def _compressible(response):
+    mimetype = response.mimetype or ''
+    return any(mimetype.startswith(t) for t in COMPRESSIBLE_TYPES)
+
+
+def install_compression(app, cache, min_bytes=1024):
+    """Compress the responses of a Flask app (see the module docstring)."""
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers or not _compressible(response)):
+            return response
+        if response.is_streamed and not response.direct_passthrough:
+            return response  # generator (SSE)
+        length = response.content_length
+        if length is not None and (length < min_bytes or length > MAX_FILE_BYTES):
+            return response
+
+        encoding = request.accept_encodings.best_match(supported_encodings())
+        response.vary.add('Accept-Encoding')
+        if encoding is None:
+            return response
+
+        if response.direct_passthrough:
+            # send_file: read the (small, known size) file once
+            response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        body = cache.compressed(data, encoding)
+        if len(body) >= len(data):
+            return response
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # Same resource, different bytes: keep the ETag but make it weak
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return cache
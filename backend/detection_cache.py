@@ -0,0 +1,170 @@
+"""
+Detection cache - persistent, content-addressed cache of letter detection
+results, so re-uploading the same scan skips detect_letters entirely
+
+Entries are compressed .npz files in the cache folder, named by a hash of
+(image file hash, separation level, detector parameters). Each holds the
+packed detections (project_file.pack_detections), the binary image and a
+small JSON header (image content id and size). The folder is bounded by
+max_bytes; least recently used entries (by file mtime, refreshed on every
+hit) are evicted first. Several processes may share the folder.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+from backend.project_file import pack_detections, unpack_detections
+
+logger = logging.getLogger(__name__)
+
+ENTRY_SUFFIX = '.npz'
+
+
+def content_hash(data):
+    """Hash of uploaded file bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CachedDetection:
+    """A cache hit: detections loaded, binary image read on demand."""
+
+    def __init__(self, path, letters, image_id, width, height):
+        self.path = path
+        self.letters = letters
+        self.image_id = image_id
+        self.width = width
+        self.height = height
+
+    def load_binary(self):
+        """Binary image of the entry; None if it was evicted meanwhile."""
+        return load_entry_binary(self.path)
+
+
+def load_entry_binary(path, fallback=None):
+    """
+    Binary image of the cache entry at path. If the entry was evicted,
+    fallback() when given, else None. A module function, so a
+    functools.partial of it pickles (see session_store.LazyArray).
+    """
+    try:
+        with np.load(path, allow_pickle=False) as arrays:
+            return arrays['binary']
+    except (OSError, KeyError, ValueError):
+        return fallback() if fallback is not None else None
+
+
+class DetectionCache:
+    """
+    Disk cache of detect_letters results.
+
+    get() / put() take the image file hash, the separation level and the
+    detector parameters (LetterDetector.cache_params()); any change in one
+    of them is a different entry.
+    """
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, image_hash, separation_level, params):
+        spec = json.dumps([image_hash, int(separation_level), params], sort_keys=True)
+        return hashlib.blake2b(spec.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ENTRY_SUFFIX)
+
+    def get(self, image_hash, separation_level, params):
+        """CachedDetection for the key, or None."""
+        path = self._path(self.key(image_hash, separation_level, params))
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                header = json.loads(str(arrays['header']))
+                letters = unpack_detections(arrays)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Dropping unreadable detection cache entry {path}: {e}")
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedDetection(path, letters, header['image_id'],
+                               header['width'], header['height'])
+
+    def put(self, image_hash, separation_level, params, letters, binary_image, image_id,
+            image_shape):
+        """Store a detection result, then evict down to max_bytes."""
+        path = self._path(self.key(image_hash, separation_level, params))
+        header = {
+            'image_hash': image_hash,
+            'separation_level': int(separation_level),
+            'params': params,
+            'image_id': image_id,
+            'width': int(image_shape[1]),
+            'height': int(image_shape[0]),
+        }
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(f, header=np.array(json.dumps(header)),
+                                    binary=binary_image, **pack_detections(letters))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write detection cache entry: {e}")
+            self._remove(tmp)
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
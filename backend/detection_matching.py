@@ -0,0 +1,201 @@
+"""
+Detection matching - carries assignments over when the detections change
+(redetect, region redetect, import of a v1 project that is re-detected)
+
+Old and new detections are matched by bounding box IoU. The new boxes go
+into a uniform grid index, so every old box is only scored against the new
+boxes it actually overlaps. Conflicts (two old boxes wanting the same new
+one, a letter split in two, two letters merged) are resolved by an optimal
+one-to-one assignment - maximum total IoU, Hungarian algorithm - solved
+separately for each connected group of candidates, which stays small even
+on full sheets.
+"""
+
+from collections import defaultdict
+
+MIN_IOU = 0.3  # weaker overlaps are not the same letter
+
+
+def bbox_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class BoxIndex:
+    """Uniform grid over (x, y, w, h) boxes, for overlap queries."""
+
+    def __init__(self, boxes, cell=None):
+        self.boxes = [tuple(b) for b in boxes]
+        if cell is None:
+            # About one letter per cell: each box spans at most ~4 cells
+            sizes = sorted(max(b[2], b[3]) for b in self.boxes)
+            cell = sizes[len(sizes) // 2] if sizes else 64
+        self.cell = max(16, int(cell))
+        self._grid = defaultdict(list)
+        for i, box in enumerate(self.boxes):
+            for key in self._cells(box):
+                self._grid[key].append(i)
+
+    def _cells(self, box):
+        x, y, w, h = box
+        c = self.cell
+        for cy in range(int(y) // c, int(y + max(h - 1, 0)) // c + 1):
+            for cx in range(int(x) // c, int(x + max(w - 1, 0)) // c + 1):
+                yield cx, cy
+
+    def query(self, box):
+        """Indices of the boxes overlapping box."""
+        found = set()
+        for key in self._cells(box):
+            found.update(self._grid.get(key, ()))
+        return sorted(i for i in found if bbox_iou(self.boxes[i], box) > 0)
+
+
+def _hungarian(cost):
+    """
+    Minimum-cost assignment for a cost matrix (list of rows) with
+    rows <= columns: every row gets a distinct column.
+
+    Returns: [(row, column)]
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    owner = [0] * (m + 1)  # column -> row (1-based, 0 = free)
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            delta, j1 = inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j], way[j] = cur, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    return [(owner[j] - 1, j - 1) for j in range(1, m + 1) if owner[j]]
+
+
+class MatchResult:
+    """
+    mapping:       old index -> new index
+    scores:        old index -> IoU of its match
+    unmatched_old: old indices without a match
+    unmatched_new: new indices without a match
+    """
+
+    def __init__(self, mapping, scores, n_old, n_new):
+        self.mapping = mapping
+        self.scores = scores
+        self.unmatched_old = [i for i in range(n_old) if i not in mapping]
+        matched_new = set(mapping.values())
+        self.unmatched_new = [j for j in range(n_new) if j not in matched_new]
+
+
+def match_boxes(old_boxes, new_boxes, min_iou=MIN_IOU):
+    """One-to-one matching of old to new boxes maximizing total IoU."""
+    index = BoxIndex(new_boxes)
+    candidates = {}  # (old, new) -> IoU
+    for i, box in enumerate(old_boxes):
+        for j in index.query(box):
+            iou = bbox_iou(box, index.boxes[j])
+            if iou >= min_iou:
+                candidates[(i, j)] = iou
+
+    # Connected groups of candidates (union-find over old and new nodes)
+    parent = {}
+
+    def find(node):
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for i, j in candidates:
+        parent[find(('old', i))] = find(('new', j))
+    groups = defaultdict(lambda: (set(), set()))
+    for i, j in candidates:
+        olds, news = groups[find(('old', i))]
+        olds.add(i)
+        news.add(j)
+
+    mapping, scores = {}, {}
+    for olds, news in groups.values():
+        olds, news = sorted(olds), sorted(news)
+
+        def score(a, b):
+            return candidates.get((olds[a], news[b]), 0.0)
+
+        if len(olds) == 1 and len(news) == 1:
+            pairs = [(0, 0)]
+        elif len(olds) <= len(news):
+            pairs = _hungarian([[1.0 - score(a, b) for b in range(len(news))]
+                                for a in range(len(olds))])
+        else:
+            pairs = [(a, b) for b, a in _hungarian([[1.0 - score(a, b) for a in range(len(olds))]
+                                                    for b in range(len(news))])]
+        for a, b in pairs:
+            i, j = olds[a], news[b]
+            if (i, j) in candidates:
+                mapping[i] = j
+                scores[i] = candidates[(i, j)]
+    return MatchResult(mapping, scores, len(old_boxes), len(new_boxes))
+
+
+def carry_assignments(assignments, mapping):
+    """
+    Client-side assignments {detection id: char} moved to the new ids.
+
+    Returns: (assignments with str ids, [{'detection_id', 'char'}] not carried over)
+    """
+    carried, dropped = {}, []
+    for det_id, char in assignments.items():
+        new = mapping.get(int(det_id))
+        if new is None:
+            dropped.append({'detection_id': int(det_id), 'char': char})
+        else:
+            carried[str(new)] = char
+    return carried, dropped
+
+
+def carry_verified_glyphs(verified_glyphs, mapping, new_letters):
+    """
+    Server-side assignments {char: {'detection_id', 'bbox', ...}} moved to
+    the new detections.
+
+    Returns: (verified glyphs, [{'detection_id', 'char', 'bbox'}] not carried over)
+    """
+    carried, dropped = {}, []
+    for char, info in verified_glyphs.items():
+        new = mapping.get(info['detection_id'])
+        if new is None:
+            dropped.append({'detection_id': info['detection_id'], 'char': char,
+                            'bbox': list(info.get('bbox', ()))})
+        else:
+            carried[char] = dict(info, detection_id=new,
+                                 bbox=tuple(int(v) for v in new_letters[new]['bbox']))
+    return carried, dropped
@@ -0,0 +1,321 @@
+"""
+Font family build module - builds several font variants (weights, smoothing
+profiles) from one session in parallel on a process pool
+"""
+
+import io
+import os
+import zipfile
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from werkzeug.utils import secure_filename
+from backend.image_processor import GlyphExtractor
+from backend.font_generator import FontCreator
+
+logger = logging.getLogger(__name__)
+
+# Keys of a variant spec that are passed through to GlyphExtractor
+EXTRACT_PARAMS = ('stroke_weight', 'smooth_window', 'point_budget')
+
+DEFAULT_VARIANTS = [
+    {'style_name': 'Light', 'weight_class': 300, 'stroke_weight': -1},
+    {'style_name': 'Regular', 'weight_class': 400, 'stroke_weight': 0},
+    {'style_name': 'Bold', 'weight_class': 700, 'stroke_weight': 2},
+]
+
+
+def session_glyph_jobs(verified_glyphs, detected_letters):
+    """
+    Flatten the session's assignments into picklable glyph jobs.
+
+    Returns: list of {'char', 'bbox', 'contour'}
+    """
+    jobs = []
+    for char, glyph_info in verified_glyphs.items():
+        letter = detected_letters[glyph_info['detection_id']]
+        jobs.append({
+            'char': char,
+            'bbox': tuple(int(v) for v in letter['bbox']),
+            'contour': letter['contour'],
+        })
+    return jobs
+
+
+class ContourCache(OrderedDict):
+    """
+    LRU of extracted glyph contours, keyed by (bbox, extract params).
+    Every stroke weight / smoothing combination is its own entry, so each
+    bbox keeps at most max_variants of them and the whole cache at most
+    max_entries; the least recently used entry goes first.
+    """
+
+    def __init__(self, entries=(), max_entries=2048, max_variants=4):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_variants = max_variants
+        for key, value in dict(entries).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        variants = [other for other in self if other[0] == key[0]]
+        for other in variants[:-self.max_variants]:
+            del self[other]
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+def _resolve_image(image):
+    """Image arguments may be callables returning the image (see extract_job_contours)."""
+    return image() if callable(image) else image
+
+
+def extract_job_contours(extractor, job, binary_image, original_image,
+                         extract_params=None, contour_cache=None):
+    """
+    Contours for one glyph job, reusing contour_cache (a ContourCache, or
+    any dict keyed by bbox and extraction parameters) when given.
+    binary_image / original_image may be callables returning the images;
+    they are only called on a cache miss, so fully cached glyphs never
+    load or decode them.
+    """
+    extract_params = extract_params or {}
+    bbox = tuple(job['bbox'])
+    key = (bbox, tuple(sorted(extract_params.items())))
+    if contour_cache is not None and key in contour_cache:
+        return contour_cache[key]
+
+    # Extract all contours (outer + holes) from the original image
+    # (using original avoids preprocessing distortion from bilateral/CLAHE/morph)
+    contour_data = extractor.extract_glyph_contours(
+        _resolve_image(binary_image), bbox, original_image=_resolve_image(original_image),
+        **extract_params
+    )
+    if contour_cache is not None:
+        contour_cache[key] = contour_data
+    return contour_data
+
+
+def add_assigned_glyphs(creator, extractor, glyph_jobs, binary_image, original_image,
+                        ref_height, adjustments, extract_params=None, contour_cache=None,
+                        progress=None):
+    """
+    Extract each glyph's contours and add it to a FontCreator, applying the
+    per-character preview adjustments.
+
+    Args:
+        glyph_jobs: list of {'char', 'bbox', 'contour'} (see session_glyph_jobs)
+        adjustments: { char: {scale, offsetX, offsetY, spacing} }
+        extract_params: optional GlyphExtractor overrides
+                        (stroke_weight, smooth_window, point_budget)
+        contour_cache: optional dict reused across calls (see extract_job_contours)
+        binary_image / original_image: arrays, or callables returning them
+                        (see extract_job_contours)
+        progress: optional callable progress('glyph', char=, done=, total=, added=),
+                  called after each glyph
+
+    Returns: number of glyphs added
+    """
+    added = 0
+
+    for done, job in enumerate(glyph_jobs, 1):
+        hebrew_char = job['char']
+        x, y, w, h = job['bbox']
+
+        contour_data = extract_job_contours(
+            extractor, job, binary_image, original_image, extract_params, contour_cache
+        )
+
+        # Get per-character adjustments if any
+        char_adj = adjustments.get(hebrew_char, {})
+        adj_scale = char_adj.get('scale', 100) / 100.0
+        adj_offset_x = char_adj.get('offsetX', 0)
+        adj_offset_y = char_adj.get('offsetY', 0)
+        adj_spacing = char_adj.get('spacing', 0)
+
+        if adj_scale != 1.0 or adj_offset_x != 0 or adj_offset_y != 0:
+            px_to_font = 750.0 / 80.0
+            computed_fy = round(-adj_offset_y * px_to_font * adj_scale)
+            computed_fx = round(adj_offset_x * px_to_font * adj_scale)
+            print(f"  Glyph '{hebrew_char}': scale={adj_scale:.0%}, "
+                  f"offsetX={adj_offset_x}→{computed_fx}fu, "
+                  f"offsetY={adj_offset_y}→{computed_fy}fu")
+
+        if contour_data:
+            # Use the new multi-contour method with proper aspect ratio
+            ok = creator.add_glyph_from_contours(
+                hebrew_char, contour_data, w, h,
+                scale_factor=adj_scale,
+                offset_x=adj_offset_x,
+                offset_y=adj_offset_y,
+                spacing=adj_spacing,
+                reference_height=ref_height
+            )
+        else:
+            # Fallback to legacy single-contour method
+            ok = False
+            contour = job.get('contour')
+            if contour is not None and len(contour) >= 3:
+                smoothed_contour = extractor.smooth_contour(contour)
+                points = extractor.contour_to_bezier_points(smoothed_contour)
+                if points:
+                    ok = creator.add_glyph(hebrew_char, points, width=int(max(h, w) * 0.7))
+
+        if ok:
+            added += 1
+        if progress:
+            progress('glyph', char=hebrew_char, done=done, total=len(glyph_jobs), added=added)
+
+    return added
+
+
+# ==================== Shared read-only images ====================
+
+def share_image(image):
+    """
+    Copy an image into a shared memory block once.
+
+    Returns: (SharedMemory, descriptor) — the caller owns the block and must
+             close() + unlink() it; the descriptor is passed to workers.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+    view = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+    view[...] = image
+    return shm, {'name': shm.name, 'shape': image.shape, 'dtype': image.dtype.str}
+
+
+def attach_image(desc):
+    """
+    Attach to a shared image block as a read-only array (no copy).
+
+    Returns: (SharedMemory, ndarray) — keep the SharedMemory referenced for as
+             long as the array is in use.
+    """
+    # Pool workers share the parent's resource tracker, so attaching does not
+    # take ownership; the parent unlinks the block when the build is done.
+    shm = shared_memory.SharedMemory(name=desc['name'])
+    arr = np.ndarray(desc['shape'], dtype=np.dtype(desc['dtype']), buffer=shm.buf)
+    arr.flags.writeable = False
+    return shm, arr
+
+
+# Per-worker state, filled by _init_worker
+_worker = {}
+
+
+def _init_worker(binary_desc, original_desc):
+    """Process pool initializer: attach the session images once per worker."""
+    _worker['extractor'] = GlyphExtractor()
+    _worker['binary_shm'], _worker['binary'] = attach_image(binary_desc)
+    if original_desc is not None:
+        _worker['original_shm'], _worker['original'] = attach_image(original_desc)
+    else:
+        _worker['original'] = None
+
+
+def _build_variant(family_name, variant, glyph_jobs, ref_height, adjustments, metadata):
+    """
+    Build one variant inside a worker process.
+
+    Returns: dict with 'style_name', 'filename', 'data' (TTF bytes) or 'error'
+    """
+    style_name = variant.get('style_name') or 'Regular'
+    try:
+        creator = FontCreator(
+            font_name=variant.get('family_name') or family_name,
+            units_per_em=1024,
+            metadata=metadata,
+            style_name=style_name,
+            weight_class=int(variant.get('weight_class', 400)),
+        )
+        extract_params = {k: variant[k] for k in EXTRACT_PARAMS if variant.get(k) is not None}
+        added = add_assigned_glyphs(
+            creator, _worker['extractor'], glyph_jobs,
+            _worker['binary'], _worker['original'],
+            ref_height, adjustments, extract_params
+        )
+
+        font = creator.build_font()
+        buf = io.BytesIO()
+        font.save(buf)
+
+        filename = secure_filename(
+            variant.get('filename') or f"{creator.font_name}-{style_name}.ttf"
+        )
+        return {
+            'style_name': style_name,
+            'filename': filename,
+            'glyph_count': added,
+            'data': buf.getvalue(),
+        }
+    except Exception as e:
+        return {'style_name': style_name, 'error': str(e)}
+
+
+def build_font_family(family_name, variants, glyph_jobs, binary_image, original_image,
+                      ref_height, adjustments=None, metadata=None, max_workers=None):
+    """
+    Build all variants in parallel from one shared, read-only copy of the
+    session images.
+
+    Args:
+        variants: list of variant specs:
+                  {style_name, weight_class, stroke_weight, smooth_window,
+                   point_budget, family_name?, filename?}
+        max_workers: process pool size; never more than #variants or the
+                     CPU count (the default)
+
+    Returns: list of per-variant result dicts (see _build_variant), in input order
+    """
+    adjustments = adjustments or {}
+    metadata = metadata or {}
+    limit = max(1, min(len(variants), os.cpu_count() or 1))
+    max_workers = limit if max_workers is None else max(1, min(int(max_workers), limit))
+
+    binary_shm, binary_desc = share_image(binary_image)
+    original_shm, original_desc = (None, None)
+    if original_image is not None:
+        original_shm, original_desc = share_image(original_image)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(binary_desc, original_desc)) as pool:
+            futures = [
+                pool.submit(_build_variant, family_name, variant, glyph_jobs,
+                            ref_height, adjustments, metadata)
+                for variant in variants
+            ]
+            results = [f.result() for f in futures]
+    finally:
+        for shm in (binary_shm, original_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    built = sum(1 for r in results if 'error' not in r)
+    logger.info(f"Built {built}/{len(variants)} variants of '{family_name}'")
+    return results
+
+
+def family_archive(results):
+    """Pack built variants into a zip archive (bytes), with a build report."""
+    buf = io.BytesIO()
+    report = []
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for r in results:
+            if 'error' in r:
+                report.append(f"{r['style_name']}: FAILED - {r['error']}")
+                continue
+            zf.writestr(r['filename'], r['data'])
+            report.append(f"{r['style_name']}: {r['filename']} ({r['glyph_count']} glyphs)")
+        zf.writestr('build_report.txt', '\n'.join(report) + '\n')
+    return buf.getvalue()
@@ -0,0 +1,110 @@
+"""
+Fast JSON - NumPy-aware serialization for the API responses and the session
+journal
+
+numpy arrays, numpy scalars and fontTools GlyphCoordinates can be put in a
+response as they are, instead of being converted to Python lists point by
+point first. With the optional 'orjson' package they are encoded straight
+from their buffers (no intermediate lists at all); without it the standard
+json module is used and arrays go through ndarray.tolist(), which is done
+in C.
+
+coords_array() views glyph coordinates as an (n, 2) int32 array; it is also
+the compact form the font editor keeps undo snapshots and originals in.
+"""
+
+import json
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    # Fallback if orjson not installed: standard json module
+    orjson = None
+
+try:
+    from fontTools.ttLib.tables._g_l_y_f import GlyphCoordinates
+except ImportError:
+    GlyphCoordinates = None
+
+
+def coords_array(coordinates):
+    """(n, 2) int32 array of GlyphCoordinates (truncated like int())."""
+    if GlyphCoordinates is not None and isinstance(coordinates, GlyphCoordinates):
+        flat = np.frombuffer(coordinates.array, dtype=np.float64)
+    else:
+        flat = np.asarray(coordinates, dtype=np.float64)
+    return flat.reshape(-1, 2).astype(np.int32)
+
+
+def flags_array(flags):
+    """On-curve bits of glyph flags as a uint8 array."""
+    return np.frombuffer(bytes(flags), dtype=np.uint8) & 1
+
+
+def default(value):
+    """numpy / fontTools values the encoders do not handle themselves."""
+    if isinstance(value, np.ndarray):
+        if orjson is not None:
+            # non-contiguous or unusual dtype: orjson takes the C-ordered copy
+            if value.dtype.kind in 'iub':
+                return np.ascontiguousarray(value, dtype=np.int64)
+            return np.ascontiguousarray(value, dtype=np.float64)
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if GlyphCoordinates is not None and isinstance(value, GlyphCoordinates):
+        return coords_array(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                   | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                   if orjson is not None else 0)
+
+
+def dumps_bytes(obj, sort_keys=False, indent=False, default=default):
+    """UTF-8 JSON of obj."""
+    if orjson is not None:
+        option = _ORJSON_OPTIONS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, default=default, ensure_ascii=False, sort_keys=sort_keys,
+                      indent=2 if indent else None,
+                      separators=None if indent else (',', ':')).encode('utf-8')
+
+
+def dumps(obj, **kwargs):
+    return dumps_bytes(obj, **kwargs).decode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider using dumps_bytes(): jsonify() accepts numpy arrays,
+    numpy scalars and GlyphCoordinates. Set with app.json = FastJSONProvider(app).
+    """
+
+    def default_for(self, value):
+        try:
+            return default(value)
+        except TypeError:
+            # dates, decimals, dataclasses, ... as Flask encodes them
+            return DefaultJSONProvider.default(value)
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {'indent', 'separators', 'sort_keys', 'ensure_ascii'}:
+            kwargs.setdefault('default', self.default_for)
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys),
+                     indent=bool(kwargs.get('indent')), default=self.default_for)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = dumps_bytes(obj, sort_keys=self.sort_keys, indent=indent,
+                           default=self.default_for)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
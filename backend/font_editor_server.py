@@ -25,8 +25,22 @@ _temp_dir = os.path.join(_project_root, 'temp')
 os.makedirs(_fonts_dir, exist_ok=True)
 os.makedirs(_temp_dir, exist_ok=True)
 
+sys.path.insert(0, _project_root)
+from config import Config
+try:
+    from backend.storage_manager import StorageManager
+    from backend.metrics import MetricsRegistry, install_metrics
+    from backend.compression import CompressionCache, install_compression, precompress_folder
+    from backend.fast_json import FastJSONProvider, coords_array, flags_array
+except ImportError:
+    from storage_manager import StorageManager
+    from metrics import MetricsRegistry, install_metrics
+    from compression import CompressionCache, install_compression, precompress_folder
+    from fast_json import FastJSONProvider, coords_array, flags_array
+
 app = Flask(__name__, static_folder=_editor_dir, static_url_path='')
 CORS(app)
+app.json = FastJSONProvider(app)  # glyph coordinates go out as arrays, not lists
 
 # --------------- editor state ---------------
 editor_state = {
@@ -40,6 +54,51 @@ editor_state = {
 
 MAX_HISTORY = 50
 
+# Uploaded fonts (edit_*.ttf) are bounded like the font maker's uploads; the
+# open font is a reference, which also keeps the maker's sweeper from
+# removing it from fonts_output/
+storage_manager = StorageManager(min_age=Config.STORAGE_MIN_AGE,
+                                 interval=Config.STORAGE_SWEEP_INTERVAL)
+storage_manager.add_area('edits', _temp_dir, ['edit_*'],
+                         max_bytes=Config.UPLOAD_QUOTA_MB * 1024 * 1024,
+                         max_age=Config.UPLOAD_MAX_AGE)
+storage_manager.add_references(lambda: [editor_state['font_path']])
+storage_manager.start()
+
+
+# Request telemetry at /api/metrics (Prometheus text format)
+metrics = MetricsRegistry(prefix='hfm_editor')
+
+
+def _collect_metrics():
+    font = editor_state['font']
+    yield ('hfm_editor_font_loaded', 'gauge', '1 while a font is open', {},
+           1 if font is not None else 0)
+    yield ('hfm_editor_glyphs', 'gauge', 'Glyphs in the open font', {},
+           len(font.getGlyphOrder()) if font is not None else 0)
+    yield ('hfm_editor_undo_entries', 'gauge', 'Undo snapshots held for the open font', {},
+           sum(len(h['undo']) + len(h['redo']) for h in editor_state['history'].values()))
+    compressed = compression_cache.stats()
+    for result, count in (('hit', compressed['hits']), ('miss', compressed['misses'])):
+        yield ('hfm_editor_cache_lookups_total', 'counter', 'Cache lookups by result',
+               {'cache': 'compression', 'result': result}, count)
+
+
+def _collect_shared_metrics():
+    for area, stats in storage_manager.stats()['areas'].items():
+        yield ('hfm_editor_storage_bytes', 'gauge', 'Bytes in a managed storage area',
+               {'area': area}, stats['bytes'])
+
+
+metrics.add_collector(_collect_metrics)
+metrics.add_collector(_collect_shared_metrics, shared=True)
+install_metrics(app, metrics)
+
+# gzip / brotli for font JSON and the editor page (after metrics: sizes as sent)
+compression_cache = CompressionCache(max_bytes=Config.COMPRESSION_CACHE_MB * 1024 * 1024)
+precompress_folder(compression_cache, _editor_dir, min_bytes=Config.COMPRESSION_MIN_BYTES)
+install_compression(app, compression_cache, min_bytes=Config.COMPRESSION_MIN_BYTES)
+
 
 def _snapshot_glyph(name):
     """Capture current glyph state for undo/redo."""
@@ -50,8 +109,8 @@ def _snapshot_glyph(name):
     g = glyf[name]
     snap = {}
     if hasattr(g, 'numberOfContours') and g.numberOfContours > 0 and g.coordinates is not None:
-        snap['coords'] = [[int(x), int(y)] for x, y in g.coordinates]
-        snap['flags'] = list(g.flags)
+        snap['coords'] = coords_array(g.coordinates)
+        snap['flags'] = bytes(g.flags)
         snap['endPts'] = list(g.endPtsOfContours)
     elif hasattr(g, 'numberOfContours') and g.numberOfContours == 0:
         snap['coords'] = []
@@ -81,7 +140,7 @@ def _restore_snapshot(name, snap):
     glyf = font['glyf']
     g = glyf[name]
     if 'coords' in snap and len(snap['coords']) > 0:
-        g.coordinates = GlyphCoordinates([(c[0], c[1]) for c in snap['coords']])
+        g.coordinates = GlyphCoordinates(snap['coords'])
         g.flags = array.array('B', snap['flags'])
         g.endPtsOfContours = list(snap['endPts'])
         g.numberOfContours = len(snap['endPts'])
@@ -137,8 +196,8 @@ def _glyph_info(glyph_name):
     if hasattr(glyph, 'numberOfContours'):
         if glyph.numberOfContours > 0 and glyph.coordinates is not None:
             points = {
-                'coords': [[int(x), int(y)] for x, y in glyph.coordinates],
-                'flags': [int(f) & 1 for f in glyph.flags],
+                'coords': coords_array(glyph.coordinates),
+                'flags': flags_array(glyph.flags),
                 'endPts': list(glyph.endPtsOfContours),
             }
         elif glyph.numberOfContours == -1:
@@ -202,8 +261,8 @@ def load_font():
             try:
                 g = glyf[name]
                 if hasattr(g, 'numberOfContours') and g.numberOfContours > 0 and g.coordinates is not None:
-                    entry['coords'] = [[int(x), int(y)] for x, y in g.coordinates]
-                    entry['flags'] = list(g.flags)
+                    entry['coords'] = coords_array(g.coordinates)
+                    entry['flags'] = bytes(g.flags)
                     entry['endPts'] = list(g.endPtsOfContours)
                 aw, lsb = hmtx[name]
                 entry['aw'] = aw
@@ -379,7 +438,7 @@ def reset_glyph():
         g = glyf[name]
 
         if 'coords' in orig and hasattr(g, 'numberOfContours') and g.numberOfContours > 0:
-            g.coordinates = GlyphCoordinates([(c[0], c[1]) for c in orig['coords']])
+            g.coordinates = GlyphCoordinates(orig['coords'])
             g.flags = array.array('B', orig['flags'])
             g.endPtsOfContours = list(orig['endPts'])
             g.recalcBounds(glyf)
@@ -8,12 +8,25 @@ from fontTools.ttLib import TTFont
 from fontTools.pens.recordingPen import RecordingPen
 from fontTools.pens.transformPen import TransformPen
 import os
+import time
+import hashlib
 import logging
+import threading
+import tracemalloc
+from array import array
+from contextlib import contextmanager
 from config import Config
 from backend.hebrew_support import HebrewReader, HEBREW_LETTERS
 
 logger = logging.getLogger(__name__)
 
+# tracemalloc is process-wide: traced phases of concurrent builds take turns,
+# so one build never resets the peak or stops tracing under another
+_TRACE_LOCK = threading.Lock()
+# Python 3.8 has no reset_peak: peaks are then only reported for phases
+# that start tracing themselves
+_HAS_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
 class FontCreator:
     """Create TTF font from glyph data"""
     
@@ -22,10 +35,28 @@ class FontCreator:
     DESCENDER_CHARS = set('ףץןקך')
     DESCENDER_SHIFT = -200  # font units below baseline
     
-    def __init__(self, font_name='HebrewFont', units_per_em=1024, metadata=None):
+    def __init__(self, font_name='HebrewFont', units_per_em=1024, metadata=None,
+                 dedupe_outlines=True, timing_hook=None, trace_allocations=False,
+                 style_name='Regular', weight_class=400):
+        """
+        Args:
+            style_name: subfamily name, e.g. 'Light', 'Regular', 'Bold'
+            weight_class: OS/2 usWeightClass (100-900)
+            timing_hook: optional callable receiving one dict per build phase:
+                         {'phase': str, 'ms': float[, 'alloc_bytes', 'peak_bytes']}
+            trace_allocations: also measure Python allocations per phase
+                               (uses tracemalloc, noticeably slower; traced
+                               phases of concurrent builds run one at a time)
+        """
         self.font_name = font_name
         self.units_per_em = units_per_em
         self.metadata = metadata or {}
+        self.style_name = style_name or 'Regular'
+        self.weight_class = weight_class
+        self.dedupe_outlines = dedupe_outlines
+        self.timing_hook = timing_hook
+        self.trace_allocations = trace_allocations
+        self.timings = []
         self.glyphs = {}
         self.metrics = {}
         self.glyph_order = ['.notdef', 'space']
@@ -56,39 +87,12 @@ class FontCreator:
         if not contour_data:
             return False
         
-        # Get glyph name
-        if HebrewReader.is_hebrew_char(char):
-            glyph_name = HebrewReader.get_letter_name(char)
-        else:
-            glyph_name = f'uni{ord(char):04X}'
-        
-        # --- Normalize coordinates preserving aspect ratio ---
-        # Use reference_height for uniform scaling across all letters.
-        # This preserves natural proportions: a short letter stays short.
-        # Without reference_height, falls back to per-letter normalization.
-        norm_h = reference_height if reference_height else src_h
-        target_h = 750
-        base_scale = target_h / norm_h if norm_h > 0 else 1
-        scale = base_scale * scale_factor
-        target_w = int(src_w * scale)
-        
-        lsb = 50  # left side bearing
-        
-        # Convert offset from preview pixels to font units.
-        # CSS transform is: scale(S) translate(X, Y) with transformOrigin center bottom.
-        # This means translate happens in the SCALED coordinate system,
-        # so the actual visual movement is S*X and S*Y pixels.
-        # preview_display_h is the CSS max-height of the tallest letter in preview.
-        preview_display_h = 80.0
-        px_to_font = target_h / preview_display_h  # ~9.375 font units per preview pixel
-        
-        font_offset_x = round(offset_x * px_to_font * scale_factor)
-        font_offset_y = round(-offset_y * px_to_font * scale_factor)  # CSS down = font down (negative Y)
-        
-        # Descender letters: shift the entire glyph downward so the tail
-        # extends below the baseline (y=0) instead of being pushed up
-        if char in self.DESCENDER_CHARS:
-            font_offset_y += self.DESCENDER_SHIFT
+        glyph_name = self.glyph_name_for(char)
+        layout = self.glyph_layout(char, src_w, src_h, scale_factor, offset_x, offset_y,
+                                   spacing, reference_height)
+        scale = layout['scale']
+        dx = layout['dx']
+        dy = layout['dy']
         
         pen = TTGlyphPen(glyphSet=None)
         
@@ -104,8 +108,8 @@ class FontCreator:
             # - Add left side bearing offset
             font_pts = []
             for px, py in pts:
-                fx = round(px * scale) + lsb + font_offset_x
-                fy = round((src_h - py) * scale) + font_offset_y
+                fx = round(px * scale) + dx
+                fy = round((src_h - py) * scale) + dy
                 font_pts.append((fx, fy))
             
             n = len(font_pts)
@@ -144,16 +148,9 @@ class FontCreator:
         if not has_contour:
             return False
         
-        advance_width = target_w + lsb * 2
-        
-        # Apply spacing adjustment: convert from preview pixels to font units
-        if spacing != 0:
-            spacing_fu = round(spacing * px_to_font)
-            advance_width = max(100, advance_width + spacing_fu * 2)
-        
         glyph = pen.glyph()
         self.glyphs[glyph_name] = glyph
-        self.metrics[glyph_name] = (advance_width, lsb)
+        self.metrics[glyph_name] = (layout['advance_width'], layout['lsb'])
         self._char_map[ord(char)] = glyph_name
         
         if glyph_name not in self.glyph_order:
@@ -161,6 +158,69 @@ class FontCreator:
         
         return True
     
+    @staticmethod
+    def glyph_name_for(char):
+        """Glyph name used for a character (Hebrew names, uniXXXX otherwise)"""
+        if HebrewReader.is_hebrew_char(char):
+            return HebrewReader.get_letter_name(char)
+        return f'uni{ord(char):04X}'
+    
+    @classmethod
+    def glyph_layout(cls, char, src_w, src_h, scale_factor=1.0, offset_x=0, offset_y=0,
+                     spacing=0, reference_height=None):
+        """
+        Placement of a traced glyph in font units, shared by add_glyph_from_contours
+        and the metrics preview so both always agree.
+        
+        A bbox-relative point (px, py) maps to
+            fx = round(px * scale) + dx
+            fy = round((src_h - py) * scale) + dy
+        
+        Returns: {'scale', 'dx', 'dy', 'advance_width', 'lsb'}
+        """
+        # --- Normalize coordinates preserving aspect ratio ---
+        # Use reference_height for uniform scaling across all letters.
+        # This preserves natural proportions: a short letter stays short.
+        # Without reference_height, falls back to per-letter normalization.
+        norm_h = reference_height if reference_height else src_h
+        target_h = 750
+        base_scale = target_h / norm_h if norm_h > 0 else 1
+        scale = base_scale * scale_factor
+        target_w = int(src_w * scale)
+        
+        lsb = 50  # left side bearing
+        
+        # Convert offset from preview pixels to font units.
+        # CSS transform is: scale(S) translate(X, Y) with transformOrigin center bottom.
+        # This means translate happens in the SCALED coordinate system,
+        # so the actual visual movement is S*X and S*Y pixels.
+        # preview_display_h is the CSS max-height of the tallest letter in preview.
+        preview_display_h = 80.0
+        px_to_font = target_h / preview_display_h  # ~9.375 font units per preview pixel
+        
+        font_offset_x = round(offset_x * px_to_font * scale_factor)
+        font_offset_y = round(-offset_y * px_to_font * scale_factor)  # CSS down = font down (negative Y)
+        
+        # Descender letters: shift the entire glyph downward so the tail
+        # extends below the baseline (y=0) instead of being pushed up
+        if char in cls.DESCENDER_CHARS:
+            font_offset_y += cls.DESCENDER_SHIFT
+        
+        advance_width = target_w + lsb * 2
+        
+        # Apply spacing adjustment: convert from preview pixels to font units
+        if spacing != 0:
+            spacing_fu = round(spacing * px_to_font)
+            advance_width = max(100, advance_width + spacing_fu * 2)
+        
+        return {
+            'scale': scale,
+            'dx': lsb + font_offset_x,
+            'dy': font_offset_y,
+            'advance_width': advance_width,
+            'lsb': lsb,
+        }
+    
     def add_glyph(self, char, points, width=600):
         """
         Legacy: Add glyph from a single flat list of points.
@@ -344,31 +404,139 @@ class FontCreator:
         fallback_tt.close()
         logger.info(f"Injected {injected} fallback glyphs from {os.path.basename(fallback_path)}")
     
+    @staticmethod
+    def _outline_key(glyph):
+        """
+        Hash a simple glyph's outline with its first point moved to the origin,
+        so copies that differ only by a translation share the same key.
+        
+        Returns: (digest, (first_x, first_y)) or None for empty/composite glyphs
+        """
+        if getattr(glyph, 'numberOfContours', 0) <= 0 or not glyph.coordinates:
+            return None
+        
+        coords = glyph.coordinates
+        x0, y0 = coords[0]
+        rel = array('i')
+        for x, y in coords:
+            rel.append(round(x - x0))
+            rel.append(round(y - y0))
+        
+        h = hashlib.blake2b(digest_size=16)
+        h.update(array('H', glyph.endPtsOfContours).tobytes())
+        h.update(bytes(f & 1 for f in glyph.flags))
+        h.update(rel.tobytes())
+        return h.digest(), (round(x0), round(y0))
+    
+    def _dedupe_glyph_outlines(self):
+        """
+        Replace glyphs whose outline is an exact or translated copy of an
+        earlier glyph with a TrueType composite referencing that glyph.
+        Advance widths and side bearings are left untouched in self.metrics.
+        """
+        seen = {}  # digest -> (base glyph name, base first point)
+        deduped = 0
+        
+        for glyph_name in self.glyph_order:
+            if glyph_name == '.notdef':
+                continue
+            glyph = self.glyphs.get(glyph_name)
+            key = self._outline_key(glyph) if glyph is not None else None
+            if key is None:
+                continue
+            
+            digest, (x0, y0) = key
+            if digest not in seen:
+                seen[digest] = (glyph_name, (x0, y0))
+                continue
+            
+            base_name, (bx, by) = seen[digest]
+            pen = TTGlyphPen(glyphSet=self.glyphs)
+            pen.addComponent(base_name, (1, 0, 0, 1, x0 - bx, y0 - by))
+            self.glyphs[glyph_name] = pen.glyph()
+            deduped += 1
+        
+        if deduped:
+            logger.info(f"Replaced {deduped} duplicate outlines with composite references")
+    
+    @contextmanager
+    def _phase(self, name):
+        """Time one build phase and report it to self.timings and timing_hook."""
+        started_tracing = False
+        if self.trace_allocations:
+            _TRACE_LOCK.acquire()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            if _HAS_RESET_PEAK:
+                tracemalloc.reset_peak()
+            mem_before = tracemalloc.get_traced_memory()[0]
+        
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {'phase': name, 'ms': round((time.perf_counter() - t0) * 1000, 3)}
+            if self.trace_allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                entry['alloc_bytes'] = current - mem_before
+                if started_tracing or _HAS_RESET_PEAK:
+                    entry['peak_bytes'] = peak - mem_before
+                if started_tracing:
+                    tracemalloc.stop()
+                _TRACE_LOCK.release()
+            self.timings.append(entry)
+            if self.timing_hook is not None:
+                try:
+                    self.timing_hook(entry)
+                except Exception as e:
+                    logger.debug(f"Timing hook failed for phase '{name}': {e}")
+    
     def build_font(self):
         """Build complete TTF font object"""
-        self._create_notdef_glyph()
-        self._create_space_glyph()
-        self._inject_fallback_glyphs()
+        self.timings = []
+        
+        with self._phase('notdef_space'):
+            self._create_notdef_glyph()
+            self._create_space_glyph()
+        with self._phase('fallback_injection'):
+            self._inject_fallback_glyphs()
+        if self.dedupe_outlines:
+            with self._phase('dedupe_outlines'):
+                self._dedupe_glyph_outlines()
         
         fb = FontBuilder(self.units_per_em, isTTF=True)
         
-        fb.setupGlyphOrder(self.glyph_order)
-        fb.setupCharacterMap(self._char_map)
+        with self._phase('glyph_order_cmap'):
+            fb.setupGlyphOrder(self.glyph_order)
+            fb.setupCharacterMap(self._char_map)
         
         # glyf must be set up before head/metrics for correct calculations
-        fb.setupGlyf(self.glyphs)
-        fb.setupHorizontalMetrics(self.metrics)
+        with self._phase('setup_glyf'):
+            fb.setupGlyf(self.glyphs)
+        with self._phase('setup_hmtx'):
+            fb.setupHorizontalMetrics(self.metrics)
+        
+        with self._phase('setup_tables'):
+            self._setup_tables(fb)
         
+        return fb.font
+    
+    def _setup_tables(self, fb):
+        """Set up hhea/head/name/OS2/post tables on a FontBuilder"""
         fb.setupHorizontalHeader(ascent=800, descent=-200)
         fb.setupHead(unitsPerEm=self.units_per_em, created=0, modified=0)
         
         # Build the name table dict with optional metadata
+        ps_name = self.font_name.replace(' ', '').replace('-', '')
+        if self.style_name != 'Regular':
+            ps_name = f"{ps_name}-{self.style_name.replace(' ', '')}"
         name_table = {
             'familyName': self.font_name,
-            'styleName': 'Regular',
-            'uniqueFontIdentifier': f'{self.font_name}-Regular',
-            'fullName': f'{self.font_name} Regular',
-            'psName': self.font_name.replace(' ', '').replace('-', ''),
+            'styleName': self.style_name,
+            'uniqueFontIdentifier': f'{self.font_name}-{self.style_name}',
+            'fullName': f'{self.font_name} {self.style_name}',
+            'psName': ps_name,
         }
 
         meta = self.metadata
@@ -394,17 +562,17 @@ class FontCreator:
             usWinDescent=200,
             sxHeight=500,
             sCapHeight=700,
+            usWeightClass=self.weight_class,
         )
         
         fb.setupPost()
-        
-        return fb.font
     
     def save_font(self, output_path):
         """Save font to TTF file"""
         try:
             font = self.build_font()
-            font.save(output_path)
+            with self._phase('compile_save'):
+                font.save(output_path)
             return True, output_path
         except Exception as e:
             return False, str(e)
@@ -425,6 +593,112 @@ class FontPreview:
                 }
         return preview
 
+class GlyphMetricsPreview(FontPreview):
+    """
+    Exact font-unit metrics (bbox, advance, side bearings) for traced glyphs,
+    computed without building or compiling a TTF.
+    
+    Each glyph's contours are reduced once to their pixel-space extents.
+    Because the outline transform (see FontCreator.glyph_layout) is a
+    per-axis scale followed by rounding and a translation, the font-unit
+    bbox follows directly from those extents, so re-evaluating adjustments
+    costs O(1) per glyph.
+    """
+    
+    def __init__(self, units_per_em=1024):
+        self.units_per_em = units_per_em
+        self._glyphs = {}  # char -> {'contours': list, 'src_w', 'src_h', 'extents'}
+    
+    @staticmethod
+    def _contour_extents(contour_data):
+        """(min_px, max_px, min_py, max_py) over the contours FontCreator keeps, or None"""
+        xs_min = ys_min = float('inf')
+        xs_max = ys_max = float('-inf')
+        for contour in contour_data:
+            pts = contour['points']
+            if len(pts) < 4:
+                continue  # skipped by add_glyph_from_contours
+            xs = [p[0] for p in pts]
+            ys = [p[1] for p in pts]
+            xs_min = min(xs_min, min(xs))
+            xs_max = max(xs_max, max(xs))
+            ys_min = min(ys_min, min(ys))
+            ys_max = max(ys_max, max(ys))
+        if xs_min == float('inf'):
+            return None
+        return xs_min, xs_max, ys_min, ys_max
+    
+    def set_glyph(self, char, contour_data, src_w, src_h):
+        """Register (or refresh) a glyph's contours; extents are recomputed only if they changed."""
+        entry = self._glyphs.get(char)
+        if (entry is not None and entry['contours'] is contour_data
+                and entry['src_w'] == src_w and entry['src_h'] == src_h):
+            return
+        self._glyphs[char] = {
+            'contours': contour_data,
+            'src_w': src_w,
+            'src_h': src_h,
+            'extents': self._contour_extents(contour_data or []),
+        }
+    
+    def retain(self, chars):
+        """Forget glyphs that are no longer assigned."""
+        for char in list(self._glyphs):
+            if char not in chars:
+                del self._glyphs[char]
+    
+    def glyph_metrics(self, char, adjustment=None, reference_height=None):
+        """
+        Metrics of one glyph as FontCreator would emit it.
+        
+        Args:
+            adjustment: {scale (percent), offsetX, offsetY, spacing} in preview units
+        
+        Returns: dict or None if the glyph would not be emitted from contours
+        """
+        entry = self._glyphs.get(char)
+        if entry is None or entry['extents'] is None:
+            return None
+        adj = adjustment or {}
+        src_h = entry['src_h']
+        layout = FontCreator.glyph_layout(
+            char, entry['src_w'], src_h,
+            scale_factor=adj.get('scale', 100) / 100.0,
+            offset_x=adj.get('offsetX', 0),
+            offset_y=adj.get('offsetY', 0),
+            spacing=adj.get('spacing', 0),
+            reference_height=reference_height,
+        )
+        scale, dx, dy = layout['scale'], layout['dx'], layout['dy']
+        min_px, max_px, min_py, max_py = entry['extents']
+        
+        # round() is monotonic, so the extreme points stay extreme after
+        # rounding; evaluate both ends in case scale is not positive
+        fx = (round(min_px * scale) + dx, round(max_px * scale) + dx)
+        fy = (round((src_h - max_py) * scale) + dy, round((src_h - min_py) * scale) + dy)
+        x_min, x_max = min(fx), max(fx)
+        y_min, y_max = min(fy), max(fy)
+        aw = layout['advance_width']
+        
+        return {
+            'glyph_name': FontCreator.glyph_name_for(char),
+            'advance_width': aw,
+            'lsb': layout['lsb'],
+            'bbox': {'xMin': x_min, 'yMin': y_min, 'xMax': x_max, 'yMax': y_max},
+            'left_bearing': x_min,
+            'right_bearing': aw - x_max,
+        }
+    
+    def export_metrics(self, adjustments=None, reference_height=None):
+        """Metrics for every registered glyph: { char: glyph_metrics(...) }"""
+        adjustments = adjustments or {}
+        result = {}
+        for char in self._glyphs:
+            m = self.glyph_metrics(char, adjustments.get(char), reference_height)
+            if m is not None:
+                result[char] = m
+        return result
+
 if __name__ == '__main__':
     # Test font creation
     creator = FontCreator('TestFont')
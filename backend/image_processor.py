@@ -6,22 +6,42 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
+import weakref
+import threading
+from collections import OrderedDict
 from config import Config
 
 class LetterDetector:
     """Detect letters from image using contour detection and image processing"""
     
+    # Bump when detect_letters / preprocess_image change their output, so
+    # cached detections (see detection_cache.py) are not reused
+    ALGORITHM_VERSION = 1
+    
     def __init__(self):
         self.min_size = Config.MIN_LETTER_SIZE
         self.max_size = Config.MAX_LETTER_SIZE
     
-    def load_image(self, image_path):
+    def cache_params(self):
+        """Everything besides the image and separation level that affects detection."""
+        return {
+            'version': self.ALGORITHM_VERSION,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+        }
+    
+    def load_image(self, image_path, flags=cv2.IMREAD_COLOR):
         """Load image from file"""
-        img = cv2.imread(image_path)
+        img = cv2.imread(image_path, flags)
         if img is None:
             raise ValueError(f"Failed to load image: {image_path}")
         return img
     
+    def preprocess_file(self, image_path, separation_level=1):
+        """Binary image of an image file (see preprocess_image)."""
+        return self.preprocess_image(self.load_image(image_path),
+                                     separation_level=separation_level)
+    
     def preprocess_image(self, image, separation_level=1):
         """
         Preprocess image for letter detection.
@@ -67,23 +87,76 @@ class LetterDetector:
         
         return binary
     
-    def detect_letters(self, image_path, separation_level=1):
+    def detect_letters(self, image_path, separation_level=1, progress=None):
         """
         Detect letters in image and return their bounding boxes and contours.
         
         Args:
             image_path: path to the image file
             separation_level: 0-5, controls how aggressively touching chars are separated
+            progress: optional callable progress(stage, **counts), called after
+                      each stage: preprocess, contours, filter, merge, sort
         
         Returns: list of letter dicts, original image, binary image
         """
         image = self.load_image(image_path)
         binary = self.preprocess_image(image, separation_level=separation_level)
         
-        # Find contours (binary should have white letters on black background)
-        contours, hierarchy = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        img_h, img_w = image.shape[:2]
+        if progress:
+            progress('preprocess', width=img_w, height=img_h)
+        
+        letters = self._find_letters(binary, img_w, img_h, progress)
+        letters, rows = self._reading_order(letters)
+        if progress:
+            progress('sort', letters=len(letters), rows=rows)
+        
+        return letters, image, binary
+    
+    def detect_region(self, image, region, separation_level=1, margin=16, with_binary=False):
+        """
+        Detect letters in one region of an already loaded image. Only the
+        region plus a margin is preprocessed, so the cost follows the
+        region size, not the image size.
+        
+        Args:
+            image: full original image
+            region: (x, y, w, h) in image coordinates
         
+        Returns: letters (image coordinates, reading order) whose bbox
+                 center lies inside region; with with_binary,
+                 (letters, binary crop, (x1, y1) crop origin)
+        """
         img_h, img_w = image.shape[:2]
+        x, y, w, h = region
+        x1, y1 = max(0, x - margin), max(0, y - margin)
+        x2, y2 = min(img_w, x + w + margin), min(img_h, y + h + margin)
+        binary = self.preprocess_image(image[y1:y2, x1:x2], separation_level=separation_level)
+        
+        # Size filters are relative to the whole image, not the crop
+        letters = []
+        for letter in self._find_letters(binary, img_w, img_h):
+            lx, ly, lw, lh = letter['bbox']
+            lx, ly = lx + x1, ly + y1
+            if not (x <= lx + lw / 2 < x + w and y <= ly + lh / 2 < y + h):
+                continue
+            letter['bbox'] = (lx, ly, lw, lh)
+            letter['contour'] = letter['contour'] + np.array([x1, y1], dtype=letter['contour'].dtype)
+            letters.append(letter)
+        letters, _ = self._reading_order(letters)
+        if with_binary:
+            return letters, binary, (x1, y1)
+        return letters
+    
+    def _find_letters(self, binary, img_w, img_h, progress=None):
+        """
+        Letter candidates of a binary image: contours filtered by size,
+        aspect and fill ratio, with nearby fragments (dots) merged in.
+        """
+        # Find contours (binary should have white letters on black background)
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if progress:
+            progress('contours', contours=len(contours))
         
         # Separate into "normal" letters and "tiny" fragments (potential dots)
         # We use a smaller min size for fragments so dots are not lost
@@ -133,12 +206,26 @@ class LetterDetector:
                 fragments.append(entry)
             else:
                 letters.append(entry)
+        if progress:
+            progress('filter', letters=len(letters), fragments=len(fragments))
         
         # --- Auto-merge nearby fragments (e.g. dots of ! ? ; : i) ---
         # Merge fragments into letters, and also merge small letters into larger ones
         letters = self._merge_fragments(letters, fragments)
+        if progress:
+            progress('merge', letters=len(letters))
+        
+        return letters
+    
+    @staticmethod
+    def _reading_order(letters):
+        """
+        Sort letters top-to-bottom by rows, right-to-left within a row.
         
+        Returns: (sorted letters, number of rows)
+        """
         # Sort by position: top-to-bottom first (group by rows), then right-to-left (Hebrew)
+        rows = []
         if letters:
             # Determine row grouping based on average letter height
             avg_h = np.mean([l['bbox'][3] for l in letters])
@@ -166,7 +253,7 @@ class LetterDetector:
             
             letters = sorted_letters
         
-        return letters, image, binary
+        return letters, len(rows)
     
     def _merge_fragments(self, letters, extra_fragments=None):
         """
@@ -339,8 +426,17 @@ class LetterDetector:
 class GlyphExtractor:
     """Extract glyph outlines from letter images for font creation"""
     
+    # Stroke weight is applied by thresholding a signed distance field of the
+    # glyph crop. Fields are computed once per crop and cached, so changing
+    # the weight only costs a threshold + findContours.
+    MAX_STROKE_WEIGHT = 8           # pixels, in either direction
+    STROKE_FIELD_CACHE_BYTES = 64 * 1024 * 1024
+    
     def __init__(self):
         self.font_size = Config.FONT_SIZE
+        self._field_cache = OrderedDict()  # key -> (source weakref, field, x1, y1)
+        self._field_cache_bytes = 0
+        self._field_cache_lock = threading.Lock()  # shared by request and job threads
     
     def _smooth_contour_pts(self, pts, window):
         """
@@ -359,7 +455,8 @@ class GlyphExtractor:
         smoothed = pts[indices].mean(axis=1)
         return smoothed
     
-    def extract_glyph_contours(self, binary_image, bbox, padding=4, original_image=None):
+    def extract_glyph_contours(self, binary_image, bbox, padding=4, original_image=None,
+                               smooth_window=None, point_budget=None, stroke_weight=0):
         """
         Extract all contours (outer + holes) for a single letter region
         with high fidelity for smooth font outlines.
@@ -370,6 +467,12 @@ class GlyphExtractor:
             padding: extra pixels around the bbox
             original_image: if provided, a clean Otsu threshold is done on
                             the original crop for maximum fidelity
+            smooth_window: averaging window for contour smoothing
+                           (None = automatic, < 3 = no smoothing)
+            point_budget: maximum control points per contour (None = 100)
+            stroke_weight: pixels to thicken (positive) or thin (negative)
+                           the strokes before tracing; fractional values are
+                           fine, clamped to +/-MAX_STROKE_WEIGHT
             
         Returns:
             list of dicts: [{'points': [(x,y),...], 'is_hole': bool}, ...]
@@ -378,20 +481,19 @@ class GlyphExtractor:
         x, y, w, h = bbox
         img_h, img_w = binary_image.shape[:2]
         
-        # Crop region with padding
-        x1 = max(0, x - padding)
-        y1 = max(0, y - padding)
-        x2 = min(img_w, x + w + padding)
-        y2 = min(img_h, y + h + padding)
+        stroke_weight = max(-self.MAX_STROKE_WEIGHT, min(self.MAX_STROKE_WEIGHT, stroke_weight))
         
-        # If original image is available, do a CLEAN threshold on the crop
-        # (avoids bilateral filter / CLAHE / morph-open distortion)
-        if original_image is not None:
-            orig_crop = original_image[y1:y2, x1:x2]
-            gray = cv2.cvtColor(orig_crop, cv2.COLOR_BGR2GRAY)
-            _, crop = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        if stroke_weight:
+            # Threshold the cached signed distance field instead of re-cropping
+            field, x1, y1 = self.stroke_field(binary_image, bbox, original_image)
+            crop = self.threshold_stroke_field(field, stroke_weight)
         else:
-            crop = binary_image[y1:y2, x1:x2].copy()
+            # Crop region with padding
+            x1 = max(0, x - padding)
+            y1 = max(0, y - padding)
+            x2 = min(img_w, x + w + padding)
+            y2 = min(img_h, y + h + padding)
+            crop = self._binary_crop(binary_image, original_image, x1, y1, x2, y2)
         
         # Offset from crop origin to bbox origin
         ox = x - x1  # typically = padding
@@ -405,6 +507,8 @@ class GlyphExtractor:
         if not contours or hierarchy is None:
             return []
         
+        max_points = point_budget if point_budget else 100
+        
         result = []
         hierarchy = hierarchy[0]  # shape: (N, 4)
         
@@ -424,13 +528,16 @@ class GlyphExtractor:
             n = len(pts)
             
             # Smooth the contour to remove pixel-level staircase noise
-            smooth_window = max(3, min(9, n // 50))
-            if smooth_window % 2 == 0:
-                smooth_window += 1
-            pts = self._smooth_contour_pts(pts, smooth_window)
+            if smooth_window is None:
+                window = max(3, min(9, n // 50))
+            else:
+                window = int(smooth_window)
+            if window >= 3 and window % 2 == 0:
+                window += 1  # odd, centered on the point; below 3 = no smoothing
+            pts = self._smooth_contour_pts(pts, window)
             
             # Subsample to a reasonable number of control points
-            target_n = max(24, min(100, n // 4))
+            target_n = max(min(24, max_points), min(max_points, n // 4))
             if n > target_n:
                 indices = np.round(np.linspace(0, n - 1, target_n)).astype(int)
                 pts = pts[indices]
@@ -444,6 +551,72 @@ class GlyphExtractor:
         
         return result
     
+    def _binary_crop(self, binary_image, original_image, x1, y1, x2, y2):
+        """Binary crop (white glyph on black) of a region, as used for tracing."""
+        # If original image is available, do a CLEAN threshold on the crop
+        # (avoids bilateral filter / CLAHE / morph-open distortion)
+        if original_image is not None:
+            orig_crop = original_image[y1:y2, x1:x2]
+            gray = cv2.cvtColor(orig_crop, cv2.COLOR_BGR2GRAY)
+            _, crop = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+            return crop
+        return binary_image[y1:y2, x1:x2].copy()
+    
+    def stroke_field(self, binary_image, bbox, original_image=None):
+        """
+        Signed distance field of a glyph crop: positive inside the strokes,
+        negative outside, zero half a pixel from the edge. Cached per crop.
+        
+        Returns: (field float32 array, x1, y1) — crop origin in image coords
+        """
+        x, y, w, h = (int(v) for v in bbox)
+        source = original_image if original_image is not None else binary_image
+        key = (id(source), x, y, w, h)
+        
+        with self._field_cache_lock:
+            cached = self._field_cache.get(key)
+            if cached is not None and cached[0]() is source:
+                self._field_cache.move_to_end(key)
+                return cached[1], cached[2], cached[3]
+        
+        img_h, img_w = binary_image.shape[:2]
+        padding = self.MAX_STROKE_WEIGHT + 2
+        x1 = max(0, x - padding)
+        y1 = max(0, y - padding)
+        x2 = min(img_w, x + w + padding)
+        y2 = min(img_h, y + h + padding)
+        crop = self._binary_crop(binary_image, original_image, x1, y1, x2, y2)
+        
+        dist_in = cv2.distanceTransform(crop, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        dist_out = cv2.distanceTransform(cv2.bitwise_not(crop), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+        field = np.where(crop > 0, dist_in - 0.5, 0.5 - dist_out).astype(np.float32)
+        
+        self._cache_field(key, source, field, x1, y1)
+        return field, x1, y1
+    
+    def _cache_field(self, key, source, field, x1, y1):
+        """Insert a field into the byte-bounded LRU cache."""
+        with self._field_cache_lock:
+            old = self._field_cache.pop(key, None)
+            if old is not None:
+                self._field_cache_bytes -= old[1].nbytes
+            self._field_cache[key] = (weakref.ref(source), field, x1, y1)
+            self._field_cache_bytes += field.nbytes
+            while self._field_cache_bytes > self.STROKE_FIELD_CACHE_BYTES and len(self._field_cache) > 1:
+                _, evicted = self._field_cache.popitem(last=False)
+                self._field_cache_bytes -= evicted[1].nbytes
+    
+    def clear_stroke_cache(self):
+        """Drop all cached distance fields (e.g. after a new upload)."""
+        with self._field_cache_lock:
+            self._field_cache.clear()
+            self._field_cache_bytes = 0
+    
+    @staticmethod
+    def threshold_stroke_field(field, stroke_weight):
+        """Binary crop with strokes grown (positive) or shrunk (negative) by stroke_weight px."""
+        return np.where(field > -stroke_weight, 255, 0).astype(np.uint8)
+    
     def contour_to_bezier_points(self, contour, num_points=100):
         """
         Legacy: Convert contour to bezier curve points.
@@ -0,0 +1,351 @@
+"""
+Background job queue - runs CPU-heavy requests (detection, font generation)
+on a worker pool with per-session concurrency caps and cancellation of
+superseded jobs
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function at a checkpoint once the job is cancelled."""
+
+
+class Job:
+    """One unit of background work and its (JSON-serializable) outcome."""
+
+    SAVE_INTERVAL = 0.5  # seconds between record writes for progress events
+
+    def __init__(self, session_id, kind, group, fn, args, kwargs, record_dir=None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.kind = kind
+        self.group = group
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.payload = None      # result dict of the job function
+        self.status_code = None  # HTTP status of the result
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.events = []  # progress events, see emit()
+        self._cancel = threading.Event()
+        self._changed = threading.Condition()
+        self._record_dir = record_dir  # shared mode: where the job record is mirrored
+        self._saved = 0  # time of the last record write
+
+    @property
+    def cancelled(self):
+        # In shared mode another worker cancels by dropping a marker file
+        if (not self._cancel.is_set() and self._record_dir is not None
+                and os.path.exists(self._path('.cancel'))):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def raise_if_cancelled(self):
+        """Checkpoint for job functions: stop before touching shared state."""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def emit(self, stage, **counts):
+        """Record a progress event {seq, stage, elapsed_ms, **counts}."""
+        with self._changed:
+            event = {
+                'seq': len(self.events),
+                'stage': stage,
+                'elapsed_ms': round((time.time() - (self.started or self.created)) * 1000, 1),
+            }
+            event.update(counts)
+            self.events.append(event)
+            # The record holds every event: rewriting it per event is quadratic
+            if time.time() - self._saved >= self.SAVE_INTERVAL:
+                self.save()
+            self._changed.notify_all()
+
+    def progress(self, stage, **counts):
+        """Progress callback for job functions: emit, then honour cancellation."""
+        self.emit(stage, **counts)
+        self.raise_if_cancelled()
+
+    def wait_events(self, since, timeout=None):
+        """
+        Block until there are events after index 'since' or the job finishes.
+        
+        Returns: (new events, finished) - finished is True once the job is
+                 over and no events follow the returned ones
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(self.events) > since or self.status in FINISHED_STATES,
+                timeout=timeout)
+            return self.events[since:], self.status in FINISHED_STATES
+
+    def _set_finished(self, status):
+        with self._changed:
+            self.status = status
+            self.finished = time.time()
+            try:
+                try:
+                    self.save()
+                except (TypeError, ValueError):
+                    # Result is not JSON-serializable: fail the job instead
+                    logger.exception(f"Job {self.id} ({self.kind}) result could not be saved")
+                    self.status = FAILED
+                    self.payload = {'error': 'Job result is not serializable'}
+                    self.status_code = 500
+                    self.save()
+            except Exception as e:
+                logger.warning(f"Could not write record of job {self.id}: {e}")
+            finally:
+                self._changed.notify_all()
+
+    # ---------- shared mode records ----------
+
+    def _path(self, suffix='.json'):
+        return os.path.join(self._record_dir, self.id + suffix)
+
+    def record(self):
+        return {
+            'job_id': self.id, 'session_id': self.session_id, 'kind': self.kind,
+            'group': self.group, 'status': self.status, 'created': self.created,
+            'started': self.started, 'finished': self.finished,
+            'payload': self.payload, 'status_code': self.status_code,
+            'events': self.events,
+        }
+
+    def save(self):
+        """Mirror the job to its record file (shared mode only)."""
+        if self._record_dir is None:
+            return
+        data = json.dumps(self.record())
+        path = self._path()
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._saved = time.time()
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        info = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created': self.created,
+            'queued_ms': round(((self.started or end) - self.created) * 1000, 1),
+        }
+        if self.started:
+            info['elapsed_ms'] = round((end - self.started) * 1000, 1)
+        if self.status == FAILED and self.payload:
+            info['error'] = self.payload.get('error')
+        return info
+
+
+class _RemoteJob(Job):
+    """Read-only view of a job run by another worker process (shared mode)."""
+
+    def __init__(self, record, record_dir):
+        super().__init__(record['session_id'], record['kind'], record['group'],
+                         None, (), {}, record_dir)
+        self.id = record['job_id']
+        self._apply(record)
+
+    def _apply(self, record):
+        for key in ('status', 'created', 'started', 'finished', 'payload',
+                    'status_code', 'events'):
+            setattr(self, key, record[key])
+
+    def refresh(self):
+        try:
+            with open(self._path(), encoding='utf-8') as f:
+                self._apply(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def cancel(self):
+        with open(self._path('.cancel'), 'w'):
+            pass
+        self._cancel.set()
+
+    def save(self):
+        pass  # owned by another worker
+
+    def wait_events(self, since, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self.refresh()
+            finished = self.status in FINISHED_STATES
+            if len(self.events) > since or finished or (deadline and time.time() >= deadline):
+                return self.events[since:], finished
+            time.sleep(0.2)
+
+
+class JobQueue:
+    """
+    In-process job queue on a thread pool (OpenCV and fontTools' heavy
+    parts release the GIL, and jobs share the session state in memory).
+
+    - at most per_session jobs of one session run at a time; the rest wait
+      in that session's FIFO
+    - submitting a job with a group cancels the session's queued or running
+      jobs of the same group (e.g. a redetect supersedes a running upload)
+    - finished jobs are kept for result_ttl seconds
+
+    With shared_dir (several worker processes) every job is mirrored to a
+    JSON record there, so status, results, progress events, cancellation
+    and superseding work from any worker. The per-session cap applies per
+    worker process.
+    """
+
+    def __init__(self, max_workers=2, per_session=1, result_ttl=600, shared_dir=None):
+        self.per_session = max(1, per_session)
+        self.result_ttl = result_ttl
+        self.shared_dir = shared_dir
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                            thread_name_prefix='job')
+        self._jobs = OrderedDict()  # job_id -> Job, in submission order
+        self._pending = {}          # session_id -> deque of queued Jobs
+        self._running = {}          # session_id -> number of running jobs
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, kind, fn, *args, group=None, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs). fn returns (payload dict, status code)
+        and should call job.raise_if_cancelled() before committing results.
+        """
+        job = Job(session_id, kind, group, fn, args, kwargs, record_dir=self.shared_dir)
+        with self._lock:
+            self._purge()
+            if group is not None:
+                others = list(self._jobs.values())
+                if self.shared_dir:
+                    others += [j for j in self._remote_jobs() if j.id not in self._jobs]
+                for other in others:
+                    if (other.session_id == session_id and other.group == group
+                            and other.status in (QUEUED, RUNNING)):
+                        other.cancel()
+                        logger.info(f"Job {other.id} ({other.kind}) superseded by {job.id}")
+            self._jobs[job.id] = job
+            job.save()
+            self._pending.setdefault(session_id, deque()).append(job)
+            self._dispatch(session_id)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.shared_dir and _JOB_ID_RE.match(job_id or ''):
+            job = self._load_remote(os.path.join(self.shared_dir, job_id + '.json'))
+        return job
+
+    def _load_remote(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return _RemoteJob(json.load(f), self.shared_dir)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _remote_jobs(self):
+        for entry in os.scandir(self.shared_dir):
+            if entry.name.endswith('.json'):
+                job = self._load_remote(entry.path)
+                if job is not None:
+                    yield job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def _dispatch(self, session_id):
+        """Start queued jobs of a session up to the cap (lock held)."""
+        pending = self._pending.get(session_id)
+        while pending and self._running.get(session_id, 0) < self.per_session:
+            job = pending.popleft()
+            if job.cancelled:
+                job._set_finished(CANCELLED)
+                continue
+            job.status = RUNNING
+            job.started = time.time()
+            job.save()
+            self._running[session_id] = self._running.get(session_id, 0) + 1
+            self._executor.submit(self._run, job)
+        if not pending:
+            self._pending.pop(session_id, None)
+
+    def _run(self, job):
+        status = FAILED
+        try:
+            job.raise_if_cancelled()
+            payload, status_code = job.fn(job, *job.args, **job.kwargs)
+            job.payload, job.status_code = payload, status_code
+            status = DONE if status_code < 400 else FAILED
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            job.payload, job.status_code = {'error': str(e)}, 500
+            status = FAILED
+        finally:
+            job.fn = job.args = job.kwargs = None
+            job._set_finished(status)
+            with self._lock:
+                count = self._running.get(job.session_id, 1) - 1
+                if count > 0:
+                    self._running[job.session_id] = count
+                else:
+                    self._running.pop(job.session_id, None)
+                self._dispatch(job.session_id)
+
+    def _purge(self):
+        """Forget finished jobs older than result_ttl (lock held)."""
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.status in FINISHED_STATES and j.finished < cutoff]:
+            del self._jobs[job_id]
+        if self.shared_dir:
+            for job in self._remote_jobs():
+                if job.status in FINISHED_STATES and job.finished < cutoff:
+                    for suffix in ('.json', '.cancel'):
+                        try:
+                            os.remove(job._path(suffix))
+                        except FileNotFoundError:
+                            pass
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; with wait, let the running ones finish."""
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
@@ -0,0 +1,336 @@
+"""
+Metrics - per-route request telemetry and component gauges, served in the
+Prometheus text format at /api/metrics (font maker and font editor)
+
+Recorded for every request, labelled by route (the URL rule, so
+/api/crop/<image_id>/<bbox> is one route), method and status:
+    <prefix>_http_request_duration_seconds   histogram
+    <prefix>_http_request_size_bytes         histogram
+    <prefix>_http_response_size_bytes        histogram (when the size is known)
+    <prefix>_http_errors_total               counter (status >= 400)
+Apps add their own samples (session memory, caches, job queue, ...) with
+add_collector(); collectors that read state every process sees the same
+way (disk caches, storage folders) are added with shared=True.
+
+With shared_dir (several worker processes, see serve.py) each worker
+writes its values to <shared_dir>/<pid>.json at most every flush_interval
+seconds: counters and histograms from the request path, collector samples
+refreshed by a background thread (so no request pays for them).
+/api/metrics then reports counters and histograms summed over all workers
+(including exited ones, so counters never go back), gauges summed over
+the live workers, and the shared collectors once, from the serving process.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from flask import Response, g, request
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216, 67108864)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')
+                                     .replace('\n', '\\n'))
+                    for k, v in pairs)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """Counters, histograms and collected samples of one app process."""
+
+    def __init__(self, prefix='hfm', shared_dir=None, flush_interval=1.0):
+        self.prefix = prefix
+        self.shared_dir = shared_dir
+        self.flush_interval = flush_interval
+        self._help = {}        # name -> (type, help text)
+        self._counters = {}    # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self._buckets = {}     # histogram name -> bucket bounds
+        self._collectors = []  # [(collect, shared)]
+        self._collected = {'counters': {}, 'gauges': {}}  # last local collector samples
+        self._lock = threading.Lock()
+        self._last_flush = 0
+        self._thread = None
+        self._stop = threading.Event()
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+        p = prefix
+        self.describe(f'{p}_http_request_duration_seconds', 'histogram',
+                      'Request latency by route', LATENCY_BUCKETS)
+        self.describe(f'{p}_http_request_size_bytes', 'histogram',
+                      'Request body size by route', SIZE_BUCKETS)
+        self.describe(f'{p}_http_response_size_bytes', 'histogram',
+                      'Response body size by route (streamed responses excluded)', SIZE_BUCKETS)
+        self.describe(f'{p}_http_errors_total', 'counter',
+                      'Responses with status >= 400 by route')
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._help[name] = (kind, help_text)
+        if buckets is not None:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name, labels, value=1):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._buckets[name]
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def add_collector(self, collect, shared=False):
+        """
+        collect() returns an iterable of samples
+        (name, 'gauge' | 'counter', help text, labels dict, value).
+        shared: the samples describe state all worker processes share (files
+        on disk); they are collected only when rendering, by the serving
+        process, and never summed over workers.
+        """
+        self._collectors.append((collect, shared))
+
+    def start(self):
+        """Shared mode: refresh collector samples and flush on a daemon thread."""
+        if self._thread is not None or not self.shared_dir:
+            return
+        self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush(refresh=True)
+            except Exception:
+                logger.exception("Metrics flush failed")
+
+    def observe_request(self, route, method, status, seconds, request_bytes, response_bytes):
+        p = self.prefix
+        labels = {'route': route, 'method': method}
+        self.observe(f'{p}_http_request_duration_seconds', labels, seconds)
+        self.observe(f'{p}_http_request_size_bytes', labels, request_bytes)
+        if response_bytes is not None:
+            self.observe(f'{p}_http_response_size_bytes', labels, response_bytes)
+        if status >= 400:
+            self.inc(f'{p}_http_errors_total', dict(labels, status=status))
+        if self.shared_dir and time.time() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    # ---------- collection ----------
+
+    def _run_collectors(self, shared):
+        """{'counters': {name: {key: v}}, 'gauges': ...} of the local or shared collectors."""
+        counters = {}
+        gauges = {}
+        for collect, is_shared in self._collectors:
+            if is_shared != shared:
+                continue
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                if value is None:
+                    continue
+                self._help.setdefault(name, (kind, help_text))
+                target = counters if kind == 'counter' else gauges
+                series = target.setdefault(name, {})
+                key = _label_key(labels)
+                series[key] = series.get(key, 0) + value
+        return {'counters': counters, 'gauges': gauges}
+
+    def _collect(self, refresh=True):
+        """
+        {'counters': {name: {key: v}}, 'gauges': ..., 'histograms': ...} of
+        this process. refresh=False reuses the last local collector samples.
+        """
+        if refresh:
+            self._collected = self._run_collectors(shared=False)
+        collected = self._collected
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(state) for key, state in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, series in collected['counters'].items():
+            target = counters.setdefault(name, {})
+            for key, value in series.items():
+                target[key] = target.get(key, 0) + value
+        gauges = {name: dict(series) for name, series in collected['gauges'].items()}
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def flush(self, refresh=False):
+        """Write this worker's values for the others (shared mode)."""
+        self._last_flush = time.time()
+        data = self._collect(refresh)
+        encoded = {kind: {name: [[list(map(list, key)), value] for key, value in series.items()]
+                          for name, series in values.items()}
+                   for kind, values in data.items()}
+        encoded['help'] = {name: list(info) for name, info in self._help.items()}
+        path = os.path.join(self.shared_dir, f'{os.getpid()}.json')
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(encoded, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics file: {e}")
+        return data
+
+    def _merged(self):
+        if not self.shared_dir:
+            merged = self._collect()
+        else:
+            merged = self._merged_workers()
+        # Shared state: reported once, as seen by this process
+        shared = self._run_collectors(shared=True)
+        for kind in ('counters', 'gauges'):
+            for name, series in shared[kind].items():
+                merged[kind].setdefault(name, {}).update(series)
+        return merged
+
+    def _merged_workers(self):
+        merged = self.flush(refresh=True)
+        own = f'{os.getpid()}.json'
+        for entry in os.scandir(self.shared_dir):
+            if not entry.name.endswith('.json') or entry.name == own:
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as f:
+                    other = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, info in other.get('help', {}).items():
+                self._help.setdefault(name, tuple(info))
+            alive = _pid_alive(int(entry.name[:-5])) if entry.name[:-5].isdigit() else False
+            for kind in ('counters', 'histograms', 'gauges'):
+                if kind == 'gauges' and not alive:
+                    continue
+                for name, series in other.get(kind, {}).items():
+                    target = merged[kind].setdefault(name, {})
+                    for key, value in series:
+                        key = tuple(tuple(pair) for pair in key)
+                        if kind == 'histograms':
+                            state = target.get(key)
+                            target[key] = (value if state is None
+                                           else [a + b for a, b in zip(state, value)])
+                        else:
+                            target[key] = target.get(key, 0) + value
+        return merged
+
+    # ---------- exposition ----------
+
+    def render(self):
+        data = self._merged()
+        lines = []
+
+        def header(name, default_kind):
+            kind, help_text = self._help.get(name, (default_kind, ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for kind in ('counters', 'gauges'):
+            for name in sorted(data[kind]):
+                header(name, kind[:-1])
+                for key, value in sorted(data[kind][name].items()):
+                    lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+
+        # Hit ratio per cache, from the (summed) lookup counters
+        lookups = data['counters'].get(f'{self.prefix}_cache_lookups_total', {})
+        ratios = {}
+        for key, value in lookups.items():
+            labels = dict(key)
+            cache = labels.get('cache')
+            hits, total = ratios.get(cache, (0, 0))
+            ratios[cache] = (hits + (value if labels.get('result') == 'hit' else 0), total + value)
+        if ratios:
+            name = f'{self.prefix}_cache_hit_ratio'
+            lines.append(f'# HELP {name} Cache hits / lookups since start')
+            lines.append(f'# TYPE {name} gauge')
+            for cache, (hits, total) in sorted(ratios.items()):
+                ratio = hits / total if total else 0
+                lines.append(f'{name}{_format_labels((("cache", cache),))} {_format_value(ratio)}')
+
+        for name in sorted(data['histograms']):
+            header(name, 'histogram')
+            buckets = self._buckets.get(name, ())
+            for key, state in sorted(data['histograms'][name].items()):
+                for bound, count in zip(buckets, state):
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", _format_value(bound))])} {count}')
+                lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {state[-1]}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_value(state[-2])}')
+                lines.append(f'{name}_count{_format_labels(key)} {state[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def install_metrics(app, registry):
+    """Time every request of a Flask app and serve /api/metrics."""
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            registry.observe_request(route, request.method, response.status_code,
+                                     time.perf_counter() - start,
+                                     request.content_length or 0,
+                                     response.content_length)  # None when streamed
+        return response
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    registry.start()
+    return registry
@@ -0,0 +1,257 @@
+"""
+Project files (.hfm) - save / load of a font maker project
+
+v1 / v2: one JSON document (images as base64 PNG, contours as nested lists)
+v3: a zip container
+    manifest.json   - the small part: font name, assignments, adjustments, ...
+    original.png    - original image (stored, PNG is already compressed)
+    binary.png      - binary image used for contour extraction
+    detections.npz  - packed detection arrays: bboxes, areas, fill ratios,
+                      and all contour points concatenated, with offsets
+    glyphs.npz      - optional: the extracted glyph outlines of the assigned
+                      letters (see pack_glyph_contours), so a font can be
+                      regenerated without re-running extraction. Valid only
+                      for the image whose content hash the manifest records
+"""
+
+import io
+import json
+import base64
+import zipfile
+import cv2
+import numpy as np
+
+HFM_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+MANIFEST_NAME = 'manifest.json'
+ORIGINAL_NAME = 'original.png'
+BINARY_NAME = 'binary.png'
+DETECTIONS_NAME = 'detections.npz'
+GLYPHS_NAME = 'glyphs.npz'
+
+
+def pack_detections(letters):
+    """Detection list -> dict of flat arrays (one concatenated contour buffer)."""
+    contours = [np.asarray(l.get('contour') if l.get('contour') is not None else [],
+                           dtype=np.int32).reshape(-1, 2) for l in letters]
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    if contours:
+        offsets[1:] = np.cumsum([len(c) for c in contours])
+    return {
+        'bboxes': np.array([l['bbox'] for l in letters], dtype=np.int32).reshape(-1, 4),
+        'areas': np.array([l['area'] for l in letters], dtype=np.float64),
+        'fill_ratios': np.array([l['fill_ratio'] for l in letters], dtype=np.float64),
+        'points': (np.concatenate(contours) if contours else np.zeros((0, 2), dtype=np.int32)),
+        'offsets': offsets,
+    }
+
+
+def unpack_detections(arrays):
+    """Inverse of pack_detections; contours come back as OpenCV (n, 1, 2) views."""
+    bboxes = arrays['bboxes'].tolist()
+    areas = arrays['areas'].tolist()
+    fill_ratios = arrays['fill_ratios'].tolist()
+    points = arrays['points'].reshape(-1, 1, 2)
+    offsets = arrays['offsets']
+    letters = []
+    for i, bbox in enumerate(bboxes):
+        letters.append({
+            'bbox': tuple(bbox),
+            'area': areas[i],
+            'fill_ratio': fill_ratios[i],
+            'contour': points[offsets[i]:offsets[i + 1]],
+        })
+    return letters
+
+
+def pack_glyph_contours(glyph_contours):
+    """
+    Extracted glyph outlines -> (entries for the manifest, dict of flat arrays).
+
+    glyph_contours maps (bbox, extract params) keys - the contour cache keys
+    of family_builder.extract_job_contours - to contour data
+    [{'points': [(x, y), ...], 'is_hole': bool}, ...].
+    """
+    entries = []
+    contour_offsets = [0]
+    point_offsets = [0]
+    points, holes = [], []
+    for (bbox, params), contour_data in glyph_contours.items():
+        entries.append({'bbox': list(bbox), 'params': dict(params)})
+        for contour in contour_data:
+            pts = np.asarray(contour['points'], dtype=np.float64).reshape(-1, 2)
+            points.append(pts)
+            holes.append(bool(contour['is_hole']))
+            point_offsets.append(point_offsets[-1] + len(pts))
+        contour_offsets.append(len(holes))
+    arrays = {
+        'contour_offsets': np.array(contour_offsets, dtype=np.int64),
+        'point_offsets': np.array(point_offsets, dtype=np.int64),
+        'is_hole': np.array(holes, dtype=bool),
+        'points': (np.concatenate(points) if points else np.zeros((0, 2), dtype=np.float64)),
+    }
+    return entries, arrays
+
+
+def unpack_glyph_contours(entries, arrays):
+    """Inverse of pack_glyph_contours; returns a contour cache dict."""
+    contour_offsets = arrays['contour_offsets'].tolist()
+    point_offsets = arrays['point_offsets'].tolist()
+    holes = arrays['is_hole'].tolist()
+    points = arrays['points']
+    cache = {}
+    for i, entry in enumerate(entries):
+        contour_data = []
+        for c in range(contour_offsets[i], contour_offsets[i + 1]):
+            pts = points[point_offsets[c]:point_offsets[c + 1]]
+            contour_data.append({
+                'points': [(float(x), float(y)) for x, y in pts],
+                'is_hole': holes[c],
+            })
+        key = (tuple(int(v) for v in entry['bbox']), tuple(sorted(entry['params'].items())))
+        cache[key] = contour_data
+    return cache
+
+
+def write_project(path, manifest, original_image, binary_image, letters,
+                  glyph_contours=None, image_hash=None):
+    """
+    Write a v3 project container. manifest holds the JSON-serializable fields.
+    glyph_contours (see pack_glyph_contours) is stored along with image_hash,
+    the content id of original_image it was extracted from.
+    """
+    manifest = dict(manifest, version=HFM_VERSION, detection_count=len(letters))
+    images = {}
+    for name, image in ((ORIGINAL_NAME, original_image), (BINARY_NAME, binary_image)):
+        if image is not None:
+            ok, buf = cv2.imencode('.png', image)
+            if ok:
+                images[name] = buf
+    manifest['images'] = sorted(images)
+
+    packed = io.BytesIO()
+    np.savez(packed, **pack_detections(letters))
+
+    glyphs = None
+    if glyph_contours and image_hash:
+        entries, arrays = pack_glyph_contours(glyph_contours)
+        manifest['glyphs'] = {'image_hash': image_hash, 'entries': entries}
+        glyphs = io.BytesIO()
+        np.savez(glyphs, **arrays)
+
+    with zipfile.ZipFile(path, 'w') as zf:
+        # Manifest first, so readers can check the version before anything else
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False),
+                    compress_type=zipfile.ZIP_DEFLATED)
+        for name, buf in images.items():
+            zf.writestr(name, buf.tobytes(), compress_type=zipfile.ZIP_STORED)
+        zf.writestr(DETECTIONS_NAME, packed.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+        if glyphs is not None:
+            zf.writestr(GLYPHS_NAME, glyphs.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+
+
+class ProjectFile:
+    """
+    A loaded project of any version. Fields are read from the manifest (or
+    the v1/v2 JSON document); images and detections are decoded on demand.
+    """
+
+    def __init__(self, manifest, archive=None):
+        self.manifest = manifest
+        self.version = manifest.get('version', 1)
+        self._archive = archive
+
+    @classmethod
+    def open(cls, stream):
+        """
+        Read a project from a binary file object. v3 zips are read through
+        the (seekable) stream without loading the whole file. Check
+        .version against SUPPORTED_VERSIONS before using it.
+
+        Raises: ValueError for unreadable files
+        """
+        head = stream.read(4)
+        stream.seek(0)
+        if head == b'PK\x03\x04':
+            try:
+                archive = zipfile.ZipFile(stream)
+                manifest = json.loads(archive.read(MANIFEST_NAME).decode('utf-8'))
+            except (zipfile.BadZipFile, KeyError, json.JSONDecodeError) as e:
+                raise ValueError(f'Invalid project container: {e}')
+            project = cls(manifest, archive)
+        else:
+            try:
+                project = cls(json.loads(stream.read().decode('utf-8')))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise ValueError(f'Invalid project file (JSON): {e}')
+        return project
+
+    def get(self, key, default=None):
+        return self.manifest.get(key, default)
+
+    def image_bytes(self, binary=False):
+        """Encoded PNG bytes of the original (or binary) image, or None."""
+        if self._archive is not None:
+            name = BINARY_NAME if binary else ORIGINAL_NAME
+            if name not in self.manifest.get('images', []):
+                return None
+            return self._archive.read(name)
+        b64 = self.manifest.get('binary_b64' if binary else 'image_b64')
+        return base64.b64decode(b64) if b64 else None
+
+    def decode_image(self, binary=False):
+        data = self.image_bytes(binary)
+        if data is None:
+            return None
+        flags = cv2.IMREAD_GRAYSCALE if binary else cv2.IMREAD_COLOR
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+    def saved_detections(self):
+        """
+        Saved detections with contours (v2, v3), or None when the file only
+        has bboxes (v1) and detection has to be re-run.
+        """
+        if self._archive is not None:
+            with self._archive.open(DETECTIONS_NAME) as f:
+                with np.load(io.BytesIO(f.read())) as arrays:
+                    return unpack_detections(arrays)
+        saved = self.manifest.get('detections', [])
+        if self.version < 2 or not saved or 'contour' not in saved[0]:
+            return None
+        letters = []
+        for det in saved:
+            entry = {
+                'bbox': tuple(det['bbox']),
+                'area': det['area'],
+                'fill_ratio': det['fill_ratio'],
+            }
+            if det.get('contour') is not None:
+                entry['contour'] = np.array(det['contour'], dtype=np.int32)
+            else:
+                entry['contour'] = np.array([], dtype=np.int32)
+            letters.append(entry)
+        return letters
+
+    def saved_bboxes(self):
+        """Bboxes of the saved detections, for re-matching assignments (v1)."""
+        if self._archive is not None:
+            return [l['bbox'] for l in self.saved_detections()]
+        return [tuple(d['bbox']) for d in self.manifest.get('detections', [])]
+
+    def saved_glyph_contours(self, image_hash):
+        """
+        Contour cache entries saved with the project, or None when there are
+        none or they were extracted from a different image than image_hash.
+        """
+        info = self.manifest.get('glyphs')
+        if (self._archive is None or not info or info.get('image_hash') != image_hash
+                or GLYPHS_NAME not in self._archive.namelist()):
+            return None
+        with self._archive.open(GLYPHS_NAME) as f:
+            with np.load(io.BytesIO(f.read())) as arrays:
+                return unpack_glyph_contours(info.get('entries', []), arrays)
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
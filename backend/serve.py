@@ -0,0 +1,180 @@
+"""
+Production server - runs the font maker (or the font editor) without the
+Werkzeug debugger, on several worker processes
+
+Usage:
+    python backend/serve.py [--app maker|editor] [--host HOST] [--port PORT]
+                            [--workers N] [--max-rss-mb MB] [--session-memory-mb MB]
+
+Defaults come from Config (SERVER_* / WORKER_MAX_RSS_MB, or the HFM_*
+environment variables). On POSIX the listening socket is opened once and
+N worker processes are forked to accept on it; sessions and job records
+are shared through temp/ (images as memory-mapped .npy files, see
+SessionStore), so any worker can serve any request. A worker whose peak
+RSS exceeds --max-rss-mb finishes its requests and jobs and is replaced.
+Where fork is unavailable (Windows), or for the font editor, which keeps
+a single font and its undo history in memory, one threaded process is used.
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import argparse
+import threading
+
+# Ensure parent directory is in path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+from config import Config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _load_app(name):
+    """Import the Flask app (in the worker, after fork, so each worker owns its pools)."""
+    if name == 'editor':
+        from backend.font_editor_server import app
+        return app, None
+    from backend import app as maker
+    return maker.app, maker.job_queue
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # Linux reports KB
+
+
+def _serve(app_name, host, port, fd=None, max_rss_mb=0):
+    """Run one worker until shut down (signal or memory limit)."""
+    app, job_queue = _load_app(app_name)
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    server.daemon_threads = False  # let in-flight requests finish on shutdown
+    stopping = threading.Event()
+
+    def stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    if max_rss_mb:
+        limit = max_rss_mb * 1024 * 1024
+
+        def check_memory():
+            if _peak_rss_bytes() > limit:
+                print(f"  worker {os.getpid()}: peak RSS above {max_rss_mb} MB, restarting")
+                stop()
+        server.service_actions = check_memory
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()  # joins request threads
+        if job_queue is not None:
+            job_queue.shutdown(wait=True)
+
+
+def _prefork(app_name, host, port, workers, max_rss_mb):
+    """Bind once, fork workers, and keep that many running until stopped."""
+    sock = socket.create_server((host, port), backlog=128)
+    # Sessions, jobs and metrics are shared between workers through these folders;
+    # anything left from a previous run is stale
+    for folder in (Config.SESSION_SPILL_FOLDER, Config.JOB_FOLDER, Config.METRICS_FOLDER):
+        shutil.rmtree(folder, ignore_errors=True)
+    Config.SHARED_STATE = True
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                _serve(app_name, host, port, fd=sock.fileno(), max_rss_mb=max_rss_mb)
+            except Exception as e:
+                print(f"  worker {os.getpid()} failed: {e}")
+                code = 1
+            os._exit(code)
+        children[pid] = time.time()
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if not stopping and started is not None:
+            if time.time() - started < 1:
+                time.sleep(1)  # don't spin on a worker that dies at startup
+            spawn()
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hebrew Font Maker production server')
+    parser.add_argument('--app', choices=('maker', 'editor'), default='maker')
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=None,
+                        help='default: SERVER_PORT (maker) / 5001 (editor)')
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS)
+    parser.add_argument('--max-rss-mb', type=int, default=Config.WORKER_MAX_RSS_MB,
+                        help='restart a worker once its peak RSS exceeds this (0 = off)')
+    parser.add_argument('--session-memory-mb', type=int, default=None,
+                        help='per-worker session memory cap (SESSION_MEMORY_CAP_MB)')
+    args = parser.parse_args(argv)
+
+    port = args.port or (5001 if args.app == 'editor' else Config.SERVER_PORT)
+    if args.session_memory_mb is not None:
+        Config.SESSION_MEMORY_CAP_MB = args.session_memory_mb
+
+    workers = max(1, args.workers)
+    if args.app == 'editor' and workers > 1:
+        print("  The font editor keeps one font in memory; serving it on a single process")
+        workers = 1
+    if workers > 1 and not hasattr(os, 'fork'):
+        print("  Multiple worker processes need fork(); serving on a single process")
+        workers = 1
+
+    print("=" * 50)
+    print(f"  Hebrew Font {'Editor' if args.app == 'editor' else 'Maker'} — "
+          f"http://{args.host}:{port} ({workers} worker{'s' if workers > 1 else ''})")
+    print("=" * 50)
+
+    if workers == 1:
+        _serve(args.app, args.host, port, max_rss_mb=0)
+    else:
+        _prefork(args.app, args.host, port, workers, args.max_rss_mb)
+
+
+if __name__ == '__main__':
+    main()
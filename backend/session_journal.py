@@ -0,0 +1,329 @@
+"""
+Session journal - append-only log of session edits, for cheap autosave and
+crash recovery
+
+Each session gets a folder under JOURNAL_FOLDER:
+    snapshot.json        - the session at journal record 'seq': image file,
+                           separation level, assignments, client state
+    snapshot-<seq>.npz   - its detections (project_file.pack_detections)
+    journal.jsonl        - one JSON record per edit after the snapshot
+    <image_id>.img       - the uploaded image file (hard link or copy)
+    binary-<hash>.npz    - the binary image (once per content; region
+                           redetect makes it differ from the upload's)
+
+Edits that replace the detections (upload, redetect, import) write a new
+snapshot; smaller edits (add / remove / merge / split, assign, autosave)
+append one line. Once journal.jsonl grows past compact_bytes it is folded
+into a snapshot. The upload is never re-encoded: recovery decodes the
+stored image file lazily, and loads the stored binary image (or re-derives
+it from the upload when none was stored) on demand.
+"""
+
+import os
+import json
+import hashlib
+import time
+import shutil
+import logging
+import threading
+from functools import partial
+import numpy as np
+from backend.project_file import pack_detections, unpack_detections
+from backend.session_store import LazyArray, valid_session_id
+from backend.fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = 'snapshot.json'
+JOURNAL_NAME = 'journal.jsonl'
+
+# Detection edits are journaled as splices: drop the 'remove' indices, then
+# insert 'letters' at index 'at' of the remaining list
+SPLICE_OPS = ('add', 'remove', 'merge', 'split')
+
+
+def letter_record(letter):
+    """JSON-serializable form of one detection."""
+    return {
+        'bbox': [int(v) for v in letter['bbox']],
+        'area': float(letter['area']),
+        'fill_ratio': float(letter['fill_ratio']),
+        'contour': np.asarray(letter['contour']).reshape(-1, 2),  # encoded by fast_json
+    }
+
+
+def _letter_from_record(record):
+    return {
+        'bbox': tuple(record['bbox']),
+        'area': record['area'],
+        'fill_ratio': record['fill_ratio'],
+        'contour': np.array(record['contour'], dtype=np.int32).reshape(-1, 1, 2),
+    }
+
+
+def _load_binary(path):
+    with np.load(path) as arrays:
+        return arrays['binary']
+
+
+def _preprocess_file(load_image, preprocess, path, separation_level):
+    return preprocess(load_image(path), separation_level=separation_level)
+
+
+def _glyphs_from_record(verified_glyphs):
+    return {char: dict(info, bbox=tuple(info['bbox'])) for char, info in verified_glyphs.items()}
+
+
+class SessionJournal:
+    """
+    Journal writer / replayer. Sessions are the SessionState dicts of
+    SessionStore; the journal position is kept in the session itself
+    ('journal_seq'), so it follows the session across worker processes.
+
+    Journal I/O never fails a request: errors are logged and the journal
+    of that session is written afresh by its next snapshot.
+    """
+
+    def __init__(self, folder, compact_bytes=1024 * 1024, retention=7 * 24 * 3600,
+                 load_image=None, preprocess=None):
+        self.folder = folder
+        self.compact_bytes = compact_bytes
+        self.retention = retention
+        # Used on recovery to rebuild the images: load_image(path) and
+        # preprocess(image, separation_level) (LetterDetector methods)
+        self.load_image = load_image
+        self.preprocess = preprocess
+        self.recoveries = 0
+        self.snapshots = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.sweep()
+
+    def _dir(self, sid):
+        return os.path.join(self.folder, sid)
+
+    # ---------- writing ----------
+
+    def snapshot(self, session):
+        """Write the whole session as the new base and empty the journal."""
+        sid = session.sid
+        if not valid_session_id(sid) or not session.get('upload_path'):
+            return
+        with self._lock:
+            try:
+                self._write_snapshot(session)
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Journal snapshot of session {sid} failed: {e}")
+
+    def record(self, session, op, **fields):
+        """Append one edit. Sessions without an image are not journaled."""
+        sid = session.sid
+        if not valid_session_id(sid) or not session.get('upload_path'):
+            return
+        with self._lock:
+            try:
+                folder = self._dir(sid)
+                if not os.path.exists(os.path.join(folder, SNAPSHOT_NAME)):
+                    self._write_snapshot(session)  # first edit after a restart
+                    return
+                seq = session.get('journal_seq', 0) + 1
+                line = dumps(dict(fields, seq=seq, op=op, ts=time.time()))
+                path = os.path.join(folder, JOURNAL_NAME)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                    size = f.tell()
+                session['journal_seq'] = seq
+                if size > self.compact_bytes:
+                    self._write_snapshot(session)
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Journal write ({op}) of session {sid} failed: {e}")
+
+    def _write_snapshot(self, session):
+        folder = self._dir(session.sid)
+        os.makedirs(folder, exist_ok=True)
+        seq = session.get('journal_seq', 0) + 1
+
+        # The image file is linked once per image, never re-encoded
+        image_name = None
+        image_id = session.get('image_id')
+        if image_id:
+            image_name = f'{image_id}.img'
+            image_path = os.path.join(folder, image_name)
+            if not os.path.exists(image_path):
+                try:
+                    os.link(session['upload_path'], image_path)
+                except OSError:
+                    shutil.copyfile(session['upload_path'], image_path)
+
+        binary_name = self._write_binary(session, folder)
+
+        detections_name = f'snapshot-{seq}.npz'
+        tmp = os.path.join(folder, f'{detections_name}.{os.getpid()}.tmp')
+        with open(tmp, 'wb') as f:
+            np.savez(f, **pack_detections(session.get('detected_letters', [])))
+        os.replace(tmp, os.path.join(folder, detections_name))
+
+        snapshot = {
+            'seq': seq,
+            'time': time.time(),
+            'image': image_name,
+            'image_id': image_id,
+            'binary': binary_name,
+            'separation_level': session.get('separation_level', 1),
+            'detections': detections_name,
+            'verified_glyphs': session.get('verified_glyphs', {}),
+            'client_state': session.get('client_state', {}),
+        }
+        tmp = os.path.join(folder, f'{SNAPSHOT_NAME}.{os.getpid()}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(dumps(snapshot))
+        os.replace(tmp, os.path.join(folder, SNAPSHOT_NAME))
+        # Records up to seq are in the snapshot now
+        open(os.path.join(folder, JOURNAL_NAME), 'w').close()
+        session['journal_seq'] = seq
+        self.snapshots += 1
+
+        for entry in os.scandir(folder):
+            if entry.name not in (SNAPSHOT_NAME, JOURNAL_NAME, detections_name, image_name,
+                                  binary_name):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _write_binary(session, folder):
+        """
+        Store the session's binary image once per content. A binary that is
+        still lazy was never changed, so recovery can re-derive it instead.
+        Returns: file name, or None
+        """
+        if session.is_lazy('binary_image'):
+            return None
+        binary = session.get('binary_image')
+        if not isinstance(binary, np.ndarray):
+            return None
+        h = hashlib.blake2b(digest_size=12)
+        h.update(repr(binary.shape).encode('ascii'))
+        h.update(np.ascontiguousarray(binary).data)
+        name = f'binary-{h.hexdigest()}.npz'
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(f, binary=binary)
+            os.replace(tmp, path)
+        return name
+
+    # ---------- recovery ----------
+
+    def has_journal(self, sid):
+        return valid_session_id(sid) and os.path.exists(os.path.join(self._dir(sid), SNAPSHOT_NAME))
+
+    def recover(self, session):
+        """
+        Rebuild an empty session from its snapshot + journal.
+
+        Returns: True if the session was restored
+        """
+        sid = session.sid
+        if session.get('upload_path') or not self.has_journal(sid):
+            return False
+        with self._lock:
+            try:
+                restored = self._replay(session)
+            except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+                logger.warning(f"Journal of session {sid} is unusable, discarding: {e}")
+                shutil.rmtree(self._dir(sid), ignore_errors=True)
+                return False
+        if restored:
+            self.recoveries += 1
+            logger.info(f"Recovered session {sid} from its journal "
+                        f"({len(session['detected_letters'])} detections)")
+        return restored
+
+    def _replay(self, session):
+        folder = self._dir(session.sid)
+        with open(os.path.join(folder, SNAPSHOT_NAME), encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if not snapshot.get('image'):
+            return False
+        image_path = os.path.join(folder, snapshot['image'])
+        if not os.path.exists(image_path):
+            return False
+        with np.load(os.path.join(folder, snapshot['detections'])) as arrays:
+            letters = unpack_detections(arrays)
+        letters = [dict(l, contour=l['contour'].copy()) for l in letters]
+        verified_glyphs = _glyphs_from_record(snapshot.get('verified_glyphs', {}))
+        client_state = snapshot.get('client_state', {})
+        seq = snapshot['seq']
+
+        journal_path = os.path.join(folder, JOURNAL_NAME)
+        if os.path.exists(journal_path):
+            with open(journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the crash: the rest is lost
+                    if record.get('seq', 0) <= seq:
+                        continue
+                    op = record['op']
+                    if op in SPLICE_OPS:
+                        remove = set(record.get('remove', []))
+                        letters = [l for i, l in enumerate(letters) if i not in remove]
+                        at = record.get('at', len(letters))
+                        letters[at:at] = [_letter_from_record(r) for r in record.get('letters', [])]
+                    elif op == 'assign':
+                        verified_glyphs = _glyphs_from_record(record['verified_glyphs'])
+                    elif op == 'autosave':
+                        client_state = record['client_state']
+                    seq = record['seq']
+
+        separation_level = snapshot.get('separation_level', 1)
+        load_image, preprocess = self.load_image, self.preprocess
+        session['upload_path'] = image_path
+        session['separation_level'] = separation_level
+        session['detected_letters'] = letters
+        session['verified_glyphs'] = verified_glyphs
+        session['client_state'] = client_state
+        session['contour_cache'] = {}
+        # Images come back lazily (as partials, so they pickle, see
+        # LazyArray); image_id is kept so crop URLs stay valid
+        session['original_image'] = LazyArray(partial(load_image, image_path))
+        binary_name = snapshot.get('binary')
+        if binary_name and os.path.exists(os.path.join(folder, binary_name)):
+            session['binary_image'] = LazyArray(
+                partial(_load_binary, os.path.join(folder, binary_name)))
+        else:
+            session['binary_image'] = LazyArray(
+                partial(_preprocess_file, load_image, preprocess, image_path, separation_level))
+        session['image_id'] = snapshot.get('image_id')
+        session['journal_seq'] = seq
+        return True
+
+    # ---------- housekeeping ----------
+
+    def drop(self, sid):
+        if valid_session_id(sid):
+            with self._lock:
+                shutil.rmtree(self._dir(sid), ignore_errors=True)
+
+    def sweep(self):
+        """Delete journals untouched for longer than retention."""
+        cutoff = time.time() - self.retention
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    journal = os.path.join(entry.path, JOURNAL_NAME)
+                    if not os.path.exists(journal) or os.path.getmtime(journal) < cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def stats(self):
+        return {
+            'journals': sum(1 for e in os.scandir(self.folder) if e.is_dir()),
+            'snapshots_written': self.snapshots,
+            'recoveries': self.recoveries,
+        }
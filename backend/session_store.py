@@ -0,0 +1,517 @@
+"""
+Session store - per-user editing sessions with memory accounting,
+LRU eviction of idle sessions and spill-to-disk of image arrays
+"""
+
+import os
+import re
+import time
+import uuid
+import pickle
+import shutil
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def valid_session_id(sid):
+    """True if sid is safe to use as a store key and file name."""
+    return bool(sid) and bool(_SESSION_ID_RE.match(sid))
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class _SpilledArray:
+    """Placeholder left in a session for an image array written to disk."""
+    __slots__ = ('path', 'nbytes')
+
+    def __init__(self, path, nbytes):
+        self.path = path
+        self.nbytes = nbytes
+
+
+class LazyArray:
+    """
+    Placeholder for an image that is only decoded on first access.
+    When load pickles (a functools.partial of a module function or bound
+    method, not a lambda), shared mode hands the image to other workers by
+    reference, still undecoded.
+    """
+    __slots__ = ('load',)
+
+    def __init__(self, load):
+        self.load = load  # callable returning the ndarray
+
+    def recipe(self):
+        """load pickled, or None if it does not pickle (closures)."""
+        try:
+            return pickle.dumps(self.load, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return None
+
+
+def _atomic_write(path, write):
+    """Write a file via a temp file + rename, so readers never see it half written."""
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+class SessionState(dict):
+    """
+    The per-session dict used by the routes (same keys as the former global
+    current_session). Image arrays may be spilled to disk by the store and
+    are transparently reloaded on access.
+    """
+
+    IMAGE_KEYS = ('original_image', 'binary_image', 'processed_image')
+    # Per-process derived data, rebuilt on demand and never shared
+    LOCAL_KEYS = ('contour_cache', 'metrics_preview', 'component_labels')
+
+    def __init__(self, sid, store):
+        super().__init__()
+        self.reset()
+        self.sid = sid
+        self.last_access = time.time()
+        self.memory_bytes = 0
+        self._store = store
+        self._stamp = None      # shared mode: state file version this copy reflects
+
+    def reset(self):
+        """Back to an empty session."""
+        self.clear()
+        self.update(
+            upload_path=None,
+            binary_path=None,       # imported binary image file, if any
+            detected_letters=[],
+            verified_glyphs={},
+            original_image=None,
+            binary_image=None,
+            image_id=None,          # content hash of original_image
+            processed_image=None,
+            contour_cache={},       # (bbox, extract params) -> contour_data
+            client_state={},        # UI state from /api/autosave (font name, assignments, ...)
+            journal_seq=0,          # last session journal record, see session_journal.py
+            font_path=None,         # last generated font (kept by the storage manager)
+        )
+        self._disk_copies = {}  # key -> (path, weakref to the array saved there)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, (_SpilledArray, LazyArray)):
+            value = self._store._reload(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def image_changed(self, key):
+        """Call after editing an image array in place: its disk copy is stale."""
+        self._disk_copies.pop(key, None)
+
+    def is_lazy(self, key):
+        """True while key holds a LazyArray that was never decoded."""
+        return isinstance(dict.get(self, key), LazyArray)
+
+    def in_memory_image_bytes(self):
+        total = 0
+        for key in self.IMAGE_KEYS:
+            value = dict.get(self, key)
+            # Memory-mapped images live in the shared page cache, not in this process
+            if isinstance(value, np.ndarray) and not isinstance(value, np.memmap):
+                total += value.nbytes
+        return total
+
+    def compute_memory(self):
+        """Approximate resident size: image arrays + detection contours + label map."""
+        total = self.in_memory_image_bytes()
+        components = dict.get(self, 'component_labels')
+        if components is not None:
+            total += components.nbytes
+        for letter in dict.get(self, 'detected_letters') or []:
+            contour = letter.get('contour')
+            if isinstance(contour, np.ndarray):
+                total += contour.nbytes
+        return total
+
+
+class SessionStore:
+    """
+    Session-id keyed store of SessionState objects.
+
+    - memory accounting: each session's size is recomputed when a request
+      releases it
+    - global cap: while the total exceeds memory_cap_bytes, image arrays of
+      the least recently used sessions (other than the one in use) are
+      spilled to spill_dir
+    - eviction: sessions idle longer than idle_timeout seconds, or beyond
+      max_sessions, are dropped along with their spill files
+
+    With shared=True (several worker processes, see backend/serve.py) the
+    session state lives in spill_dir, so any worker can serve any session:
+    images are written once as content-addressed .npy files that every
+    worker memory-maps (no re-decoding, one copy in the page cache), and the
+    rest of the state is pickled per session after each mutating request and
+    reloaded by other workers when the file is newer than their copy.
+    Concurrent writes to one session from two workers are last-writer-wins.
+    """
+
+    def __init__(self, spill_dir, memory_cap_bytes=2 * 1024 ** 3,
+                 idle_timeout=6 * 3600, max_sessions=64, shared=False):
+        self.spill_dir = spill_dir
+        self.memory_cap_bytes = memory_cap_bytes
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.shared = shared
+        self._sessions = OrderedDict()  # sid -> SessionState, LRU order
+        self._active = {}               # sid -> number of requests using it
+        self._lock = threading.RLock()
+        self.spills = 0
+        self.reloads = 0
+        self.evictions = 0
+        self._last_sweep = 0
+        if not shared:
+            # Sessions live in memory, so spill files of a previous run are
+            # orphans (in shared mode the server clears them once at startup)
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        os.makedirs(os.path.join(spill_dir, 'images'), exist_ok=True)
+
+    # ---------- access ----------
+
+    def acquire(self, sid):
+        """Get (or create) the session for sid and mark it in use."""
+        with self._lock:
+            self._evict_idle(exclude=sid)
+            state = self._sessions.get(sid)
+            if state is None:
+                state = SessionState(sid, self)
+                self._sessions[sid] = state
+            self._sessions.move_to_end(sid)
+            if self.shared and sid not in self._active:
+                self._sync_from_disk(state)
+            self._active[sid] = self._active.get(sid, 0) + 1
+            state.last_access = time.time()
+            return state
+
+    def release(self, sid, modified=True):
+        """
+        Request finished: recompute the session's memory and enforce the cap.
+        In shared mode a modified session is also written out for other workers.
+        """
+        with self._lock:
+            count = self._active.get(sid, 0) - 1
+            if count > 0:
+                self._active[sid] = count
+            else:
+                self._active.pop(sid, None)
+            state = self._sessions.get(sid)
+            if state is not None:
+                if self.shared and modified:
+                    self._persist(state)
+                state.memory_bytes = state.compute_memory()
+                state.last_access = time.time()
+            self._enforce_cap()
+
+    def drop(self, sid):
+        """Forget a session entirely (memory and spill files)."""
+        with self._lock:
+            self._sessions.pop(sid, None)
+        self._remove_spill_dir(sid)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def find_image(self, image_id, key='original_image'):
+        """Image array of any session whose image_id matches (content-addressed)."""
+        with self._lock:
+            candidates = list(self._sessions.values())
+        for state in candidates:
+            if dict.get(state, 'image_id') == image_id:
+                image = state.get(key)
+                if image is not None:
+                    return image
+        if self.shared:
+            # Session persisted by another worker
+            try:
+                with open(self._shared_index_path(image_id, key), 'rb') as f:
+                    ref = pickle.load(f)
+                if isinstance(ref, dict):
+                    return pickle.loads(ref['lazy'])()
+                return np.load(self._image_path(ref), mmap_mode='r')
+            except FileNotFoundError:
+                pass
+        return None
+
+    def persisted_count(self):
+        """Shared mode: number of sessions on disk, whichever worker holds them."""
+        try:
+            return sum(1 for entry in os.scandir(self.spill_dir)
+                       if entry.is_dir() and os.path.exists(self._state_path(entry.name)))
+        except FileNotFoundError:
+            return 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'active': len(self._active),
+                'memory_bytes': sum(s.memory_bytes for s in self._sessions.values()),
+                'memory_cap_bytes': self.memory_cap_bytes,
+                'spills': self.spills,
+                'reloads': self.reloads,
+                'evictions': self.evictions,
+            }
+
+    # ---------- eviction / spilling ----------
+
+    def _evict_idle(self, exclude=None):
+        now = time.time()
+        if self.shared:
+            self._sweep_shared(now)
+        victims = [
+            sid for sid, state in self._sessions.items()
+            if sid != exclude and sid not in self._active
+            and now - state.last_access > self.idle_timeout
+        ]
+        # Oldest first beyond max_sessions
+        overflow = len(self._sessions) - len(victims) - self.max_sessions
+        if overflow > 0:
+            for sid in self._sessions:
+                if overflow <= 0:
+                    break
+                if sid != exclude and sid not in self._active and sid not in victims:
+                    victims.append(sid)
+                    overflow -= 1
+        for sid in victims:
+            self._sessions.pop(sid, None)
+            if not self.shared:
+                # Shared state may still be in use by another worker; it is
+                # removed by _sweep_shared once idle everywhere
+                self._remove_spill_dir(sid)
+            self.evictions += 1
+            logger.info(f"Evicted idle session {sid}")
+
+    def _enforce_cap(self):
+        total = sum(s.memory_bytes for s in self._sessions.values())
+        if total <= self.memory_cap_bytes:
+            return
+        for sid, state in list(self._sessions.items()):  # least recently used first
+            if total <= self.memory_cap_bytes:
+                break
+            if sid in self._active or (state.in_memory_image_bytes() == 0
+                                       and dict.get(state, 'component_labels') is None):
+                continue
+            freed = self._spill(state)
+            state.memory_bytes -= freed
+            total -= freed
+
+    def _session_dir(self, sid):
+        return os.path.join(self.spill_dir, sid)
+
+    def _remove_spill_dir(self, sid):
+        path = self._session_dir(sid)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _spill(self, state):
+        """Write a session's image arrays to disk and drop them from memory."""
+        freed = 0
+        os.makedirs(self._session_dir(state.sid), exist_ok=True)
+        for key in SessionState.IMAGE_KEYS:
+            value = dict.get(state, key)
+            if not isinstance(value, np.ndarray):
+                continue
+            path = os.path.join(self._session_dir(state.sid), f'{key}.npy')
+            disk = state._disk_copies.get(key)
+            # Images edited in place drop their disk copy (image_changed), so
+            # an array reloaded from this file need not be written again
+            if disk is None or disk[1]() is not value:
+                np.save(path, value, allow_pickle=False)
+            dict.__setitem__(state, key, _SpilledArray(path, value.nbytes))
+            freed += value.nbytes
+        components = dict.get(state, 'component_labels')
+        if components is not None:
+            # Derived from the binary image: rebuilt on the next split/merge
+            dict.__setitem__(state, 'component_labels', None)
+            freed += components.nbytes
+        if freed:
+            self.spills += 1
+            logger.info(f"Spilled {freed / 1e6:.1f} MB of session {state.sid} to disk")
+        return freed
+
+    def _reload(self, state, key, placeholder):
+        # Decode outside the store lock, so a large image does not stall
+        # every other session; install it only if the key still holds the
+        # same placeholder (another thread may have reloaded or replaced it)
+        if isinstance(placeholder, LazyArray):
+            array = placeholder.load()
+        elif self.shared:
+            array = np.load(placeholder.path, mmap_mode='r', allow_pickle=False)
+        else:
+            array = np.load(placeholder.path, allow_pickle=False)
+        with self._lock:
+            value = dict.get(state, key)
+            if value is not placeholder:
+                if not isinstance(value, (_SpilledArray, LazyArray)):
+                    return value
+            else:
+                dict.__setitem__(state, key, array)
+                if array is not None and (isinstance(placeholder, LazyArray) or not self.shared):
+                    state.memory_bytes += array.nbytes
+                if isinstance(placeholder, _SpilledArray):
+                    state._disk_copies[key] = (placeholder.path, weakref.ref(array))
+                    self.reloads += 1
+                return array
+        # Spilled again or swapped for another lazy image meanwhile
+        return self._reload(state, key, value)
+
+    # ---------- shared mode (multi-process) ----------
+
+    def _state_path(self, sid):
+        return os.path.join(self._session_dir(sid), 'state.pkl')
+
+    def _image_path(self, name):
+        return os.path.join(self.spill_dir, 'images', name)
+
+    def _shared_index_path(self, image_id, key):
+        # image_id (hash of the original image) -> file name of one of its arrays
+        return os.path.join(self.spill_dir, 'images', f'{image_id}.{key}.ref')
+
+    def _persist(self, state):
+        """
+        Write a session for other workers (images once, by content hash;
+        undecoded images by reference, see LazyArray).
+        """
+        images = {}
+        image_id = dict.get(state, 'image_id')
+        for key in SessionState.IMAGE_KEYS:
+            value = dict.get(state, key)
+            if isinstance(value, LazyArray):
+                recipe = value.recipe()
+                if recipe is not None:
+                    images[key] = {'lazy': recipe}
+                    if image_id:
+                        _atomic_write(self._shared_index_path(image_id, key),
+                                      lambda f: pickle.dump(images[key], f))
+                    continue
+                value = state[key]
+            if isinstance(value, _SpilledArray):
+                images[key] = os.path.basename(value.path)
+                continue
+            if not isinstance(value, np.ndarray):
+                images[key] = None
+                continue
+            disk = state._disk_copies.get(key)
+            if disk is not None and disk[1]() is value:
+                images[key] = os.path.basename(disk[0])
+                continue
+            h = hashlib.blake2b(digest_size=12)
+            h.update(repr((value.shape, value.dtype.str)).encode('ascii'))
+            h.update(np.ascontiguousarray(value).data)
+            name = f'{h.hexdigest()}.npy'
+            path = self._image_path(name)
+            if not os.path.exists(path):
+                _atomic_write(path, lambda f: np.save(f, value, allow_pickle=False))
+            state._disk_copies[key] = (path, weakref.ref(value))
+            images[key] = name
+            if image_id:
+                _atomic_write(self._shared_index_path(image_id, key),
+                              lambda f: pickle.dump(name, f))
+
+        data = {k: v for k, v in state.items()
+                if k not in SessionState.IMAGE_KEYS and k not in SessionState.LOCAL_KEYS}
+        data['_images'] = images
+        os.makedirs(self._session_dir(state.sid), exist_ok=True)
+        path = self._state_path(state.sid)
+        _atomic_write(path, lambda f: pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL))
+        state._stamp = os.stat(path).st_mtime_ns
+
+    def _sync_from_disk(self, state):
+        """Load the shared copy of a session if another worker changed it."""
+        path = self._state_path(state.sid)
+        try:
+            stamp = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if state._stamp is not None:
+                # Cleared (or swept) by another worker
+                state.reset()
+                state._stamp = None
+            return
+        if stamp == state._stamp:
+            return
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        images = data.pop('_images', {})
+        if data.get('image_id') != dict.get(state, 'image_id'):
+            dict.__setitem__(state, 'contour_cache', {})
+            dict.__setitem__(state, 'component_labels', None)
+        for key, value in data.items():
+            dict.__setitem__(state, key, value)
+        for key in SessionState.IMAGE_KEYS:
+            name = images.get(key)
+            if name is None:
+                dict.__setitem__(state, key, None)
+                continue
+            if isinstance(name, dict):
+                current = dict.get(state, key)
+                if not (isinstance(current, LazyArray) and current.recipe() == name['lazy']):
+                    dict.__setitem__(state, key, LazyArray(pickle.loads(name['lazy'])))
+                state._disk_copies.pop(key, None)
+                continue
+            path_i = self._image_path(name)
+            disk = state._disk_copies.get(key)
+            current = dict.get(state, key)
+            if disk is not None and disk[0] == path_i and disk[1]() is current:
+                continue  # unchanged image already mapped or loaded here
+            dict.__setitem__(state, key, _SpilledArray(path_i, 0))
+        state._stamp = stamp
+
+    def _sweep_shared(self, now):
+        """Remove shared sessions and images not touched within idle_timeout."""
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        cutoff = now - self.idle_timeout
+        for entry in os.scandir(self.spill_dir):
+            if not valid_session_id(entry.name) or not entry.is_dir():
+                continue
+            try:
+                if os.stat(os.path.join(entry.path, 'state.pkl')).st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        # Keep every image a remaining session refers to
+        live = set()
+        for entry in os.scandir(self.spill_dir):
+            state_path = os.path.join(entry.path, 'state.pkl')
+            if entry.is_dir() and os.path.exists(state_path):
+                try:
+                    with open(state_path, 'rb') as f:
+                        live.update(n for n in pickle.load(f).get('_images', {}).values()
+                                    if isinstance(n, str))
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    continue
+        for entry in os.scandir(os.path.join(self.spill_dir, 'images')):
+            if entry.name.endswith('.npy') and entry.name not in live \
+                    and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+            elif entry.name.endswith('.ref') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
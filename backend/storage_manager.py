@@ -0,0 +1,178 @@
+"""
+Storage manager - bounds the files the apps leave in temp/ and fonts_output/
+(uploads, imported images, generated fonts, exports)
+
+Each managed area is a folder plus file name patterns, with a byte quota and
+a maximum age. A sweep (periodically, on a background thread) removes files
+older than the maximum age, then the least recently used ones (by mtime)
+until the area is within its quota. Files in use are never removed:
+
+- reference sources are callables returning the paths live sessions use;
+  every sweep refreshes their mtime, so they are also the most recently
+  used files for the LRU order
+- files younger than min_age are never removed. Since every process sweeps
+  (and touches its references) more often than min_age, a file referenced
+  by any process - another worker, or the font editor - stays protected
+
+Subfolders (session spill files, job records, journals, the detection
+cache) are managed by their own components and ignored here.
+"""
+
+import os
+import time
+import fnmatch
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Area:
+    def __init__(self, name, folder, patterns, max_bytes, max_age):
+        self.name = name
+        self.folder = folder
+        self.patterns = tuple(patterns)
+        self.max_bytes = max_bytes  # 0 = no quota
+        self.max_age = max_age      # seconds, 0 = no age limit
+        self.removed_files = 0
+        self.removed_bytes = 0
+
+    def matches(self, filename):
+        return any(fnmatch.fnmatch(filename, p) for p in self.patterns)
+
+    def files(self):
+        """[(mtime, size, path)] of the area's files."""
+        files = []
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if not self.matches(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+
+class StorageManager:
+    """
+    Quota / age / LRU eviction for managed folders, see the module docstring.
+    """
+
+    def __init__(self, min_age=900, interval=300):
+        self.min_age = min_age
+        self.interval = interval
+        self.last_sweep = None
+        self._areas = []
+        self._reference_sources = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_area(self, name, folder, patterns, max_bytes=0, max_age=0):
+        os.makedirs(folder, exist_ok=True)
+        self._areas.append(_Area(name, folder, patterns, max_bytes, max_age))
+
+    def add_references(self, source):
+        """source() returns an iterable of file paths currently in use."""
+        self._reference_sources.append(source)
+
+    def references(self):
+        refs = set()
+        for source in self._reference_sources:
+            try:
+                refs.update(os.path.abspath(p) for p in source() if p)
+            except Exception as e:
+                logger.warning(f"Storage reference source failed: {e}")
+        return refs
+
+    def sweep(self):
+        """
+        One eviction pass over all areas.
+
+        Returns: { area name: {'files': removed, 'bytes': removed} }
+        """
+        with self._lock:
+            now = time.time()
+            refs = self.references()
+            for path in refs:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+
+            report = {}
+            for area in self._areas:
+                removed_files = removed_bytes = 0
+                files = area.files()
+                total = sum(size for _, size, _ in files)
+                # Oldest first: age limit, then quota
+                for mtime, size, path in sorted(files):
+                    expired = area.max_age and now - mtime > area.max_age
+                    over_quota = area.max_bytes and total > area.max_bytes
+                    if not (expired or over_quota):
+                        break
+                    if now - mtime < self.min_age or os.path.abspath(path) in refs:
+                        continue
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass  # removed by another process
+                    except OSError as e:
+                        logger.warning(f"Could not remove {path}: {e}")
+                        continue
+                    total -= size
+                    removed_files += 1
+                    removed_bytes += size
+                area.removed_files += removed_files
+                area.removed_bytes += removed_bytes
+                if removed_files:
+                    logger.info(f"Storage sweep ({area.name}): removed {removed_files} files, "
+                                f"{removed_bytes / 1e6:.1f} MB")
+                report[area.name] = {'files': removed_files, 'bytes': removed_bytes}
+            self.last_sweep = now
+            return report
+
+    # ---------- background sweeper ----------
+
+    def start(self):
+        """Sweep now and then every interval seconds on a daemon thread."""
+        if self._thread is not None or not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Storage sweep failed")
+            self._stop.wait(self.interval)
+
+    def removal_counts(self):
+        """{area: (files, bytes) removed by this process}, without scanning the folders."""
+        return {area.name: (area.removed_files, area.removed_bytes) for area in self._areas}
+
+    def stats(self):
+        areas = {}
+        for area in self._areas:
+            files = area.files()
+            areas[area.name] = {
+                'files': len(files),
+                'bytes': sum(size for _, size, _ in files),
+                'max_bytes': area.max_bytes,
+                'max_age': area.max_age,
+                'removed_files': area.removed_files,
+                'removed_bytes': area.removed_bytes,
+            }
+        return {'areas': areas, 'last_sweep': self.last_sweep}
@@ -0,0 +1,247 @@
+"""
+Detection thumbnail cache - encodes each detection crop once per image/bbox
+"""
+
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Padding (pixels) around a detection bbox in its thumbnail
+THUMB_PADDING = 6
+
+
+def image_content_id(image):
+    """Short content hash identifying an image array (shape + pixels)."""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(repr((image.shape, image.dtype.str)).encode('ascii'))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def crop_with_padding(image, bbox, padding=THUMB_PADDING):
+    """Crop a bbox plus padding, clamped to the image."""
+    x, y, w, h = bbox
+    x1 = max(0, x - padding)
+    y1 = max(0, y - padding)
+    x2 = min(image.shape[1], x + w + padding)
+    y2 = min(image.shape[0], y + h + padding)
+    return image[y1:y2, x1:x2]
+
+
+# Encoders for the supported thumbnail formats: (extension, imencode params)
+THUMB_FORMATS = {
+    'png': ('.png', []),
+    'webp': ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 101]),  # > 100 = lossless
+}
+
+
+class ThumbnailCache:
+    """
+    LRU cache of encoded detection crops keyed by (image_id, bbox, format).
+
+    Edits (add / remove / merge / split) keep the same image_id, so only new
+    or changed bboxes are cropped and encoded again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (image_id, bbox, fmt) -> encoded bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_bytes(self, image_id, image, bbox, fmt='png'):
+        """Encoded padded crop for bbox ('png' or 'webp'), encoding it only on a miss."""
+        key = (image_id, tuple(int(v) for v in bbox), fmt)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        ext, params = THUMB_FORMATS[fmt]
+        _, buffer = cv2.imencode(ext, crop_with_padding(image, key[1]), params)
+        encoded = buffer.tobytes()
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = encoded
+                self._bytes += len(encoded)
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+        return encoded
+
+    def get_base64(self, image_id, image, bbox):
+        """Base64 PNG of the padded crop for bbox (inline response mode)."""
+        return base64.b64encode(self.get_bytes(image_id, image, bbox)).decode('utf-8')
+
+    def drop_image(self, image_id):
+        """Forget every thumbnail of an image that is no longer in use."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == image_id]:
+                self._bytes -= len(self._entries.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def crop_url(image_id, bbox):
+    """URL of the binary crop endpoint for a detection."""
+    x, y, w, h = (int(v) for v in bbox)
+    return f'/api/crop/{image_id}/{x},{y},{w},{h}'
+
+
+def crop_etag(image_id, bbox, fmt):
+    """Strong ETag for a crop; image_id is a content hash, so crops never change."""
+    x, y, w, h = (int(v) for v in bbox)
+    return f'{image_id}-{x}-{y}-{w}-{h}-{THUMB_PADDING}-{fmt}'
+
+
+class AtlasPacker:
+    """
+    Packs the detection crops of an image into a sprite atlas made of
+    fixed-width shelves (rows). Each shelf is encoded as its own PNG strip.
+
+    Placement is sticky across edits: crops that still exist keep their
+    slot, removed crops leave a hole, and new crops go into the first shelf
+    with room. Only shelves that received new crops are re-encoded. When
+    more than half of the packed area is holes the atlas is repacked.
+    """
+
+    def __init__(self, shelf_width=1024, max_images=8):
+        self.shelf_width = shelf_width
+        self.max_images = max_images
+        self._atlases = OrderedDict()  # image_id -> atlas state dict
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _padded_box(image, bbox, padding=THUMB_PADDING):
+        x, y, w, h = (int(v) for v in bbox)
+        x1 = max(0, x - padding)
+        y1 = max(0, y - padding)
+        x2 = min(image.shape[1], x + w + padding)
+        y2 = min(image.shape[0], y + h + padding)
+        return x1, y1, x2 - x1, y2 - y1
+
+    def _new_atlas(self, clock=0):
+        # 'clock' only ever increases, so a (shelf, version) pair is never reused
+        return {'shelves': [], 'slots': {}, 'clock': clock}
+
+    def _place(self, atlas, key, w, h):
+        """Put one crop into the first shelf with room (creating one if needed)."""
+        for idx, shelf in enumerate(atlas['shelves']):
+            # Skip shelves that are too short, or so tall that the crop would waste most of them
+            if h > shelf['height'] or h < shelf['height'] // 2:
+                continue
+            if shelf['cursor'] + w > max(self.shelf_width, shelf['width']):
+                continue
+            x = shelf['cursor']
+            shelf['cursor'] += w
+            shelf['width'] = max(shelf['width'], shelf['cursor'])
+            shelf['keys'].add(key)
+            atlas['clock'] += 1
+            shelf['version'] = atlas['clock']
+            shelf['data'] = None
+            atlas['slots'][key] = (idx, x, w, h)
+            return
+        atlas['clock'] += 1
+        atlas['shelves'].append({
+            'height': h, 'width': w, 'cursor': w, 'version': atlas['clock'],
+            'keys': {key}, 'data': None,
+        })
+        atlas['slots'][key] = (len(atlas['shelves']) - 1, 0, w, h)
+
+    def _fragmented(self, atlas):
+        total = sum(s['width'] * s['height'] for s in atlas['shelves'])
+        live = sum(w * h for (_, _, w, h) in atlas['slots'].values())
+        return total > 0 and live < total * 0.5
+
+    def layout(self, image_id, image, bboxes):
+        """
+        Update the atlas of image_id to hold exactly the given bboxes.
+
+        Returns: (list of per-bbox slots {'shelf', 'x', 'y', 'w', 'h'},
+                  list of shelves {'index', 'version', 'width', 'height'})
+        """
+        keys = [self._padded_box(image, b) for b in bboxes]
+        with self._lock:
+            atlas = self._atlases.get(image_id)
+            if atlas is None:
+                atlas = self._new_atlas()
+                self._atlases[image_id] = atlas
+                while len(self._atlases) > self.max_images:
+                    self._atlases.popitem(last=False)
+            self._atlases.move_to_end(image_id)
+
+            wanted = set(keys)
+            for key in [k for k in atlas['slots'] if k not in wanted]:
+                shelf_idx = atlas['slots'].pop(key)[0]
+                atlas['shelves'][shelf_idx]['keys'].discard(key)
+
+            if self._fragmented(atlas):
+                atlas = self._new_atlas(clock=atlas['clock'])
+                self._atlases[image_id] = atlas
+                # Tallest first gives the classic shelf-packing fill rate
+                for key in sorted(wanted, key=lambda k: -k[3]):
+                    self._place(atlas, key, key[2], key[3])
+            else:
+                new_keys = sorted((k for k in wanted if k not in atlas['slots']),
+                                  key=lambda k: -k[3])
+                for key in new_keys:
+                    self._place(atlas, key, key[2], key[3])
+
+            slots = []
+            for key in keys:
+                shelf_idx, x, w, h = atlas['slots'][key]
+                slots.append({'shelf': shelf_idx, 'x': x, 'y': 0, 'w': w, 'h': h})
+            shelves = [
+                {'index': i, 'version': s['version'], 'width': s['width'], 'height': s['height']}
+                for i, s in enumerate(atlas['shelves'])
+            ]
+        return slots, shelves
+
+    def shelf_png(self, image_id, image, shelf_idx):
+        """
+        Encoded PNG strip of one shelf (cached until the shelf changes).
+
+        Returns: (bytes, version) or (None, None) if the shelf does not exist
+        """
+        with self._lock:
+            atlas = self._atlases.get(image_id)
+            if atlas is None or not (0 <= shelf_idx < len(atlas['shelves'])):
+                return None, None
+            shelf = atlas['shelves'][shelf_idx]
+            if shelf['data'] is not None:
+                return shelf['data'], shelf['version']
+            version = shelf['version']
+            placements = [(key, atlas['slots'][key][1]) for key in shelf['keys']]
+            height, width = shelf['height'], shelf['width']
+
+        strip = np.full((height, width) + image.shape[2:], 255, dtype=image.dtype)
+        for (x1, y1, w, h), x in placements:
+            strip[0:h, x:x + w] = image[y1:y1 + h, x1:x1 + w]
+        _, buffer = cv2.imencode('.png', strip)
+        data = buffer.tobytes()
+
+        with self._lock:
+            if shelf['version'] == version:
+                shelf['data'] = data
+        return data, version
+
+    def drop_image(self, image_id):
+        with self._lock:
+            self._atlases.pop(image_id, None)
+
+
+def atlas_url(image_id, shelf_idx, version):
+    """Versioned URL of one atlas shelf strip."""
+    return f'/api/atlas/{image_id}/{shelf_idx}?v={version}'
@@ -0,0 +1,293 @@
+"""
+Tile pyramid - deep-zoom style image tiles for the detection review canvas
+
+Instead of sending the whole original as one base64 JPEG, the canvas asks
+for a small manifest and then only for the tiles it shows, at the level
+that matches its display size. Level 0 is full resolution; every next
+level halves both sides, until the image fits in one tile.
+
+A pyramid is built once per image (content id) on a background thread and
+kept on disk: <folder>/<image_id>/<level>/<col>_<row>.jpg, plus
+manifest.json once it is complete. Tiles requested before the build gets
+to them are rendered on request and written in place (the build keeps
+them); both go through the same chain of halvings, so a tile has the same
+bytes whichever path made it. Since image ids are content hashes, tiles
+never change and are served with strong ETags. The folder is bounded by max_bytes;
+least recently used pyramids (by manifest mtime, refreshed on use) are
+evicted first. Several processes may share the folder.
+"""
+
+import os
+import re
+import json
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+TILE_QUALITY = 85  # JPEG quality, same as /api/original-image
+# Bump when tiles are rendered differently, so cached tiles are not reused
+PYRAMID_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+_IMAGE_ID_RE = re.compile(r'^[0-9a-f]{8,64}$')
+
+
+def valid_image_id(image_id):
+    """True if image_id looks like an image content id (safe as a folder name)."""
+    return bool(_IMAGE_ID_RE.match(image_id or ''))
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def pyramid_levels(width, height, tile_size=TILE_SIZE):
+    """[{'level', 'width', 'height', 'cols', 'rows'}], full resolution first."""
+    levels = []
+    level = 0
+    while True:
+        w = max(1, _ceil_div(width, 2 ** level))
+        h = max(1, _ceil_div(height, 2 ** level))
+        levels.append({'level': level, 'width': w, 'height': h,
+                       'cols': _ceil_div(w, tile_size), 'rows': _ceil_div(h, tile_size)})
+        if w <= tile_size and h <= tile_size:
+            return levels
+        level += 1
+
+
+def downscale(image, info):
+    """Next pyramid level of image (info: its entry from pyramid_levels)."""
+    return cv2.resize(image, (info['width'], info['height']), interpolation=cv2.INTER_AREA)
+
+
+def tile_etag(image_id, level, col, row, tile_size=TILE_SIZE):
+    """Strong ETag for a tile; image_id is a content hash, so tiles never change."""
+    return f'{image_id}-t{PYRAMID_VERSION}-{tile_size}-{level}-{col}-{row}'
+
+
+class TilePyramidCache:
+    """Disk cache of image pyramids, see the module docstring."""
+
+    def __init__(self, folder, tile_size=TILE_SIZE, quality=TILE_QUALITY,
+                 max_bytes=1024 * 1024 * 1024):
+        self.folder = folder
+        self.tile_size = tile_size
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.hits = 0      # tiles served from disk
+        self.misses = 0    # tiles rendered on request
+        self.builds = 0
+        self._building = set()  # image ids being built by this process
+        # Downscaled levels for on-request tiles: image_id -> {level: array}
+        self._levels = OrderedDict()
+        self.max_level_images = 2
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _dir(self, image_id):
+        return os.path.join(self.folder, image_id)
+
+    def _tile_path(self, image_id, level, col, row):
+        return os.path.join(self._dir(image_id), str(level), f'{col}_{row}.jpg')
+
+    def manifest(self, image_id, width, height):
+        """Pyramid layout of an image; 'ready' once every tile is on disk."""
+        return {
+            'image_id': image_id,
+            'width': int(width),
+            'height': int(height),
+            'tile_size': self.tile_size,
+            'format': 'jpg',
+            'levels': pyramid_levels(int(width), int(height), self.tile_size),
+            'ready': os.path.exists(os.path.join(self._dir(image_id), MANIFEST_NAME)),
+        }
+
+    def load_manifest(self, image_id):
+        """Manifest of a complete pyramid on disk (marked as used), or None."""
+        path = os.path.join(self._dir(image_id), MANIFEST_NAME)
+        try:
+            with open(path, 'rb') as f:
+                manifest = json.loads(f.read())
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        manifest.pop('bytes', None)
+        return manifest
+
+    def ensure(self, image_id, width, height, load_image):
+        """
+        Start building the pyramid of an image on a background thread,
+        unless it is complete or already being built here.
+        load_image: callable returning the original image (run on the thread)
+        """
+        path = os.path.join(self._dir(image_id), MANIFEST_NAME)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # mark as recently used
+            except OSError:
+                pass
+            return False
+        with self._lock:
+            if image_id in self._building:
+                return False
+            self._building.add(image_id)
+        thread = threading.Thread(target=self._build, args=(image_id, width, height, load_image),
+                                  name=f'tiles-{image_id}', daemon=True)
+        thread.start()
+        return True
+
+    def _build(self, image_id, width, height, load_image):
+        try:
+            image = load_image()
+            levels = pyramid_levels(int(width), int(height), self.tile_size)
+            written = 0
+            for info in levels:
+                if info['level'] > 0:
+                    image = downscale(image, info)
+                for row in range(info['rows']):
+                    for col in range(info['cols']):
+                        path = self._tile_path(image_id, info['level'], col, row)
+                        if os.path.exists(path):
+                            continue  # rendered on request meanwhile
+                        x, y = col * self.tile_size, row * self.tile_size
+                        self._write_tile(path, image[y:y + self.tile_size, x:x + self.tile_size])
+                        written += 1
+            manifest = self.manifest(image_id, width, height)
+            manifest['ready'] = True
+            manifest['bytes'] = sum(
+                os.path.getsize(self._tile_path(image_id, info['level'], col, row))
+                for info in levels for row in range(info['rows']) for col in range(info['cols']))
+            self._write(os.path.join(self._dir(image_id), MANIFEST_NAME),
+                        json.dumps(manifest).encode('utf-8'))
+            self.builds += 1
+            logger.info(f"Built tile pyramid {image_id}: {len(levels)} levels, {written} tiles")
+        except Exception as e:
+            logger.warning(f"Tile pyramid {image_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(image_id)
+                self._levels.pop(image_id, None)  # tiles are on disk now
+        self._evict()
+
+    def tile(self, image_id, level, col, row, image=None):
+        """
+        JPEG bytes of one tile: from disk, or rendered from the original
+        image when given. None if the tile does not exist (yet).
+        """
+        path = self._tile_path(image_id, level, col, row)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.hits += 1
+            return data
+        except FileNotFoundError:
+            pass
+        if image is None:
+            return None
+        self.misses += 1
+        level_image = self._level_image(image_id, image, level)
+        x, y = col * self.tile_size, row * self.tile_size
+        return self._write_tile(path, level_image[y:y + self.tile_size, x:x + self.tile_size])
+
+    def _level_image(self, image_id, image, level):
+        """
+        Level of the pyramid for on-request tiles, downscaled level by level
+        like _build does. Levels are kept for the last few images.
+        """
+        if level == 0:
+            return image
+        img_h, img_w = image.shape[:2]
+        levels = pyramid_levels(img_w, img_h, self.tile_size)
+        with self._lock:
+            cached = self._levels.setdefault(image_id, {})
+            self._levels.move_to_end(image_id)
+            while len(self._levels) > self.max_level_images:
+                self._levels.popitem(last=False)
+            start = max([lvl for lvl in cached if lvl <= level], default=0)
+            current = cached.get(start, image)
+        for info in levels[start + 1:level + 1]:
+            current = downscale(current, info)
+            with self._lock:
+                cached[info['level']] = current
+        return current
+
+    def _write_tile(self, path, tile):
+        ok, buffer = cv2.imencode('.jpg', tile, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError('Failed to encode tile')
+        data = buffer.tobytes()
+        self._write(path, data)
+        return data
+
+    @staticmethod
+    def _write(path, data):
+        """Write a file via a temp file + rename, so readers never see it half written."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write tile file {path}: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _entries(self):
+        """[(last use, bytes, image_id)] of the pyramids on disk."""
+        entries = []
+        try:
+            dirs = [entry for entry in os.scandir(self.folder) if entry.is_dir()]
+        except FileNotFoundError:
+            return entries
+        for entry in dirs:
+            path = os.path.join(entry.path, MANIFEST_NAME)
+            try:
+                # Complete pyramid: the manifest records its size
+                with open(path, 'rb') as f:
+                    size = json.loads(f.read())['bytes']
+                entries.append((os.stat(path).st_mtime, size, entry.name))
+                continue
+            except (OSError, ValueError, KeyError):
+                pass
+            size, newest = 0, 0
+            for root, _, files in os.walk(entry.path):
+                for name in files:
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    size += stat.st_size
+                    newest = max(newest, stat.st_mtime)
+            entries.append((newest, size, entry.name))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            building = set(self._building)
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, image_id in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if image_id in building:
+                continue
+            shutil.rmtree(self._dir(image_id), ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'builds': self.builds,
+        }
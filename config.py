@@ -12,6 +12,58 @@ class Config:
     OUTPUT_FOLDER = os.path.join(os.path.dirname(__file__), 'fonts_output')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max file size
     
+    # Session store settings
+    SESSION_COOKIE = 'hfm_session'
+    SESSION_SPILL_FOLDER = os.path.join(UPLOAD_FOLDER, 'sessions')
+    SESSION_MEMORY_CAP_MB = int(os.environ.get('HFM_SESSION_MEMORY_CAP_MB', 1024))  # per process; above it idle sessions' images are spilled to disk
+    SESSION_IDLE_TIMEOUT = 6 * 3600  # seconds before an idle session is dropped
+    MAX_SESSIONS = 64
+    
+    # Background jobs (?async=1 on upload / redetect / generate-font)
+    JOB_WORKERS = min(4, os.cpu_count() or 1)
+    JOBS_PER_SESSION = 1  # concurrent jobs per session; the rest wait in order
+    JOB_RESULT_TTL = 600  # seconds a finished job's result is kept
+    JOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')  # job records (multi-process mode)
+    
+    # Detection cache (repeat uploads of the same scan skip detection)
+    DETECTION_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'detections')
+    DETECTION_CACHE_MAX_MB = int(os.environ.get('HFM_DETECTION_CACHE_MB', 512))
+    
+    # Session journal (autosave + crash recovery, see backend/session_journal.py)
+    JOURNAL_FOLDER = os.path.join(UPLOAD_FOLDER, 'journal')
+    JOURNAL_COMPACT_BYTES = 1024 * 1024  # journal size that triggers a snapshot
+    JOURNAL_RETENTION = 7 * 24 * 3600  # seconds an untouched journal is kept
+    
+    # Storage limits for files in temp/ and fonts_output/ (backend/storage_manager.py)
+    STORAGE_SWEEP_INTERVAL = 300  # seconds between sweeps (0 = no background sweeper)
+    STORAGE_MIN_AGE = 900  # files younger than this are never removed
+    UPLOAD_QUOTA_MB = int(os.environ.get('HFM_UPLOAD_QUOTA_MB', 1024))  # uploads, imports, editor temp fonts
+    UPLOAD_MAX_AGE = 2 * 24 * 3600
+    OUTPUT_QUOTA_MB = int(os.environ.get('HFM_OUTPUT_QUOTA_MB', 2048))  # generated fonts
+    OUTPUT_MAX_AGE = 30 * 24 * 3600
+    EXPORT_MAX_AGE = 24 * 3600  # .hfm exports and family zips (already downloaded)
+    
+    # Metrics (/api/metrics); with several workers each one publishes its values here
+    METRICS_FOLDER = os.path.join(UPLOAD_FOLDER, 'metrics')
+    METRICS_FLUSH_INTERVAL = 5  # seconds
+    
+    # Response compression (gzip, brotli if installed) - see backend/compression.py
+    COMPRESSION_MIN_BYTES = 1024  # smaller responses are sent as is
+    COMPRESSION_CACHE_MB = 32  # compressed bodies kept for repeated payloads
+    
+    # Tile pyramids of the uploaded scans for the review canvas (backend/tile_pyramid.py)
+    TILE_FOLDER = os.path.join(UPLOAD_FOLDER, 'tiles')
+    TILE_SIZE = 256
+    TILE_CACHE_MAX_MB = int(os.environ.get('HFM_TILE_CACHE_MB', 1024))
+    
+    # Production server (backend/serve.py)
+    SERVER_HOST = os.environ.get('HFM_HOST', '127.0.0.1')
+    SERVER_PORT = int(os.environ.get('HFM_PORT', 5000))
+    SERVER_WORKERS = int(os.environ.get('HFM_WORKERS', 2))
+    WORKER_MAX_RSS_MB = int(os.environ.get('HFM_WORKER_MAX_RSS_MB', 0))  # 0 = no limit; a worker above it is restarted
+    # Set by backend/serve.py when several worker processes share sessions and jobs
+    SHARED_STATE = os.environ.get('HFM_SHARED_STATE') == '1'
+    
     # Hebrew alphabet characters
     HEBREW_LETTERS = [
         'א', 'ב', 'ג', 'ד', 'ה', 'ו', 'ז', 'ח', 'ט', 'י', 
@@ -2,12 +2,58 @@
 
 const API_BASE = '/api';
 
+// Per-tab session id, so two tabs don't overwrite each other's work
+const SESSION_ID = sessionStorage.getItem('hfmSessionId') || (() => {
+    const id = Array.from(crypto.getRandomValues(new Uint8Array(16)),
+                          b => b.toString(16).padStart(2, '0')).join('');
+    sessionStorage.setItem('hfmSessionId', id);
+    return id;
+})();
+
+// Send the session id with every API request
+const _fetch = window.fetch.bind(window);
+window.fetch = (url, options = {}) => {
+    if (typeof url === 'string' && url.startsWith(API_BASE)) {
+        const headers = new Headers(options.headers || {});
+        headers.set('X-Session-Id', SESSION_ID);
+        options = { ...options, headers };
+    }
+    return _fetch(url, options);
+};
+
+// Run a heavy request as a background job (?async=1) and resolve with the
+// result response once it finishes, so callers use it like fetch().
+// onProgress (optional) receives the job's progress events {stage, elapsed_ms, ...}
+async function runJob(url, options = {}, onProgress = null) {
+    const sep = url.includes('?') ? '&' : '?';
+    const res = await fetch(`${url}${sep}async=1`, options);
+    if (res.status !== 202) return res;
+    const job = await res.json();
+    let events = null;
+    if (onProgress) {
+        events = new EventSource(`${job.events_url.replace(/^\/api/, API_BASE)}?session=${SESSION_ID}`);
+        events.addEventListener('progress', e => onProgress(JSON.parse(e.data)));
+        events.addEventListener('end', () => events.close());
+    }
+    try {
+        let delay = 100;
+        while (true) {
+            await new Promise(r => setTimeout(r, delay));
+            delay = Math.min(delay * 2, 1000);
+            const result = await fetch(job.result_url.replace(/^\/api/, API_BASE));
+            if (result.status !== 202) return result;
+        }
+    } finally {
+        if (events) events.close();
+    }
+}
+
 // Application State
 const appState = {
     currentStep: 1,
     uploadedFile: null,
     uploadedImagePath: null,
-    detectedLetters: [],   // array of {id, bbox, area, fill_ratio, image (base64)}
+    detectedLetters: [],   // array of {id, bbox, area, fill_ratio, image_url (or image base64)}
     assignments: {},       // { detectionId: 'א', ... }
     fontName: 'HebrewFont',
     activeInputId: null,   // which detection card is being edited
@@ -23,6 +69,8 @@ document.addEventListener('DOMContentLoaded', () => {
     initializeUploadArea();
     initializeEventListeners();
     checkApiHealth();
+    restoreSession();
+    setInterval(autosave, AUTOSAVE_INTERVAL_MS);
 });
 
 async function checkApiHealth() {
@@ -35,6 +83,47 @@ async function checkApiHealth() {
     }
 }
 
+// ==================== Autosave / Recovery ====================
+
+const AUTOSAVE_INTERVAL_MS = 5000;
+let lastAutosave = null;
+
+// Journal the client-side state (assignments, adjustments, name, metadata)
+// when it changed; detection edits are journaled by the server itself
+async function autosave() {
+    if (!appState.detectedLetters.length) return;
+    const body = JSON.stringify({
+        font_name: document.getElementById('font-name').value || 'HebrewFont',
+        assignments: appState.assignments,
+        adjustments: appState.adjustments,
+        metadata: getFontMetadata()
+    });
+    if (body === lastAutosave) return;
+    try {
+        const res = await fetch(`${API_BASE}/autosave`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body
+        });
+        if (res.ok) lastAutosave = body;
+    } catch {
+        // server unreachable - retried on the next tick
+    }
+}
+
+// After a reload or a server restart, pick up the session where it was
+async function restoreSession() {
+    try {
+        const res = await fetch(`${API_BASE}/session-restore`);
+        const data = await res.json();
+        if (!res.ok || data.status !== 'restored') return;
+        applyProjectState(data);
+        showNotification('success', `העבודה שוחזרה: ${data.count} זיהויים, ${Object.keys(appState.assignments).length} שיוכים`);
+    } catch {
+        // nothing to restore
+    }
+}
+
 // ==================== Upload ====================
 function initializeUploadArea() {
     const area = document.getElementById('upload-area');
@@ -80,8 +169,7 @@ function clearUpload() {
     document.getElementById('upload-btn').style.display = 'none';
     document.getElementById('file-input').value = '';
     appState.uploadedFile = null;
-    reviewState.originalImageB64 = null;
-    reviewState.imageObj = null;
+    resetReviewTiles();
 }
 
 // ==================== Event Listeners ====================
@@ -92,8 +180,7 @@ function initializeEventListeners() {
     // Step 2 (detection/assignment)
     document.getElementById('back-btn-detection').addEventListener('click', () => {
         goToStep(1);
-        reviewState.originalImageB64 = null;
-        reviewState.imageObj = null;
+        resetReviewTiles();
     });
     document.getElementById('next-btn-detection').addEventListener('click', goToPreview);
 
@@ -161,7 +248,7 @@ async function uploadImage() {
     formData.append('separation_level', document.getElementById('separation-level').value);
 
     try {
-        const res = await fetch(`${API_BASE}/upload`, { method: 'POST', body: formData });
+        const res = await runJob(`${API_BASE}/upload`, { method: 'POST', body: formData });
         const data = await res.json();
         if (!res.ok) throw new Error(data.error || 'Upload failed');
 
@@ -195,7 +282,7 @@ function populateAssignmentGrid() {
 
         card.innerHTML = `
             <div class="detection-card-img">
-                <img src="data:image/png;base64,${det.image}" alt="letter ${idx + 1}">
+                <img src="${detImageSrc(det)}" alt="letter ${idx + 1}">
             </div>
             <div class="detection-card-label ${assigned ? 'assigned' : 'unassigned'}" id="label-${idx}">
                 ${assigned || '?'}
@@ -341,7 +428,7 @@ async function generateFont() {
         setProgress(60);
         statusText.textContent = 'יוצר פונט...';
 
-        const genRes = await fetch(`${API_BASE}/generate-font`, {
+        const genRes = await runJob(`${API_BASE}/generate-font`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -350,6 +437,14 @@ async function generateFont() {
                 ref_height: appState.refHeight,
                 metadata: getFontMetadata()
             })
+        }, ev => {
+            if (ev.stage === 'glyph') {
+                statusText.textContent = `יוצר פונט... ${ev.done}/${ev.total}`;
+                setProgress(60 + Math.round(30 * ev.done / ev.total));
+            } else if (ev.stage === 'save') {
+                statusText.textContent = 'שומר פונט...';
+                setProgress(95);
+            }
         });
         const genData = await genRes.json();
         if (!genRes.ok) throw new Error(genData.error || 'Font generation failed');
@@ -384,12 +479,19 @@ function openFontFolder() {
 }
 
 // ==================== Preview & Adjustments ====================
+// Detection crops come as a cacheable URL (image_url); older responses and
+// ?inline=1 requests embed them as base64 (image)
+function detImageSrc(det) {
+    if (det.image) return `data:image/png;base64,${det.image}`;
+    return det.image_url;
+}
+
 function getCharImage(char) {
     // Find the detection that is assigned to this character
     for (const [detId, assignedChar] of Object.entries(appState.assignments)) {
         if (assignedChar === char) {
             const det = appState.detectedLetters[parseInt(detId)];
-            if (det) return det.image;
+            if (det) return detImageSrc(det);
         }
     }
     return null;
@@ -449,7 +551,7 @@ function renderPreview() {
     }
 
     for (const char of text) {
-        const img64 = getCharImage(char);
+        const imgSrc = getCharImage(char);
         const adj = appState.adjustments[char] || { scale: 100, offsetX: 0, offsetY: 0, spacing: 0 };
         const det = getDetectionForChar(char);
 
@@ -468,7 +570,7 @@ function renderPreview() {
         if (char === ' ') {
             wrapper.classList.add('preview-space');
             wrapper.innerHTML = '&nbsp;';
-        } else if (img64) {
+        } else if (imgSrc) {
             const scaleF = adj.scale / 100;
             // Use proportional height: this letter's bbox.h / refHeight * displayMax
             const refH = appState.refHeight || computeRefHeight();
@@ -478,7 +580,7 @@ function renderPreview() {
                 naturalH = (det.bbox.h / refH) * displayMax;
             }
             const img = document.createElement('img');
-            img.src = `data:image/png;base64,${img64}`;
+            img.src = imgSrc;
             img.style.height = naturalH + 'px';
             img.style.maxHeight = 'none';
             img.style.maxWidth = 'none';
@@ -592,7 +694,7 @@ async function redetectLetters() {
     showNotification('info', `מזהה מחדש עם רמת הפרדה ${separationLevel}...`);
 
     try {
-        const res = await fetch(`${API_BASE}/redetect`, {
+        const res = await runJob(`${API_BASE}/redetect`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ separation_level: separationLevel })
@@ -601,12 +703,13 @@ async function redetectLetters() {
         if (!res.ok) throw new Error(data.error || 'Re-detection failed');
 
         appState.detectedLetters = data.detections;
-        appState.assignments = {};
+        const lost = remapAssignments(data.id_map || {});
         appState.mergeMode = false;
         appState.mergeSelection.clear();
         appState.refHeight = computeRefHeight();
 
-        showNotification('success', `זוהו ${data.count} אותיות עם הפרדה ${separationLevel}`);
+        showNotification('success', `זוהו ${data.count} אותיות עם הפרדה ${separationLevel}` +
+            (lost ? ` — ${lost} שיוכים לא נשמרו` : ''));
         populateAssignmentGrid();
     } catch (err) {
         showNotification('error', `שגיאה: ${err.message}`);
@@ -615,15 +718,16 @@ async function redetectLetters() {
 
 // ==================== Detection Review (Canvas Overlay) ====================
 const reviewState = {
-    originalImageB64: null,
-    imageObj: null,
+    tiles: null,            // tile pyramid manifest of the image (/api/tiles/manifest)
+    tileImages: new Map(),  // 'level/col/row' -> Image
     scale: 1,
     offsetX: 0,
     offsetY: 0,
     drawing: false,
     drawStart: null,
     drawCurrent: null,
-    hoveredBox: -1
+    hoveredBox: -1,
+    regionMode: false  // next drawn rectangle re-detects that region
 };
 
 async function showDetectionReview() {
@@ -632,41 +736,41 @@ async function showDetectionReview() {
     document.getElementById('assignment-panel').style.display = 'none';
     document.getElementById('review-count').textContent = appState.detectedLetters.length;
 
-    // Load original image for canvas
-    if (!reviewState.originalImageB64) {
-        try {
-            const res = await fetch(`${API_BASE}/original-image`);
-            const data = await res.json();
-            if (!res.ok) throw new Error(data.error);
-            reviewState.originalImageB64 = data.image;
-        } catch (err) {
-            showNotification('error', 'שגיאה בטעינת תמונה: ' + err.message);
-            return;
+    // Load the tile pyramid manifest of the image; tiles are fetched as they are drawn
+    try {
+        const res = await fetch(`${API_BASE}/tiles/manifest`);
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error);
+        if (!reviewState.tiles || reviewState.tiles.image_id !== data.image_id) {
+            resetReviewTiles();
+            reviewState.tiles = data;
         }
+    } catch (err) {
+        showNotification('error', 'שגיאה בטעינת תמונה: ' + err.message);
+        return;
     }
 
-    // Load image into an Image object
-    const img = new Image();
-    img.onload = () => {
-        reviewState.imageObj = img;
-        initReviewCanvas();
-        drawReviewCanvas();
-    };
-    img.src = 'data:image/jpeg;base64,' + reviewState.originalImageB64;
+    initReviewCanvas();
+    drawReviewCanvas();
+}
+
+function resetReviewTiles() {
+    reviewState.tiles = null;
+    reviewState.tileImages.clear();
 }
 
 function initReviewCanvas() {
     const canvas = document.getElementById('review-canvas');
     const container = canvas.parentElement;
-    const img = reviewState.imageObj;
+    const tiles = reviewState.tiles;
 
     // Fit canvas to container width
     const maxW = container.clientWidth || 900;
-    const scale = Math.min(1, maxW / img.width);
+    const scale = Math.min(1, maxW / tiles.width);
     reviewState.scale = scale;
 
-    canvas.width = Math.round(img.width * scale);
-    canvas.height = Math.round(img.height * scale);
+    canvas.width = Math.round(tiles.width * scale);
+    canvas.height = Math.round(tiles.height * scale);
 
     // Mouse events for drawing new boxes & clicking existing ones
     canvas.onmousedown = onReviewMouseDown;
@@ -682,14 +786,83 @@ function initReviewCanvas() {
     canvas.style.cursor = 'crosshair';
 }
 
+// Redraw when scrolling brings other tiles into view
+let reviewRedrawPending = false;
+window.addEventListener('scroll', () => {
+    if (!reviewState.tiles || reviewRedrawPending) return;
+    if (document.getElementById('detection-review').style.display === 'none') return;
+    reviewRedrawPending = true;
+    requestAnimationFrame(() => {
+        reviewRedrawPending = false;
+        drawReviewCanvas();
+    });
+});
+
+// Tile image (cached); starts loading it on first use, redraws when it arrives
+function getReviewTile(level, col, row) {
+    const key = `${level}/${col}/${row}`;
+    let img = reviewState.tileImages.get(key);
+    if (!img) {
+        img = new Image();
+        img.onload = () => {
+            if (reviewState.tileImages.get(key) === img) drawReviewCanvas();
+        };
+        img.src = reviewState.tiles.tile_url
+            .replace('{level}', level).replace('{col}', col).replace('{row}', row);
+        reviewState.tileImages.set(key, img);
+    }
+    return img.complete && img.naturalWidth > 0 ? img : null;
+}
+
+// Draw the loaded tiles of one pyramid level that intersect the visible
+// canvas area (canvas pixels); missing ones are requested
+function drawReviewTiles(ctx, level, visible) {
+    const tiles = reviewState.tiles;
+    const info = tiles.levels[level];
+    const ts = tiles.tile_size;
+    const f = reviewState.scale * (2 ** level);  // level pixels -> canvas pixels
+    const col0 = Math.max(0, Math.floor(visible.left / (ts * f)));
+    const col1 = Math.min(info.cols - 1, Math.floor((visible.right - 1) / (ts * f)));
+    const row0 = Math.max(0, Math.floor(visible.top / (ts * f)));
+    const row1 = Math.min(info.rows - 1, Math.floor((visible.bottom - 1) / (ts * f)));
+    for (let row = row0; row <= row1; row++) {
+        for (let col = col0; col <= col1; col++) {
+            const img = getReviewTile(level, col, row);
+            if (img) ctx.drawImage(img, col * ts * f, row * ts * f, img.naturalWidth * f, img.naturalHeight * f);
+        }
+    }
+}
+
 function drawReviewCanvas() {
     const canvas = document.getElementById('review-canvas');
     const ctx = canvas.getContext('2d');
     const s = reviewState.scale;
-    const img = reviewState.imageObj;
+    const tiles = reviewState.tiles;
+    if (!tiles) return;
 
-    // Draw original image
-    ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
+    // Draw original image: only the tiles in view, from the smallest level
+    // that still has at least canvas resolution
+    let level = 0;
+    while (level + 1 < tiles.levels.length && tiles.levels[level + 1].width >= canvas.width) level++;
+    const rect = canvas.getBoundingClientRect();
+    const k = rect.width > 0 ? canvas.width / rect.width : 1;  // CSS -> canvas pixels
+    const visible = {
+        left: Math.max(0, -rect.left) * k,
+        top: Math.max(0, -rect.top) * k,
+        right: Math.min(rect.width, window.innerWidth - rect.left) * k,
+        bottom: Math.min(rect.height, window.innerHeight - rect.top) * k
+    };
+    ctx.fillStyle = '#f9fafb';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    if (visible.right > visible.left && visible.bottom > visible.top) {
+        const top = tiles.levels.length - 1;
+        if (level !== top) {
+            // Coarsest level (one tile) underneath until the sharp tiles arrive
+            const placeholder = getReviewTile(top, 0, 0);
+            if (placeholder) ctx.drawImage(placeholder, 0, 0, canvas.width, canvas.height);
+        }
+        drawReviewTiles(ctx, level, visible);
+    }
 
     // Draw existing detection boxes
     appState.detectedLetters.forEach((det, idx) => {
@@ -724,7 +897,7 @@ function drawReviewCanvas() {
     if (reviewState.drawing && reviewState.drawStart && reviewState.drawCurrent) {
         const sx = reviewState.drawStart.x, sy = reviewState.drawStart.y;
         const cx = reviewState.drawCurrent.x, cy = reviewState.drawCurrent.y;
-        ctx.strokeStyle = '#3b82f6';
+        ctx.strokeStyle = reviewState.regionMode ? '#f59e0b' : '#3b82f6';
         ctx.lineWidth = 2;
         ctx.setLineDash([6, 3]);
         ctx.strokeRect(sx, sy, cx - sx, cy - sy);
@@ -769,7 +942,7 @@ function onReviewMouseDown(e) {
     const pos = getCanvasPos(e);
     const boxIdx = findBoxAtPos(pos.x, pos.y);
 
-    if (boxIdx >= 0) {
+    if (boxIdx >= 0 && !reviewState.regionMode) {
         // Check if clicking the X button area of hovered box
         const b = appState.detectedLetters[boxIdx].bbox;
         const s = reviewState.scale;
@@ -825,9 +998,59 @@ function onReviewMouseUp(e) {
     const imgX = Math.round(rx / s), imgY = Math.round(ry / s);
     const imgW = Math.round(rw / s), imgH = Math.round(rh / s);
 
+    if (reviewState.regionMode) {
+        toggleRegionMode();
+        redetectRegion(imgX, imgY, imgW, imgH);
+        return;
+    }
     addDetection(imgX, imgY, imgW, imgH);
 }
 
+function toggleRegionMode() {
+    reviewState.regionMode = !reviewState.regionMode;
+    document.getElementById('region-redetect-btn').classList.toggle('btn-primary', reviewState.regionMode);
+    if (reviewState.regionMode) {
+        showNotification('info', 'גררו מלבן סביב האזור לזיהוי מחדש');
+    }
+}
+
+// Carry assignments over to the ids of a re-detection ({old id: new id})
+function remapAssignments(idMap) {
+    const remapped = {};
+    for (const [oldId, char] of Object.entries(appState.assignments)) {
+        if (oldId in idMap) remapped[idMap[oldId]] = char;
+    }
+    const lost = Object.keys(appState.assignments).length - Object.keys(remapped).length;
+    appState.assignments = remapped;
+    return lost;
+}
+
+async function redetectRegion(x, y, w, h) {
+    const separationLevel = parseInt(document.getElementById('review-separation').value);
+    showNotification('info', `מזהה מחדש באזור עם רמת הפרדה ${separationLevel}...`);
+
+    try {
+        const res = await runJob(`${API_BASE}/redetect-region`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ x, y, w, h, separation_level: separationLevel })
+        });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || 'Re-detection failed');
+
+        appState.detectedLetters = data.detections;
+        const lost = remapAssignments(data.id_map);
+        appState.refHeight = computeRefHeight();
+        reviewState.hoveredBox = -1;
+        drawReviewCanvas();
+        let message = `הוחלפו ${data.replaced} זיהויים ב-${data.detected} (סה"כ ${data.count})`;
+        if (lost > 0) message += ` — ${lost} שיוכים לא נשמרו`;
+        showNotification('success', message);
+    } catch (err) {
+        showNotification('error', `שגיאה: ${err.message}`);
+    }
+}
+
 async function addDetection(x, y, w, h) {
     try {
         const res = await fetch(`${API_BASE}/add-detection`, {
@@ -870,7 +1093,7 @@ async function redetectFromReview() {
     showNotification('info', `מזהה מחדש עם רמת הפרדה ${separationLevel}...`);
 
     try {
-        const res = await fetch(`${API_BASE}/redetect`, {
+        const res = await runJob(`${API_BASE}/redetect`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ separation_level: separationLevel })
@@ -879,10 +1102,11 @@ async function redetectFromReview() {
         if (!res.ok) throw new Error(data.error || 'Re-detection failed');
 
         appState.detectedLetters = data.detections;
-        appState.assignments = {};
+        const lost = remapAssignments(data.id_map || {});
         appState.refHeight = computeRefHeight();
         drawReviewCanvas();
-        showNotification('success', `זוהו ${data.count} צורות`);
+        showNotification('success', `זוהו ${data.count} צורות` +
+            (lost ? ` — ${lost} שיוכים לא נשמרו` : ''));
     } catch (err) {
         showNotification('error', `שגיאה: ${err.message}`);
     }
@@ -1155,35 +1379,10 @@ async function importProject(inputEl) {
         const data = await res.json();
         if (!res.ok) throw new Error(data.error || 'Import failed');
 
-        // Restore application state
-        appState.detectedLetters = data.detections;
-        appState.assignments = data.assignments || {};
-        appState.adjustments = data.adjustments || {};
-        appState.imageInfo = data.image_info;
-        appState.refHeight = computeRefHeight();
-
-        // Set font name
-        const fontNameInput = document.getElementById('font-name');
-        if (data.font_name) {
-            fontNameInput.value = data.font_name;
-            appState.fontName = data.font_name;
-        }
-
-        // Restore metadata fields
-        setFontMetadata(data.metadata);
-
-        showNotification('success', `הפרויקט נטען! ${data.count} זיהויים, ${Object.keys(appState.assignments).length} שיוכים`);
-
-        // Decide which step to go to based on what was restored
-        if (Object.keys(appState.assignments).length > 0) {
-            // Has assignments — go straight to preview
-            goToStep(3);
-            renderPreview();
-        } else {
-            // No assignments yet — go to detection review
-            goToStep(2);
-            showDetectionReview();
-        }
+        applyProjectState(data);
+        const unmatched = (data.unmatched_assignments || []).length;
+        showNotification('success', `הפרויקט נטען! ${data.count} זיהויים, ${Object.keys(appState.assignments).length} שיוכים` +
+            (unmatched ? ` — ${unmatched} שיוכים לא נשמרו` : ''));
     } catch (err) {
         showNotification('error', `שגיאה בטעינת פרויקט: ${err.message}`);
     }
@@ -1191,3 +1390,34 @@ async function importProject(inputEl) {
     // Clear the input so the same file can be re-imported
     inputEl.value = '';
 }
+
+// Load an imported / restored project into the UI
+function applyProjectState(data) {
+    // Restore application state
+    appState.detectedLetters = data.detections;
+    appState.assignments = data.assignments || {};
+    appState.adjustments = data.adjustments || {};
+    appState.imageInfo = data.image_info;
+    appState.refHeight = computeRefHeight();
+
+    // Set font name
+    const fontNameInput = document.getElementById('font-name');
+    if (data.font_name) {
+        fontNameInput.value = data.font_name;
+        appState.fontName = data.font_name;
+    }
+
+    // Restore metadata fields
+    setFontMetadata(data.metadata);
+
+    // Decide which step to go to based on what was restored
+    if (Object.keys(appState.assignments).length > 0) {
+        // Has assignments — go straight to preview
+        goToStep(3);
+        renderPreview();
+    } else {
+        // No assignments yet — go to detection review
+        goToStep(2);
+        showDetectionReview();
+    }
+}